@@ -0,0 +1,129 @@
+import math, threading, time
+from collections import deque
+from typing import Any, Callable, Dict, Optional
+
+
+class CircuitBreaker:
+    """Corta las llamadas a un servicio que viene fallando.
+
+    `closed`: todo pasa; `failure_threshold` fallos seguidos lo abren. `open`: se
+    rechaza todo durante `cooldown` segundos. `half_open`: pasa una única llamada de
+    prueba; si sale bien se cierra y si falla se vuelve a abrir. Con `failure_threshold`
+    0 nunca se abre. Segura entre hilos.
+    """
+
+    CLOSED, OPEN, HALF_OPEN = "closed", "open", "half_open"
+
+    def __init__(self, failure_threshold: int, cooldown: float, clock: Callable[[], float] = time.monotonic):
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._state = self.CLOSED
+        self._failures = 0
+        self._opened_at = 0.0
+        self._probing = False
+        self.trips = self.rejected = 0
+
+    def _current(self) -> str:
+        if self._state == self.OPEN and self._clock() - self._opened_at >= self.cooldown:
+            self._state = self.HALF_OPEN
+            self._probing = False
+        return self._state
+
+    @property
+    def state(self) -> str:
+        with self._lock:
+            return self._current()
+
+    def admit(self) -> Optional[str]:
+        """Estado con el que sale la llamada (`closed`, o `half_open` si es el sondeo), o None si se rechaza."""
+        with self._lock:
+            state = self._current()
+            if state == self.CLOSED:
+                return state
+            if state == self.HALF_OPEN and not self._probing:
+                self._probing = True
+                return state
+            self.rejected += 1
+            return None
+
+    def allow(self) -> bool:
+        """True si la llamada puede salir; en `half_open` solo la primera (el sondeo)."""
+        return self.admit() is not None
+
+    def record_success(self) -> None:
+        with self._lock:
+            self._state = self.CLOSED
+            self._failures = 0
+            self._probing = False
+
+    def record_failure(self) -> None:
+        with self._lock:
+            self._failures += 1
+            state = self._current()
+            if self.failure_threshold <= 0 or state == self.OPEN:
+                return
+            if state == self.HALF_OPEN or self._failures >= self.failure_threshold:
+                self._state = self.OPEN
+                self._opened_at = self._clock()
+                self._probing = False
+                self.trips += 1
+
+    def release(self) -> None:
+        """La llamada permitida no terminó: libera el sondeo sin contar éxito ni fallo."""
+        with self._lock:
+            self._probing = False
+
+    def reset(self) -> None:
+        with self._lock:
+            self._state = self.CLOSED
+            self._failures = 0
+            self._probing = False
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "state": self._current(),
+                "consecutive_failures": self._failures,
+                "failure_threshold": self.failure_threshold,
+                "cooldown_sec": self.cooldown,
+                "trips": self.trips,
+                "rejected": self.rejected,
+            }
+
+
+class LatencyWindow:
+    """Últimas `size` latencias observadas (segundos), para derivar timeouts de sus percentiles.
+
+    Hasta juntar `min_samples` los percentiles son None: con pocos datos no se adapta nada.
+    """
+
+    def __init__(self, size: int, min_samples: int):
+        self.min_samples = min_samples
+        self._samples: deque = deque(maxlen=size)
+        self._lock = threading.Lock()
+
+    def add(self, seconds: float) -> None:
+        with self._lock:
+            self._samples.append(seconds)
+
+    def percentile(self, q: float) -> Optional[float]:
+        with self._lock:
+            samples = sorted(self._samples)
+        if not samples or len(samples) < self.min_samples:
+            return None
+        # rango más cercano: el valor que deja al menos q% de las muestras por debajo o igual
+        rank = max(1, math.ceil(q / 100 * len(samples)))
+        return samples[min(rank, len(samples)) - 1]
+
+    def clear(self) -> None:
+        with self._lock:
+            self._samples.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "samples": len(self._samples),
+            "p50_sec": self.percentile(50),
+            "p99_sec": self.percentile(99),
+        }
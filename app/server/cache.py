@@ -0,0 +1,237 @@
+import hashlib, json, logging, sqlite3, threading, time
+from collections import OrderedDict
+from pathlib import Path
+from typing import Any, Callable, Dict, Hashable, Optional
+
+logger = logging.getLogger(__name__)
+
+
+def _canonical(value: Any) -> Any:
+    # Listas ordenadas (los filtros son conjuntos) y dicts con claves ordenadas al serializar
+    if isinstance(value, dict):
+        return {str(k): _canonical(v) for k, v in value.items()}
+    if isinstance(value, (list, tuple, set, frozenset)):
+        items = [_canonical(v) for v in value]
+        return sorted(items, key=lambda v: json.dumps(v, sort_keys=True, ensure_ascii=False))
+    return value
+
+
+def canonical_hash(value: Any) -> str:
+    """Hash estable de una estructura JSON, indiferente al orden de listas y claves."""
+    data = json.dumps(_canonical(value), sort_keys=True, ensure_ascii=False, separators=(",", ":"))
+    return hashlib.blake2b(data.encode("utf-8"), digest_size=16).hexdigest()
+
+
+class LRUCache:
+    """Caché acotada por cantidad de entradas (LRU) y por antigüedad (TTL).
+
+    Segura entre hilos. Con `maxsize` 0 no guarda nada; con `ttl` 0 las entradas
+    no vencen. Cuenta aciertos, fallos y desalojos para `stats`.
+    """
+
+    def __init__(self, maxsize: int, ttl: float, clock: Callable[[], float] = time.monotonic):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._clock = clock
+        self._data: "OrderedDict[Hashable, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = self.misses = self.evictions = 0
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is not None and self.ttl and self._clock() - entry[0] > self.ttl:
+                del self._data[key]
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return default
+            self._data.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def put(self, key: Hashable, value: Any) -> None:
+        if self.maxsize <= 0:
+            return
+        with self._lock:
+            self._data[key] = (self._clock(), value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses
+        return {
+            "size": len(self._data),
+            "maxsize": self.maxsize,
+            "ttl_sec": self.ttl,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else None,
+        }
+
+
+class SQLiteCache:
+    """Caché persistente clave -> texto en un archivo SQLite.
+
+    Sobrevive reinicios y la comparten todos los workers que apunten al mismo
+    archivo (modo WAL). Las entradas vencen por `ttl` y, pasado `max_entries`,
+    se desalojan las usadas hace más tiempo. Un error de SQLite nunca corta la
+    request: se registra y se sigue como si no hubiera caché.
+
+    Cada hilo reutiliza su conexión. Los hits no escriben: el último acceso se
+    acumula en memoria y se vuelca en la próxima escritura o cada
+    `access_flush_every` hits, así leer no toma el lock de escritura del archivo.
+    """
+
+    _SCHEMA = """
+        CREATE TABLE IF NOT EXISTS entries (
+            key TEXT PRIMARY KEY,
+            value TEXT NOT NULL,
+            created REAL NOT NULL,
+            accessed REAL NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS entries_accessed ON entries (accessed);
+    """
+
+    def __init__(
+        self, path: Path, ttl: float, max_entries: int, clock: Callable[[], float] = time.time,
+        access_flush_every: int = 64,
+    ):
+        self.path = Path(path)
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.access_flush_every = access_flush_every
+        self._clock = clock
+        self._ready = False
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._accessed: Dict[str, float] = {}  # accesos pendientes de volcar
+        self.hits = self.misses = 0
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is not None:
+            return conn
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+        with self._lock:
+            if not self._ready:
+                conn.execute("PRAGMA journal_mode=WAL")
+                conn.executescript(self._SCHEMA)
+                self._ready = True
+        self._local.conn = conn
+        return conn
+
+    def _discard(self) -> None:
+        # tras un error se abre una conexión nueva en el próximo uso
+        conn = getattr(self._local, "conn", None)
+        self._local.conn = None
+        if conn is not None:
+            conn.close()
+
+    def _cutoff(self, now: float) -> float:
+        # con ttl 0 las entradas no vencen (igual que LRUCache)
+        return now - self.ttl if self.ttl > 0 else float("-inf")
+
+    def _take_accessed(self) -> Dict[str, float]:
+        with self._lock:
+            pending, self._accessed = self._accessed, {}
+        return pending
+
+    def _write_accessed(self, conn: sqlite3.Connection, pending: Dict[str, float]) -> None:
+        if pending:
+            conn.executemany(
+                "UPDATE entries SET accessed = MAX(accessed, ?) WHERE key = ?",
+                [(when, key) for key, when in pending.items()],
+            )
+
+    def flush(self) -> None:
+        """Vuelca los accesos pendientes al archivo."""
+        pending = self._take_accessed()
+        if not pending:
+            return
+        try:
+            conn = self._connect()
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                self._write_accessed(conn, pending)
+                conn.execute("COMMIT")
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+        except sqlite3.Error:
+            self._discard()
+            logger.warning("No se pudo escribir en la caché %s", self.path, exc_info=True)
+
+    def get(self, key: str) -> Optional[str]:
+        now = self._clock()
+        try:
+            row = self._connect().execute(
+                "SELECT value FROM entries WHERE key = ? AND created >= ?", (key, self._cutoff(now))
+            ).fetchone()
+        except sqlite3.Error:
+            self._discard()
+            logger.warning("Caché %s no disponible", self.path, exc_info=True)
+            row = None
+        if row is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        with self._lock:
+            self._accessed[key] = now
+            full = len(self._accessed) >= self.access_flush_every
+        if full:
+            self.flush()
+        return row[0]
+
+    def put(self, key: str, value: str) -> None:
+        now = self._clock()
+        pending = self._take_accessed()
+        try:
+            conn = self._connect()
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                # los accesos pendientes cuentan para elegir qué desalojar
+                self._write_accessed(conn, pending)
+                conn.execute(
+                    "INSERT OR REPLACE INTO entries (key, value, created, accessed) VALUES (?, ?, ?, ?)",
+                    (key, value, now, now),
+                )
+                conn.execute("DELETE FROM entries WHERE created < ?", (self._cutoff(now),))
+                conn.execute(
+                    "DELETE FROM entries WHERE key IN ("
+                    " SELECT key FROM entries ORDER BY accessed DESC LIMIT -1 OFFSET ?)",
+                    (self.max_entries,),
+                )
+                conn.execute("COMMIT")
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+        except sqlite3.Error:
+            self._discard()
+            logger.warning("No se pudo escribir en la caché %s", self.path, exc_info=True)
+
+    def stats(self) -> Dict[str, Any]:
+        try:
+            size = self._connect().execute("SELECT COUNT(*) FROM entries").fetchone()[0]
+        except sqlite3.Error:
+            self._discard()
+            size = None
+        return {
+            "path": str(self.path),
+            "size": size,
+            "max_entries": self.max_entries,
+            "ttl_sec": self.ttl,
+            "hits": self.hits,
+            "misses": self.misses,
+        }
@@ -0,0 +1,261 @@
+import bisect, gzip, hashlib, json, os
+from pathlib import Path
+from typing import TYPE_CHECKING, Any, Dict, List, Optional, Tuple
+
+if TYPE_CHECKING:
+    from .columnar import ColumnarCatalog, DishRecord
+
+try:  # brotli es opcional: sin el paquete solo se sirve gzip
+    import brotli
+except ImportError:  # pragma: no cover - depende del entorno
+    brotli = None
+
+DATA_DIR = Path(__file__).resolve().parent.parent / "data"
+CATALOG_PATH = DATA_DIR / "catalog.json"
+# Versión compilada por `python -m server.columnar` (ver columnar.py)
+COLUMNAR_PATH = DATA_DIR / "catalog.columns"
+DICT_DIR = DATA_DIR / "dictionaries"
+# Deltas de PATCH /catalog/items pendientes de volcar a catalog.json (ver snapshot.py)
+DELTA_LOG_PATH = Path(os.getenv("CATALOG_DELTA_LOG", str(DATA_DIR / "catalog.deltas.jsonl")))
+DICTIONARY_FILES = {
+    "categories": "categories.json",
+    "ingredients": "ingredients.json",
+    "diets": "diets.json",
+    "allergens": "allergens.json",
+    "health": "health.json",
+    "intents": "intents.json",
+}
+
+
+class CatalogError(ValueError):
+    """Catálogo con formato inválido."""
+
+
+REQUIRED_FIELDS = ("id", "dish_name", "description", "categories", "ingredients", "allergens", "diet_flags", "price_ars", "restaurant")
+REQUIRED_RESTAURANT_FIELDS = ("name", "neighborhood", "cuisines", "rating", "eta_min")
+
+ROMANTIC_CATEGORIES = {"pasta", "sushi", "parrilla", "wok", "postres"}
+FRIENDS_CATEGORIES = {"pizza", "hamburguesas", "tacos", "sandwiches", "empanadas"}
+FAMILY_CATEGORIES = {"parrilla", "pasta", "sopas", "bowls"}
+HEALTH_CATEGORIES = {"ensaladas", "bowls", "wok"}
+
+
+def _norm_str(t: str) -> str:
+    return (t or "").lower()\
+        .replace("á","a").replace("é","e").replace("í","i")\
+        .replace("ó","o").replace("ú","u").replace("ñ","n")
+
+
+def validate_catalog(data: Any) -> List[Dict[str, Any]]:
+    if not isinstance(data, list):
+        raise CatalogError("El catálogo debe ser una lista de platos.")
+    for pos, dish in enumerate(data):
+        if not isinstance(dish, dict):
+            raise CatalogError(f"Plato #{pos} no es un objeto.")
+        missing = [f for f in REQUIRED_FIELDS if f not in dish]
+        if missing:
+            raise CatalogError(f"Plato {dish.get('id', f'#{pos}')} sin campos requeridos: {missing}")
+        restaurant = dish["restaurant"]
+        if not isinstance(restaurant, dict):
+            raise CatalogError(f"Plato {dish['id']}: 'restaurant' debe ser un objeto.")
+        missing = [f for f in REQUIRED_RESTAURANT_FIELDS if f not in restaurant]
+        if missing:
+            raise CatalogError(f"Plato {dish['id']}: restaurante sin campos requeridos: {missing}")
+        for value, label in ((dish["price_ars"], "price_ars"), (restaurant["rating"], "rating"), (restaurant["eta_min"], "eta_min")):
+            if not isinstance(value, (int, float)) or isinstance(value, bool):
+                raise CatalogError(f"Plato {dish['id']}: '{label}' debe ser numérico.")
+    return data
+
+
+def load_catalog(path: Optional[Path] = None) -> List[Dict[str, Any]]:
+    """Lee y valida el catálogo. Si el archivo no existe devuelve una lista vacía."""
+    path = path or CATALOG_PATH
+    try:
+        raw = path.read_text(encoding="utf-8")
+    except FileNotFoundError:
+        return []
+    return validate_catalog(json.loads(raw))
+
+
+def write_catalog(items: List[Dict[str, Any]], path: Optional[Path] = None) -> None:
+    """Reescribe el catálogo en el mismo formato del archivo, de forma atómica (temporal + rename)."""
+    path = path or CATALOG_PATH
+    tmp = path.with_name(f"{path.name}.{os.getpid()}.tmp")
+    tmp.write_text(json.dumps(items, ensure_ascii=False), encoding="utf-8")
+    tmp.replace(path)
+
+
+def file_signature(path: Path) -> Optional[Tuple[int, int]]:
+    """(tamaño, mtime_ns) del archivo, o None si no existe."""
+    try:
+        stat = path.stat()
+    except FileNotFoundError:
+        return None
+    return (stat.st_size, stat.st_mtime_ns)
+
+
+def load_dictionaries(dict_dir: Optional[Path] = None) -> Dict[str, Any]:
+    dict_dir = dict_dir or DICT_DIR
+    return {
+        name: json.loads((dict_dir / filename).read_text(encoding="utf-8"))
+        for name, filename in DICTIONARY_FILES.items()
+    }
+
+
+def source_signature() -> Tuple[Tuple[str, Optional[int]], ...]:
+    """(ruta, mtime_ns) de cada archivo de datos; cambia cuando se edita alguno."""
+    paths = [CATALOG_PATH, COLUMNAR_PATH] + [DICT_DIR / filename for filename in DICTIONARY_FILES.values()]
+    signature = []
+    for path in paths:
+        try:
+            signature.append((str(path), path.stat().st_mtime_ns))
+        except FileNotFoundError:
+            signature.append((str(path), None))
+    return tuple(signature)
+
+
+def base_intent_tags(dish: Dict[str, Any]) -> List[str]:
+    """Tags de intención que trae el archivo, antes de agregar los derivados."""
+    return list(dish.get("intent_tags") or dish.get("experience_tags") or [])
+
+
+def dish_intent_tags(dish: Dict[str, Any], base: List[str]) -> List[str]:
+    tags = set(base)
+    tags.add("delivery_dining")
+    categories = {c.lower() for c in dish.get("categories", [])}
+    cuisine = _norm_str(dish.get("restaurant", {}).get("cuisines", ""))
+    rating = dish.get("restaurant", {}).get("rating", 0)
+    price = dish.get("price_ars", 0)
+    eta = dish.get("restaurant", {}).get("eta_min", 60)
+    health_tags = set(_norm_str(t) for t in dish.get("health_tags", []))
+
+    if rating >= 4.4 and (categories & ROMANTIC_CATEGORIES or cuisine in {"italiana", "sushi", "parrilla"}):
+        tags.update({"romantic_evening", "date_night"})
+    if categories & FRIENDS_CATEGORIES:
+        tags.update({"friends_gathering", "movie_night"})
+    if categories & FAMILY_CATEGORIES:
+        tags.add("family_sharing")
+    if categories & HEALTH_CATEGORIES or health_tags & {"no_fry", "low_sodium"}:
+        tags.add("healthy_choice")
+    if price <= 6000:
+        tags.add("budget_friendly")
+    if eta <= 25:
+        tags.update({"express_delivery", "quick_lunch"})
+    if rating >= 4.7:
+        tags.add("top_rated")
+    if "postres" in categories:
+        tags.add("sweet_treat")
+    return sorted(tags)
+
+
+def augment_catalog_intents(items: List[Dict[str, Any]]) -> None:
+    for dish in items:
+        dish["intent_tags"] = dish_intent_tags(dish, base_intent_tags(dish))
+
+
+def get_restaurant_names(catalog: "ColumnarCatalog") -> List[str]:
+    return sorted(set(catalog.strings("restaurant.name")))
+
+
+def build_metrics(catalog: "ColumnarCatalog") -> Dict[str, List[Any]]:
+    """Distribuciones ordenadas de precio, ETA y rating (percentiles del parser)."""
+    prices = sorted(catalog.column("price_ars").tolist())
+    etas = sorted(catalog.column("restaurant.eta_min").tolist())
+    ratings = sorted(catalog.column("restaurant.rating").tolist())
+    return {"prices": prices, "etas": etas, "ratings": ratings}
+
+
+def build_indexes(catalog: "ColumnarCatalog", metrics: Dict[str, List[Any]]) -> Dict[str, Any]:
+    """Límites de normalización del scoring (min/max por campo)."""
+    if not len(catalog):
+        return {}
+    etas = metrics["etas"]
+    ratings = metrics["ratings"]
+    fees = catalog.column("delivery_fee", default=0)
+    discounts = catalog.column("discount_pct", default=0)
+    return {
+        "price_min": metrics["prices"][0], "price_max": metrics["prices"][-1],
+        "eta_min": etas[0], "eta_max": etas[-1],
+        "rating_min": ratings[0], "rating_max": ratings[-1],
+        "fee_min": fees.min().item(), "fee_max": fees.max().item(),
+        "discount_min": discounts.min().item(), "discount_max": discounts.max().item(),
+        # misma lista que metrics["prices"]: se comparte en lugar de duplicarla
+        "prices_sorted": metrics["prices"],
+    }
+
+
+def _replace_sorted(values: List[Any], old: Any, new: Any) -> List[Any]:
+    out = list(values)
+    del out[bisect.bisect_left(out, old)]
+    bisect.insort(out, new)
+    return out
+
+
+def update_metrics(
+    metrics: Dict[str, List[Any]], changes: List[Tuple["DishRecord", "DishRecord"]]
+) -> Dict[str, List[Any]]:
+    """Distribuciones con los cambios (plato viejo, plato nuevo) aplicados sin reordenar todo."""
+    prices, etas = metrics["prices"], metrics["etas"]
+    for old, new in changes:
+        if old.price_ars != new.price_ars:
+            prices = _replace_sorted(prices, old.price_ars, new.price_ars)
+        if old.eta_min != new.eta_min:
+            etas = _replace_sorted(etas, old.eta_min, new.eta_min)
+    return {"prices": prices, "etas": etas, "ratings": metrics["ratings"]}
+
+
+def update_indexes(
+    idx: Dict[str, Any],
+    catalog: "ColumnarCatalog",
+    metrics: Dict[str, List[Any]],
+    changes: List[Tuple["DishRecord", "DishRecord"]],
+) -> Dict[str, Any]:
+    """Límites de normalización tras aplicar `changes` sobre `catalog` (ya actualizado).
+
+    Precio y ETA salen de las distribuciones ordenadas; el descuento solo se
+    recorre completo si se modificó un plato que definía el mínimo o el máximo.
+    """
+    if not len(catalog):
+        return {}
+    out = dict(idx)
+    out.update({
+        "price_min": metrics["prices"][0], "price_max": metrics["prices"][-1],
+        "eta_min": metrics["etas"][0], "eta_max": metrics["etas"][-1],
+        "prices_sorted": metrics["prices"],
+    })
+    for old, new in changes:
+        before, after = old.discount_pct, new.discount_pct
+        if before == after:
+            continue
+        if before in (out["discount_min"], out["discount_max"]):
+            discounts = catalog.column("discount_pct", default=0)
+            out["discount_min"], out["discount_max"] = discounts.min().item(), discounts.max().item()
+            break
+        out["discount_min"] = min(out["discount_min"], after)
+        out["discount_max"] = max(out["discount_max"], after)
+    return out
+
+
+# sufijo del ETag de cada codificación: cada representación tiene su propio validador fuerte
+ETAG_SUFFIXES = {"gzip": "-gz", "br": "-br"}
+
+
+def build_payload(items: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """Respuesta de /catalog serializada y comprimida una sola vez, con un ETag fuerte por codificación."""
+    # mismo formato compacto que JSONResponse de FastAPI
+    body = json.dumps(
+        {"count": len(items), "items": items},
+        ensure_ascii=False, allow_nan=False, separators=(",", ":"),
+    ).encode("utf-8")
+    encoded = {"gzip": gzip.compress(body, compresslevel=9, mtime=0)}
+    if brotli is not None:
+        encoded["br"] = brotli.compress(body)
+    digest = hashlib.sha256(body).hexdigest()[:32]
+    etags = {"identity": f'"{digest}"'}
+    etags.update({coding: f'"{digest}{ETAG_SUFFIXES[coding]}"' for coding in encoded})
+    return {
+        "body": body,
+        "encoded": encoded,
+        "etags": etags,
+    }
+
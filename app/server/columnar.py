@@ -0,0 +1,546 @@
+"""Formato binario columnar del catálogo.
+
+Un único archivo con un header JSON y secciones NumPy alineadas a 64 bytes:
+columnas numéricas de ancho fijo, una tabla de strings internados (cada valor
+distinto se guarda una vez) y listas como pares offsets/valores. Al cargarlo con
+`load` las secciones se mapean en memoria: varios workers comparten las mismas
+páginas a través del page cache del sistema operativo. Solo esas columnas: la
+tabla de strings decodificada y los índices derivados (léxico, BM25, filtros,
+scorer) se arman en el heap de cada worker.
+
+    PYTHONPATH=app python -m server.columnar   # compila app/data/catalog.json
+"""
+import json, mmap, sys
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from . import catalog as catalog_store
+
+MAGIC = b"FSCOLS01"
+ALIGN = 64
+ITER_BATCH = 1024  # platos materializados por tanda al iterar
+_MISSING = object()
+
+
+def _kind(values: List[Any]) -> str:
+    if all(isinstance(v, str) for v in values):
+        return "str"
+    if all(isinstance(v, bool) for v in values):
+        return "bool"
+    if all(isinstance(v, int) and not isinstance(v, bool) for v in values):
+        return "int"
+    if all(isinstance(v, (int, float)) and not isinstance(v, bool) for v in values):
+        return "float"
+    if all(isinstance(v, list) and all(isinstance(x, str) for x in v) for v in values):
+        return "list"
+    if all(isinstance(v, dict) and all(isinstance(x, bool) for x in v.values()) for v in values):
+        return "flags"
+    return "json"
+
+
+NUMERIC_DTYPES = {"bool": np.uint8, "int": np.int64, "float": np.float64}
+
+
+class _StringTable:
+    def __init__(self):
+        self.ids: Dict[str, int] = {}
+
+    def intern(self, value: str) -> int:
+        sid = self.ids.get(value)
+        if sid is None:
+            sid = self.ids[value] = len(self.ids)
+        return sid
+
+    def sections(self) -> Dict[str, np.ndarray]:
+        encoded = [s.encode("utf-8") for s in self.ids]
+        offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+        offsets[1:] = np.cumsum([len(b) for b in encoded])
+        data = np.frombuffer(b"".join(encoded), dtype=np.uint8)
+        return {"strings.offsets": offsets, "strings.data": data}
+
+
+def _field_sections(
+    name: str, kind: str, values: List[Any], table: _StringTable
+) -> Dict[str, np.ndarray]:
+    if kind == "str":
+        return {name: np.asarray([table.intern(v) for v in values], dtype=np.int32)}
+    if kind in NUMERIC_DTYPES:
+        return {name: np.asarray(values, dtype=NUMERIC_DTYPES[kind])}
+    if kind == "json":
+        return {name: np.asarray([table.intern(json.dumps(v, ensure_ascii=False)) for v in values], dtype=np.int32)}
+    offsets = np.zeros(len(values) + 1, dtype=np.int64)
+    offsets[1:] = np.cumsum([len(v) for v in values])
+    if kind == "list":
+        flat = [table.intern(x) for v in values for x in v]
+        return {f"{name}.offsets": offsets, f"{name}.values": np.asarray(flat, dtype=np.int32)}
+    keys = [table.intern(k) for v in values for k in v]
+    flags = [bool(x) for v in values for x in v.values()]
+    return {
+        f"{name}.offsets": offsets,
+        f"{name}.keys": np.asarray(keys, dtype=np.int32),
+        f"{name}.values": np.asarray(flags, dtype=np.uint8),
+    }
+
+
+def _placeholder(kind: str) -> Any:
+    return {"str": "", "list": [], "flags": {}, "json": None}.get(kind, 0)
+
+
+def compile_catalog(
+    items: List[Dict[str, Any]], aux_lists: Optional[Dict[str, List[List[str]]]] = None
+) -> Tuple[Dict[str, Any], Dict[str, np.ndarray]]:
+    """Header y secciones columnares de `items`.
+
+    El esquema se infiere de los datos. Los campos de texto del restaurante se
+    guardan una sola vez por restaurante (tabla `restaurants.*` más `restaurant.id`
+    por plato); sus campos numéricos quedan por plato para admitir deltas.
+    """
+    table = _StringTable()
+    sections: Dict[str, np.ndarray] = {}
+
+    def add_fields(prefix: str, rows: List[Dict[str, Any]], skip: Tuple[str, ...] = ()) -> List[Dict[str, Any]]:
+        out = []
+        names = list(dict.fromkeys(k for row in rows for k in row))
+        for name in names:
+            if name in skip:
+                out.append({"name": name, "kind": "struct"})
+                continue
+            present = [name in row for row in rows]
+            raw = [row[name] for row in rows if name in row]
+            kind = _kind(raw)
+            values = [row[name] if name in row else _placeholder(kind) for row in rows]
+            sections.update(_field_sections(prefix + name, kind, values, table))
+            field = {"name": name, "kind": kind}
+            if not all(present):
+                sections[prefix + name + ".present"] = np.asarray(present, dtype=np.uint8)
+                field["optional"] = True
+            out.append(field)
+        return out
+
+    fields = add_fields("", items, skip=("restaurant",))
+    restaurants = [d.get("restaurant") or {} for d in items]
+    string_keys = [k for k in dict.fromkeys(k for r in restaurants for k in r) if all(isinstance(r.get(k), str) for r in restaurants)]
+    ids: Dict[Tuple[str, ...], int] = {}
+    restaurant_ids = []
+    unique: List[Dict[str, Any]] = []
+    for r in restaurants:
+        key = tuple(r[k] for k in string_keys)
+        if key not in ids:
+            ids[key] = len(unique)
+            unique.append({k: r[k] for k in string_keys})
+        restaurant_ids.append(ids[key])
+    sections["restaurant.id"] = np.asarray(restaurant_ids, dtype=np.int32)
+    restaurant_fields = add_fields("restaurants.", unique)
+    numeric_rows = [{k: v for k, v in r.items() if k not in string_keys} for r in restaurants]
+    restaurant_fields += [dict(f, per_dish=True) for f in add_fields("restaurant.", numeric_rows)]
+    order = list(dict.fromkeys(k for r in restaurants for k in r))
+    restaurant_fields.sort(key=lambda f: order.index(f["name"]))
+
+    # listas auxiliares (p. ej. tags de intención originales): se guardan pero no son parte del plato
+    for name, values in (aux_lists or {}).items():
+        sections.update(_field_sections(name, "list", values, table))
+    sections.update(table.sections())
+    header = {
+        "count": len(items),
+        "restaurants": len(unique),
+        "fields": fields,
+        "restaurant_fields": restaurant_fields,
+        "aux_lists": sorted(aux_lists or {}),
+    }
+    return header, sections
+
+
+def _align(n: int) -> int:
+    return (n + ALIGN - 1) // ALIGN * ALIGN
+
+
+def write(path: Path, header: Dict[str, Any], sections: Dict[str, np.ndarray]) -> None:
+    """Escribe el archivo de forma atómica (temporal + rename)."""
+    layout = {}
+    offset = 0
+    for name, arr in sections.items():
+        arr = np.ascontiguousarray(arr)
+        layout[name] = {"dtype": arr.dtype.str, "shape": list(arr.shape), "offset": offset}
+        offset = _align(offset + arr.nbytes)
+    meta = json.dumps(dict(header, sections=layout), ensure_ascii=False).encode("utf-8")
+    base = _align(len(MAGIC) + 8 + len(meta))
+    tmp = path.with_name(path.name + ".tmp")
+    with open(tmp, "wb") as f:
+        f.write(MAGIC)
+        f.write(len(meta).to_bytes(8, "little"))
+        f.write(meta)
+        for name, arr in sections.items():
+            f.seek(base + layout[name]["offset"])
+            f.write(np.ascontiguousarray(arr).tobytes())
+        f.truncate(base + offset)
+    tmp.replace(path)
+
+
+class RestaurantRecord:
+    """Textos de un restaurante: una sola instancia compartida por todos sus platos."""
+
+    __slots__ = ("id", "name", "neighborhood", "cuisines")
+
+    def __init__(self, rid: int, name: str, neighborhood: str, cuisines: str):
+        self.id = rid
+        self.name = name
+        self.neighborhood = neighborhood
+        self.cuisines = cuisines
+
+
+class DishRecord:
+    """Plato con atributos fijos para filtros y scoring.
+
+    Listas de tags como tuplas de strings internados, dietas como el conjunto de
+    flags activos; rating y ETA son por plato porque los deltas pueden cambiarlos.
+    Los opcionales ausentes quedan en su default (`delivery_fee` y
+    `delivery_eta_min` en None).
+    """
+
+    __slots__ = (
+        "pos", "id", "dish_name", "description", "categories", "synonyms", "ingredients",
+        "allergens", "diets", "health_tags", "experience_tags", "intent_tags", "meal_moments",
+        "price_ars", "popularity", "available", "discount_pct", "delivery_fee", "delivery_eta_min",
+        "restaurant", "rating", "eta_min",
+    )
+
+    def __init__(self, **fields: Any):
+        for name, value in fields.items():
+            setattr(self, name, value)
+
+
+# atributo del registro -> (campo del catálogo, default si el plato no lo trae)
+RECORD_TAGS = ("categories", "synonyms", "ingredients", "allergens", "health_tags", "experience_tags", "intent_tags", "meal_moments")
+RECORD_NUMBERS = {
+    "price_ars": ("price_ars", None),
+    "popularity": ("popularity", 0),
+    "available": ("available", True),
+    "discount_pct": ("discount_pct", 0),
+    "delivery_fee": ("delivery_fee", None),
+    "delivery_eta_min": ("delivery_eta_min", None),
+    "rating": ("restaurant.rating", None),
+    "eta_min": ("restaurant.eta_min", None),
+}
+
+
+class ColumnarCatalog(Sequence):
+    """Catálogo en columnas. Indexarlo devuelve el plato como dict (solo para la API);
+    los índices se construyen leyendo columnas con `column`, `strings` y `lists`, y
+    el código que evalúa plato por plato usa los registros de `records`."""
+
+    def __init__(self, header: Dict[str, Any], sections: Dict[str, np.ndarray], buffer: Any = None):
+        self.header = header
+        self.sections = sections
+        self._buffer = buffer  # mmap que respalda las secciones (si vino de archivo)
+        self._size = header["count"]
+        self._table: Optional[List[str]] = None
+        self._overrides: Dict[int, Dict[str, Any]] = {}
+        self._records: Optional[List[DishRecord]] = None
+
+    # --- acceso por columnas
+
+    @property
+    def table(self) -> List[str]:
+        # Tabla de strings decodificada una vez por proceso
+        if self._table is None:
+            offsets = self.sections["strings.offsets"].tolist()
+            data = self.sections["strings.data"].tobytes()
+            self._table = [sys.intern(data[offsets[i]:offsets[i + 1]].decode("utf-8")) for i in range(len(offsets) - 1)]
+        return self._table
+
+    def _section_name(self, field: str) -> str:
+        # "restaurant.name" -> tabla de restaurantes; "restaurant.rating" -> columna por plato
+        if field.startswith("restaurant.") and field not in self.sections and f"{field}.offsets" not in self.sections:
+            return "restaurants." + field[len("restaurant."):]
+        return field
+
+    def _by_restaurant(self, name: str, values: np.ndarray) -> np.ndarray:
+        if name.startswith("restaurants."):
+            return values[self.sections["restaurant.id"]]
+        return values
+
+    def column(self, field: str, default: Any = None) -> np.ndarray:
+        """Columna numérica alineada por posición (vista del archivo si no hubo deltas).
+
+        En campos opcionales, `default` reemplaza a los platos que no lo traen.
+        """
+        name = self._section_name(field)
+        if name not in self.sections and default is not None:
+            return np.full(self._size, default)
+        values = self._by_restaurant(name, self.sections[name])
+        present = self.sections.get(name + ".present")
+        if default is not None and present is not None:
+            values = np.where(self._by_restaurant(name, present).astype(bool), values, default)
+        overridden = [(pos, fields[field]) for pos, fields in self._overrides.items() if field in fields]
+        if overridden:
+            values = values.copy()
+            for pos, value in overridden:
+                values[pos] = value
+        return values
+
+    def values(self, field: str, default: Any = None) -> List[Any]:
+        """Columna numérica como valores Python; `default` donde el plato no trae el campo."""
+        name = self._section_name(field)
+        if name not in self.sections:
+            return [default] * self._size
+        out = self._by_restaurant(name, self.sections[name]).tolist()
+        present = self.sections.get(name + ".present")
+        if present is not None:
+            out = [v if p else default for v, p in zip(out, self._by_restaurant(name, present).tolist())]
+        for pos, fields in self._overrides.items():
+            if field in fields:
+                out[pos] = fields[field]
+        return out
+
+    def strings(self, field: str) -> List[str]:
+        name = self._section_name(field)
+        table = self.table
+        out = [table[i] for i in self._by_restaurant(name, self.sections[name]).tolist()]
+        for pos, fields in self._overrides.items():
+            if field in fields:
+                out[pos] = fields[field]
+        return out
+
+    def lists(self, field: str) -> List[List[str]]:
+        """Listas por plato; vacías si el plato (o todo el catálogo) no trae el campo."""
+        if f"{field}.offsets" not in self.sections:
+            return [[] for _ in range(self._size)]
+        table = self.table
+        offsets = self.sections[f"{field}.offsets"].tolist()
+        values = [table[i] for i in self.sections[f"{field}.values"].tolist()]
+        out = [values[offsets[i]:offsets[i + 1]] for i in range(self._size)]
+        for pos, fields in self._overrides.items():
+            if field in fields:
+                out[pos] = list(fields[field])
+        return out
+
+    def flags(self, field: str) -> List[Dict[str, bool]]:
+        table = self.table
+        offsets = self.sections[f"{field}.offsets"].tolist()
+        keys = [table[i] for i in self.sections[f"{field}.keys"].tolist()]
+        values = [bool(v) for v in self.sections[f"{field}.values"].tolist()]
+        return [dict(zip(keys[offsets[i]:offsets[i + 1]], values[offsets[i]:offsets[i + 1]])) for i in range(self._size)]
+
+    # --- registros compactos (filtros y scoring plato por plato)
+
+    def _restaurant_records(self) -> List[RestaurantRecord]:
+        table = self.table
+        columns = [[table[i] for i in self.sections[f"restaurants.{f}"].tolist()] for f in ("name", "neighborhood", "cuisines")]
+        return [RestaurantRecord(rid, *fields) for rid, fields in enumerate(zip(*columns))]
+
+    def records(self) -> List[DishRecord]:
+        """Un `DishRecord` por posición, armado una vez por versión del catálogo."""
+        if self._records is None:
+            restaurants = self._restaurant_records()
+            rids = self.sections["restaurant.id"].tolist()
+            columns = {
+                "id": self.strings("id"),
+                "dish_name": self.strings("dish_name"),
+                "description": self.strings("description"),
+                "diets": [frozenset(k for k, on in flags.items() if on) for flags in self.flags("diet_flags")],
+            }
+            for attr in RECORD_TAGS:
+                columns[attr] = [tuple(values) for values in self.lists(attr)]
+            for attr, (field, default) in RECORD_NUMBERS.items():
+                columns[attr] = self.values(field, default)
+            columns["available"] = [bool(v) for v in columns["available"]]
+            names = list(columns)
+            self._records = [
+                DishRecord(pos=pos, restaurant=restaurants[rids[pos]], **dict(zip(names, row)))
+                for pos, row in enumerate(zip(*columns.values()))
+            ]
+        return self._records
+
+    def record(self, pos: int) -> DishRecord:
+        """Registro de una posición; sin `records` armados se lee solo esa fila."""
+        if self._records is not None:
+            return self._records[pos]
+        rid = int(self.sections["restaurant.id"][pos])
+        table = self.table
+        restaurant = RestaurantRecord(rid, *(table[self.sections[f"restaurants.{f}"][rid]] for f in ("name", "neighborhood", "cuisines")))
+        return self._record_from_dish(pos, restaurant)
+
+    def _record_from_dish(self, pos: int, restaurant: RestaurantRecord) -> DishRecord:
+        d = self.dish(pos)
+        fields = {attr: tuple(sys.intern(t) for t in d.get(attr, [])) for attr in RECORD_TAGS}
+        for attr, (field, default) in RECORD_NUMBERS.items():
+            if field.startswith("restaurant."):
+                fields[attr] = d["restaurant"].get(field[len("restaurant."):], default)
+            else:
+                fields[attr] = d.get(field, default)
+        fields["available"] = bool(fields["available"])
+        return DishRecord(
+            pos=pos, id=d["id"], dish_name=d["dish_name"], description=d["description"],
+            diets=frozenset(k for k, on in d["diet_flags"].items() if on), restaurant=restaurant, **fields,
+        )
+
+    # --- plato como dict (frontera de la API)
+
+    def _values(self, prefix: str, field: Dict[str, Any], rows: np.ndarray) -> List[Any]:
+        # Valores de un campo para varias filas; _MISSING donde el plato no lo trae
+        name = prefix + field["name"]
+        kind = field["kind"]
+        table = self.table
+        if kind in ("str", "json"):
+            out = [table[i] for i in self.sections[name][rows].tolist()]
+            if kind == "json":
+                out = [json.loads(v) for v in out]
+        elif kind in NUMERIC_DTYPES:
+            out = self.sections[name][rows].tolist()
+            if kind == "bool":
+                out = [bool(v) for v in out]
+        else:
+            offsets = self.sections[f"{name}.offsets"]
+            bounds = zip(offsets[rows].tolist(), offsets[rows + 1].tolist())
+            if kind == "list":
+                values = self.sections[f"{name}.values"]
+                out = [[table[i] for i in values[start:end].tolist()] for start, end in bounds]
+            else:
+                keys, flags = self.sections[f"{name}.keys"], self.sections[f"{name}.values"]
+                out = [
+                    dict(zip((table[i] for i in keys[start:end].tolist()), (bool(v) for v in flags[start:end].tolist())))
+                    for start, end in bounds
+                ]
+        if field.get("optional"):
+            present = self.sections[f"{name}.present"][rows].tolist()
+            out = [v if p else _MISSING for v, p in zip(out, present)]
+        return out
+
+    def dishes(self, positions: Sequence[int]) -> List[Dict[str, Any]]:
+        """Platos como dicts, leyendo cada columna una sola vez para todas las posiciones."""
+        rows = np.asarray(positions, dtype=np.intp)
+        rids = self.sections["restaurant.id"][rows]
+        restaurants: List[Dict[str, Any]] = [{} for _ in range(len(rows))]
+        for field in self.header["restaurant_fields"]:
+            if field.get("per_dish"):
+                values = self._values("restaurant.", field, rows)
+            else:
+                values = self._values("restaurants.", field, rids)
+            for restaurant, value in zip(restaurants, values):
+                if value is not _MISSING:
+                    restaurant[field["name"]] = value
+        out: List[Dict[str, Any]] = [{} for _ in range(len(rows))]
+        for field in self.header["fields"]:
+            name = field["name"]
+            values = restaurants if field["kind"] == "struct" else self._values("", field, rows)
+            for dish, value in zip(out, values):
+                if value is not _MISSING:
+                    dish[name] = value
+        if self._overrides:
+            for pos, dish in zip(rows.tolist(), out):
+                for key, value in self._overrides.get(pos, {}).items():
+                    if key.startswith("restaurant."):
+                        dish["restaurant"][key[len("restaurant."):]] = value
+                    else:
+                        dish[key] = value
+        return out
+
+    def dish(self, pos: int) -> Dict[str, Any]:
+        return self.dishes([pos])[0]
+
+    def __len__(self) -> int:
+        return self._size
+
+    def __getitem__(self, pos):
+        if isinstance(pos, slice):
+            return self.dishes(range(*pos.indices(self._size)))
+        if pos < 0:
+            pos += self._size
+        if not 0 <= pos < self._size:
+            raise IndexError(pos)
+        return self.dish(pos)
+
+    def __iter__(self) -> Iterator[Dict[str, Any]]:
+        for start in range(0, self._size, ITER_BATCH):
+            yield from self.dishes(range(start, min(start + ITER_BATCH, self._size)))
+
+    @property
+    def overridden(self) -> int:
+        """Platos con valores superpuestos por deltas."""
+        return len(self._overrides)
+
+    def with_updates(self, updates: Dict[int, Dict[str, Any]]) -> "ColumnarCatalog":
+        """Copia que comparte las secciones y superpone valores nuevos por posición.
+
+        Las claves son nombres de campo ("price_ars", "intent_tags") o
+        "restaurant.<campo>" para los numéricos del restaurante.
+        """
+        new = ColumnarCatalog(self.header, self.sections, self._buffer)
+        new._table = self._table
+        new._overrides = {pos: dict(fields) for pos, fields in self._overrides.items()}
+        for pos, fields in updates.items():
+            new._overrides.setdefault(pos, {}).update(fields)
+        if self._records is not None:
+            # solo se rearman los registros tocados; el resto (y los restaurantes) se comparten
+            new._records = list(self._records)
+            for pos in updates:
+                new._records[pos] = new._record_from_dish(pos, self._records[pos].restaurant)
+        return new
+
+
+def from_items(items: List[Dict[str, Any]], aux_lists: Optional[Dict[str, List[List[str]]]] = None) -> ColumnarCatalog:
+    header, sections = compile_catalog(items, aux_lists)
+    return ColumnarCatalog(header, sections)
+
+
+def read_header(path: Path) -> Dict[str, Any]:
+    with open(path, "rb") as f:
+        if f.read(len(MAGIC)) != MAGIC:
+            raise catalog_store.CatalogError(f"{path} no es un catálogo columnar.")
+        size = int.from_bytes(f.read(8), "little")
+        return json.loads(f.read(size).decode("utf-8"))
+
+
+def load(path: Optional[Path] = None) -> ColumnarCatalog:
+    """Mapea el archivo en memoria (solo lectura) sin copiar las columnas."""
+    path = path or catalog_store.COLUMNAR_PATH
+    header = read_header(path)
+    with open(path, "rb") as f:
+        buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    size = int.from_bytes(buffer[len(MAGIC):len(MAGIC) + 8], "little")
+    base = _align(len(MAGIC) + 8 + size)
+    sections = {}
+    for name, spec in header.pop("sections").items():
+        dtype = np.dtype(spec["dtype"])
+        count = int(np.prod(spec["shape"]))
+        sections[name] = np.frombuffer(buffer, dtype=dtype, count=count, offset=base + spec["offset"]).reshape(spec["shape"])
+    return ColumnarCatalog(header, sections, buffer)
+
+
+def build(src: Optional[Path] = None, dest: Optional[Path] = None) -> Dict[str, Any]:
+    """Compila catalog.json (validado y con tags de intención derivados) al formato columnar."""
+    src = src or catalog_store.CATALOG_PATH
+    dest = dest or catalog_store.COLUMNAR_PATH
+    items = catalog_store.load_catalog(src)
+    base = [catalog_store.base_intent_tags(d) for d in items]
+    catalog_store.augment_catalog_intents(items)
+    header, sections = compile_catalog(items, {"base_intent_tags": base})
+    signature = catalog_store.file_signature(src)
+    header["source_signature"] = list(signature) if signature else None
+    write(dest, header, sections)
+    return header
+
+
+def load_for(src: Optional[Path] = None, path: Optional[Path] = None) -> Optional[ColumnarCatalog]:
+    """Versión columnar de `src` si existe y fue compilada desde ese mismo archivo.
+
+    Se compara el (tamaño, mtime) de `src` guardado en el header: no hace falta leer
+    el JSON para validar el archivo compilado.
+    """
+    src = src or catalog_store.CATALOG_PATH
+    path = path or catalog_store.COLUMNAR_PATH
+    if not path.exists():
+        return None
+    header = read_header(path)
+    signature = catalog_store.file_signature(src)
+    if signature is not None and header.get("source_signature") != list(signature):
+        return None
+    return load(path)
+
+
+if __name__ == "__main__":
+    dest = Path(sys.argv[1]) if len(sys.argv) > 1 else catalog_store.COLUMNAR_PATH
+    info = build(dest=dest)
+    print(f"Catálogo columnar: {info['count']} platos, {info['restaurants']} restaurantes -> {dest}")
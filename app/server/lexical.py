@@ -0,0 +1,96 @@
+import math
+from typing import TYPE_CHECKING, Callable, Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+
+if TYPE_CHECKING:
+    from .columnar import ColumnarCatalog
+
+# Boost por campo: una coincidencia en el nombre del plato pesa más que en la descripción
+FIELD_BOOSTS = {
+    "dish_name": 3.0,
+    "synonyms": 2.0,
+    "ingredients": 1.5,
+    "restaurant": 1.5,
+    "description": 1.0,
+}
+
+
+def _field_texts(catalog: "ColumnarCatalog", field: str) -> List[str]:
+    if field in ("dish_name", "description"):
+        return catalog.strings(field)
+    if field == "restaurant":
+        return catalog.strings("restaurant.name")
+    return [" ".join(values) for values in catalog.lists(field)]
+
+
+class BM25Index:
+    """BM25 por campos (estilo BM25F simplificado) sobre postings precomputados.
+
+    Cada término guarda posiciones, impacto por plato (idf x suma de los tf
+    saturados de cada campo, ponderados por su boost) y el impacto máximo, que
+    ordena los términos y normaliza el score léxico.
+    """
+
+    def __init__(
+        self,
+        catalog: "ColumnarCatalog",
+        tokenize: Callable[[str], Iterable[str]],
+        boosts: Optional[Dict[str, float]] = None,
+        k1: float = 1.2,
+        b: float = 0.75,
+    ):
+        self.size = len(catalog)
+        self.tokenize = tokenize
+        self.boosts = dict(FIELD_BOOSTS if boosts is None else boosts)
+        weights: Dict[str, Dict[int, float]] = {}
+        for field, boost in self.boosts.items():
+            field_tokens = [list(tokenize(text)) for text in _field_texts(catalog, field)]
+            lengths = [len(tokens) for tokens in field_tokens]
+            avg_len = (sum(lengths) / len(lengths)) if lengths else 0.0
+            for pos, tokens in enumerate(field_tokens):
+                tf: Dict[str, int] = {}
+                for token in tokens:
+                    tf[token] = tf.get(token, 0) + 1
+                norm_len = (1 - b + b * lengths[pos] / avg_len) if avg_len else 1.0
+                for token, freq in tf.items():
+                    saturated = freq * (k1 + 1) / (freq + k1 * norm_len)
+                    postings = weights.setdefault(token, {})
+                    postings[pos] = postings.get(pos, 0.0) + boost * saturated
+        self.postings: Dict[str, Tuple[np.ndarray, np.ndarray]] = {}
+        self.max_impact: Dict[str, float] = {}
+        for token, per_dish in weights.items():
+            df = len(per_dish)
+            idf = math.log(1 + (self.size - df + 0.5) / (df + 0.5))
+            positions = np.asarray(sorted(per_dish), dtype=np.intp)
+            impacts = np.asarray([per_dish[p] for p in positions.tolist()], dtype=np.float64) * idf
+            self.postings[token] = (positions, impacts)
+            self.max_impact[token] = float(impacts.max())
+
+    def terms(self, text: str) -> List[Tuple[str, np.ndarray, np.ndarray, float]]:
+        """Términos conocidos de la consulta, de mayor a menor cota superior."""
+        seen = set()
+        out = []
+        for token in self.tokenize(text):
+            if token in seen or token not in self.postings:
+                continue
+            seen.add(token)
+            positions, impacts = self.postings[token]
+            out.append((token, positions, impacts, self.max_impact[token]))
+        out.sort(key=lambda t: t[3], reverse=True)
+        return out
+
+    def retrieve(self, terms: List[Tuple[str, np.ndarray, np.ndarray, float]]) -> Tuple[np.ndarray, np.ndarray]:
+        """Posiciones (ordenadas) que matchean algún término y su score léxico en [0, 1].
+
+        Solo recorre los postings de los términos: el costo depende de cuántos
+        platos los contienen, no del tamaño del catálogo. Los impactos de cada plato
+        se suman en el orden de `terms`.
+        """
+        if not terms:
+            return np.zeros(0, dtype=np.intp), np.zeros(0)
+        norm = sum(t[3] for t in terms) or 1.0
+        positions = np.concatenate([t[1] for t in terms])
+        impacts = np.concatenate([t[2] for t in terms])
+        matched, slot = np.unique(positions, return_inverse=True)
+        return matched, np.bincount(slot, weights=impacts, minlength=len(matched)) / norm
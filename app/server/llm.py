@@ -1,17 +1,143 @@
+import asyncio
+import hashlib
 import json
 import os
 import re
-from typing import Any, Dict, Optional, List
+import threading
+import time
+import weakref
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeout
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Any, Dict, Iterator, Optional, List, Tuple
 
 import httpx
 
+from .breaker import CircuitBreaker, LatencyWindow
+from .cache import SQLiteCache
+from .catalog import DATA_DIR
+
+try:  # h2 es opcional: sin el paquete se usa HTTP/1.1 con keep-alive
+    import h2  # noqa: F401
+    HTTP2_AVAILABLE = True
+except ImportError:  # pragma: no cover - depende del entorno
+    HTTP2_AVAILABLE = False
+
 
 class LLMError(RuntimeError):
     """LLM interaction failure."""
 
 
+class LLMTimeout(LLMError):
+    """El LLM no respondió dentro del presupuesto de latencia."""
+
+
+class LLMUnavailable(LLMError):
+    """Circuito abierto: el proveedor viene fallando y no se lo consulta."""
+
+
 DEFAULT_MODEL = os.getenv("LLM_MODEL", "llama-3.3-70b-versatile")
 DEFAULT_TIMEOUT_SEC = float(os.getenv("LLM_TIMEOUT", "15"))
+TEMPERATURE = 0.2
+MAX_TOKENS = 900
+
+# Respuestas del LLM en disco, compartidas entre workers y reinicios. LLM_CACHE_PATH vacío la desactiva.
+LLM_CACHE_PATH = os.getenv("LLM_CACHE_PATH", str(DATA_DIR / "llm_cache.sqlite3"))
+LLM_CACHE_TTL_SEC = float(os.getenv("LLM_CACHE_TTL_SEC", str(7 * 24 * 3600)))
+LLM_CACHE_MAX_ENTRIES = int(os.getenv("LLM_CACHE_MAX_ENTRIES", "5000"))
+RESPONSE_CACHE: Optional[SQLiteCache] = (
+    SQLiteCache(Path(LLM_CACHE_PATH), LLM_CACHE_TTL_SEC, LLM_CACHE_MAX_ENTRIES) if LLM_CACHE_PATH else None
+)
+
+# Pool de conexiones por URL base: keep-alive (y HTTP/2 si está h2) evita un handshake TCP/TLS por consulta
+LLM_POOL_MAX_CONNECTIONS = int(os.getenv("LLM_POOL_MAX_CONNECTIONS", "20"))
+LLM_POOL_MAX_KEEPALIVE = int(os.getenv("LLM_POOL_MAX_KEEPALIVE", "10"))
+LLM_POOL_KEEPALIVE_SEC = float(os.getenv("LLM_POOL_KEEPALIVE_SEC", "60"))
+_CLIENTS: Dict[str, httpx.Client] = {}
+# Los AsyncClient quedan atados al event loop que los creó: loop -> URL base -> cliente.
+# Con claves débiles un loop descartado (asyncio.run, reinicios) no retiene sus clientes.
+_ASYNC_CLIENTS: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, Dict[str, httpx.AsyncClient]]" = (
+    weakref.WeakKeyDictionary()
+)
+_CLIENTS_LOCK = threading.Lock()
+
+# Tras LLM_BREAKER_FAILURES fallos o timeouts seguidos no se consulta al proveedor durante
+# LLM_BREAKER_COOLDOWN_SEC; después pasa una consulta de prueba (half-open). 0 lo desactiva.
+LLM_BREAKER_FAILURES = int(os.getenv("LLM_BREAKER_FAILURES", "5"))
+LLM_BREAKER_COOLDOWN_SEC = float(os.getenv("LLM_BREAKER_COOLDOWN_SEC", "30"))
+BREAKER = CircuitBreaker(LLM_BREAKER_FAILURES, LLM_BREAKER_COOLDOWN_SEC)
+
+# Timeout adaptativo: LLM_TIMEOUT_FACTOR veces el percentil LLM_TIMEOUT_PERCENTILE de las latencias
+# recientes, entre LLM_TIMEOUT_MIN_SEC y LLM_TIMEOUT. Hasta juntar muestras, y en el sondeo half-open,
+# se usa LLM_TIMEOUT. Una consulta vencida cuenta como muestra del timeout que tenía.
+LLM_TIMEOUT_PERCENTILE = float(os.getenv("LLM_TIMEOUT_PERCENTILE", "99"))
+LLM_TIMEOUT_FACTOR = float(os.getenv("LLM_TIMEOUT_FACTOR", "2"))
+LLM_TIMEOUT_MIN_SEC = float(os.getenv("LLM_TIMEOUT_MIN_SEC", "2"))
+LATENCY = LatencyWindow(
+    int(os.getenv("LLM_LATENCY_WINDOW", "200")), int(os.getenv("LLM_TIMEOUT_MIN_SAMPLES", "20"))
+)
+
+# Presupuesto de latencia (ms): pasado ese tiempo el parser responde con las reglas locales y la
+# consulta sigue en segundo plano, así su respuesta queda en RESPONSE_CACHE. 0 espera hasta LLM_TIMEOUT.
+LLM_BUDGET_MS = float(os.getenv("LLM_BUDGET_MS", "0"))
+_BACKGROUND = ThreadPoolExecutor(max_workers=LLM_POOL_MAX_CONNECTIONS, thread_name_prefix="llm")
+# Tareas async que siguieron tras vencer el presupuesto (referencia fuerte hasta que terminen)
+_PENDING: set = set()
+
+
+def _pool_options() -> Dict[str, Any]:
+    return {
+        "http2": HTTP2_AVAILABLE,
+        "limits": httpx.Limits(
+            max_connections=LLM_POOL_MAX_CONNECTIONS,
+            max_keepalive_connections=LLM_POOL_MAX_KEEPALIVE,
+            keepalive_expiry=LLM_POOL_KEEPALIVE_SEC,
+        ),
+    }
+
+
+def _client(base_url: str) -> httpx.Client:
+    """Cliente compartido para `base_url`; se crea en el primer uso y vive hasta `close_clients`."""
+    client = _CLIENTS.get(base_url)
+    if client is None:
+        with _CLIENTS_LOCK:
+            client = _CLIENTS.get(base_url)
+            if client is None:
+                client = _CLIENTS[base_url] = httpx.Client(base_url=base_url, **_pool_options())
+    return client
+
+
+def _async_client(base_url: str) -> httpx.AsyncClient:
+    """Como `_client`, pero asíncrono y uno por event loop."""
+    loop = asyncio.get_running_loop()
+    client = _ASYNC_CLIENTS.get(loop, {}).get(base_url)
+    if client is None:
+        with _CLIENTS_LOCK:
+            # un loop cerrado no vuelve a correr: sus clientes se sueltan aunque alguien lo referencie
+            for closed in [other for other in _ASYNC_CLIENTS if other.is_closed()]:
+                del _ASYNC_CLIENTS[closed]
+            clients = _ASYNC_CLIENTS.setdefault(loop, {})
+            client = clients.get(base_url)
+            if client is None:
+                client = clients[base_url] = httpx.AsyncClient(base_url=base_url, **_pool_options())
+    return client
+
+
+def close_clients() -> None:
+    """Cierra las conexiones abiertas (al apagar la app)."""
+    with _CLIENTS_LOCK:
+        clients = list(_CLIENTS.values())
+        _CLIENTS.clear()
+    for client in clients:
+        client.close()
+
+
+async def aclose_clients() -> None:
+    """Cierra los clientes asíncronos del event loop actual (al apagar la app)."""
+    with _CLIENTS_LOCK:
+        clients = list(_ASYNC_CLIENTS.pop(asyncio.get_running_loop(), {}).values())
+    for client in clients:
+        await client.aclose()
 
 
 def _provider() -> str:
@@ -40,6 +166,16 @@ def provider_name() -> str:
     return _provider()
 
 
+def cache_identity() -> Optional[tuple]:
+    """Proveedor y modelo que determinan la respuesta del LLM (None si está deshabilitado)."""
+    if not llm_enabled():
+        return None
+    provider = _provider()
+    if provider == "stub":
+        return (provider, os.getenv("LLM_STUB_RESPONSE") or "")
+    return (provider, DEFAULT_MODEL)
+
+
 def _build_messages(user_text: str, context: Dict[str, Any]) -> list[Dict[str, str]]:
     system_prompt = (
         "Sos un planificador gastronómico de Buenos Aires. "
@@ -115,87 +251,241 @@ def _stub_response() -> Dict[str, Any]:
     }
 
 
-def _groq_request(messages: list[Dict[str, str]], model: str) -> str:
-    api_key = os.getenv("GROQ_API_KEY") or os.getenv("LLM_API_KEY")
-    if not api_key:
-        raise LLMError("Falta GROQ_API_KEY para el proveedor Groq.")
-    base_url = os.getenv("LLM_BASE_URL", "https://api.groq.com/openai/v1").rstrip("/")
-    url = f"{base_url}/chat/completions"
+# Etiquetas de los errores según el proveedor: (origen del error HTTP, respuesta sin contenido)
+_ERROR_LABELS = {
+    "groq": ("Groq", "Respuesta de Groq sin contenido válido."),
+    "generic": ("el proveedor LLM genérico", "Respuesta LLM sin contenido válido."),
+}
+
+
+def _chat_request(provider: str, messages: list[Dict[str, str]], model: str) -> Tuple[str, Dict[str, str], Dict[str, Any]]:
+    """URL base, headers y payload de /chat/completions para el proveedor."""
+    if provider == "groq":
+        api_key = os.getenv("GROQ_API_KEY") or os.getenv("LLM_API_KEY")
+        if not api_key:
+            raise LLMError("Falta GROQ_API_KEY para el proveedor Groq.")
+        base_url = os.getenv("LLM_BASE_URL", "https://api.groq.com/openai/v1")
+    else:
+        api_key = os.getenv("LLM_API_KEY")
+        base_url = os.getenv("LLM_BASE_URL")
+        if not api_key or not base_url:
+            raise LLMError("Para proveedores genéricos se requieren LLM_API_KEY y LLM_BASE_URL.")
     payload = {
         "model": model,
         "messages": messages,
-        "temperature": 0.2,
-        "max_tokens": 900,
+        "temperature": TEMPERATURE,
+        "max_tokens": MAX_TOKENS,
     }
     headers = {
         "Authorization": f"Bearer {api_key}",
         "Content-Type": "application/json",
     }
-    with httpx.Client(timeout=DEFAULT_TIMEOUT_SEC) as client:
-        response = client.post(url, json=payload, headers=headers)
-        try:
-            response.raise_for_status()
-        except httpx.HTTPStatusError as exc:
-            raise LLMError(f"Error HTTP {exc.response.status_code} desde Groq: {exc.response.text}") from exc
-        data = response.json()
+    return base_url.rstrip("/"), headers, payload
+
+
+def _chat_content(response: httpx.Response, provider: str) -> str:
+    source, empty = _ERROR_LABELS["groq" if provider == "groq" else "generic"]
+    try:
+        response.raise_for_status()
+    except httpx.HTTPStatusError as exc:
+        raise LLMError(f"Error HTTP {exc.response.status_code} desde {source}: {exc.response.text}") from exc
+    data = response.json()
     try:
         return data["choices"][0]["message"]["content"]
     except (KeyError, IndexError) as exc:
-        raise LLMError("Respuesta de Groq sin contenido válido.") from exc
+        raise LLMError(empty) from exc
+
+
+def request_timeout() -> float:
+    """Timeout para la próxima consulta, derivado de las latencias observadas."""
+    observed = LATENCY.percentile(LLM_TIMEOUT_PERCENTILE)
+    if observed is None:
+        return DEFAULT_TIMEOUT_SEC
+    return min(DEFAULT_TIMEOUT_SEC, max(LLM_TIMEOUT_MIN_SEC, observed * LLM_TIMEOUT_FACTOR))
+
+
+def _provider_fault(exc: Exception) -> bool:
+    """Si el error habla de la salud del proveedor (red, 5xx, 429) y no de la consulta o
+    la configuración (otros 4xx como una API key inválida, respuestas malformadas)."""
+    cause = exc.__cause__ if isinstance(exc, LLMError) else exc
+    if isinstance(cause, httpx.HTTPStatusError):
+        status = cause.response.status_code
+        return status >= 500 or status == 429
+    return isinstance(cause, httpx.TransportError)
+
+
+@contextmanager
+def _provider_call() -> Iterator[float]:
+    """Pasa por el circuit breaker, fija el timeout y registra el resultado y la latencia."""
+    admitted = BREAKER.admit()
+    if admitted is None:
+        raise LLMUnavailable(
+            f"Proveedor con fallas recientes; se reintenta en {BREAKER.cooldown:.0f} s (circuito abierto)."
+        )
+    # el sondeo usa el timeout completo: si el proveedor volvió más lento que antes de
+    # fallar, un timeout aprendido de la latencia vieja lo dejaría abierto para siempre
+    timeout = DEFAULT_TIMEOUT_SEC if admitted == CircuitBreaker.HALF_OPEN else request_timeout()
+    start = time.monotonic()
+    try:
+        yield timeout
+    except httpx.TimeoutException as exc:
+        # tardó al menos `timeout`: esa cota entra a la ventana para que el percentil
+        # (y el próximo timeout) suba cuando el proveedor se pone más lento
+        LATENCY.add(timeout)
+        BREAKER.record_failure()
+        raise LLMError(f"El LLM no respondió en {timeout:.1f} s.") from exc
+    except Exception as exc:
+        # solo los fallos del proveedor cuentan para el circuito; los errores del
+        # cliente no lo abren ni dejan latencias en la ventana
+        if _provider_fault(exc):
+            BREAKER.record_failure()
+        else:
+            BREAKER.release()
+        raise
+    except BaseException:
+        # cancelada (p. ej. al apagar): no dice nada del proveedor
+        BREAKER.release()
+        raise
+    LATENCY.add(time.monotonic() - start)
+    BREAKER.record_success()
+
+
+def _chat_completion(provider: str, messages: list[Dict[str, str]], model: str) -> str:
+    base_url, headers, payload = _chat_request(provider, messages, model)
+    with _provider_call() as timeout:
+        response = _client(base_url).post("/chat/completions", json=payload, headers=headers, timeout=timeout)
+        return _chat_content(response, provider)
+
+
+def _groq_request(messages: list[Dict[str, str]], model: str) -> str:
+    return _chat_completion("groq", messages, model)
 
 
 def _generic_request(messages: list[Dict[str, str]], model: str) -> str:
-    api_key = os.getenv("LLM_API_KEY")
-    base_url = os.getenv("LLM_BASE_URL")
-    if not api_key or not base_url:
-        raise LLMError("Para proveedores genéricos se requieren LLM_API_KEY y LLM_BASE_URL.")
-    url = f"{base_url.rstrip('/')}/chat/completions"
-    payload = {
-        "model": model,
-        "messages": messages,
-        "temperature": 0.2,
-        "max_tokens": 900,
-    }
-    headers = {
-        "Authorization": f"Bearer {api_key}",
-        "Content-Type": "application/json",
-    }
-    with httpx.Client(timeout=DEFAULT_TIMEOUT_SEC) as client:
-        response = client.post(url, json=payload, headers=headers)
-        try:
-            response.raise_for_status()
-        except httpx.HTTPStatusError as exc:
-            raise LLMError(
-                f"Error HTTP {exc.response.status_code} desde el proveedor LLM genérico: {exc.response.text}"
-            ) from exc
-        data = response.json()
+    return _chat_completion("generic", messages, model)
+
+
+async def _chat_completion_async(provider: str, messages: list[Dict[str, str]], model: str) -> str:
+    base_url, headers, payload = _chat_request(provider, messages, model)
+    with _provider_call() as timeout:
+        response = await _async_client(base_url).post(
+            "/chat/completions", json=payload, headers=headers, timeout=timeout
+        )
+        return _chat_content(response, provider)
+
+
+def response_cache_key(messages: list[Dict[str, str]], model: str, temperature: float = TEMPERATURE) -> str:
+    """Hash del payload exacto enviado al proveedor (mensajes, modelo y temperatura)."""
+    data = json.dumps(
+        {"messages": messages, "model": model, "temperature": temperature},
+        ensure_ascii=False, sort_keys=True, separators=(",", ":"),
+    )
+    return hashlib.sha256(data.encode("utf-8")).hexdigest()
+
+
+def _decode_plan(content: str) -> Dict[str, Any]:
     try:
-        return data["choices"][0]["message"]["content"]
-    except (KeyError, IndexError) as exc:
-        raise LLMError("Respuesta LLM sin contenido válido.") from exc
+        payload = _extract_json_payload(content)
+        return json.loads(payload)
+    except json.JSONDecodeError as exc:
+        raise LLMError(f"Respuesta del LLM no es JSON válido: {content}") from exc
 
 
 def request_plan(user_text: str, context: Dict[str, Any]) -> Dict[str, Any]:
+    provider = _provider()
+    if provider == "stub":
+        return _stub_response()
+    return _plan_for_messages(provider, _build_messages(user_text, context))
+
+
+def _plan_for_messages(provider: str, messages: list[Dict[str, str]]) -> Dict[str, Any]:
+    model = DEFAULT_MODEL
+    key = response_cache_key(messages, model)
+    cached = RESPONSE_CACHE.get(key) if RESPONSE_CACHE is not None else None
+    content = cached
+    if content is None:
+        if provider == "groq":
+            content = _groq_request(messages, model)
+        else:
+            content = _generic_request(messages, model)
+    plan = _decode_plan(content)
+    # solo se guardan respuestas utilizables
+    if cached is None and RESPONSE_CACHE is not None:
+        RESPONSE_CACHE.put(key, content)
+    return plan
+
+
+async def request_plan_async(user_text: str, context: Dict[str, Any]) -> Dict[str, Any]:
+    """`request_plan` sin bloquear el event loop: HTTP con AsyncClient y SQLite en un hilo."""
     provider = _provider()
     if provider == "stub":
         return _stub_response()
     messages = _build_messages(user_text, context)
     model = DEFAULT_MODEL
-    if provider == "groq":
-        content = _groq_request(messages, model)
-    else:
-        content = _generic_request(messages, model)
-    try:
-        payload = _extract_json_payload(content)
-        return json.loads(payload)
-    except json.JSONDecodeError as exc:
-        raise LLMError(f"Respuesta del LLM no es JSON válido: {content}") from exc
+    key = response_cache_key(messages, model)
+    cached = await asyncio.to_thread(RESPONSE_CACHE.get, key) if RESPONSE_CACHE is not None else None
+    content = cached
+    if content is None:
+        content = await _chat_completion_async(provider, messages, model)
+    plan = _decode_plan(content)
+    if cached is None and RESPONSE_CACHE is not None:
+        await asyncio.to_thread(RESPONSE_CACHE.put, key, content)
+    return plan
+
+
+def cache_stats() -> Optional[Dict[str, Any]]:
+    return RESPONSE_CACHE.stats() if RESPONSE_CACHE is not None else None
+
+
+def provider_stats() -> Dict[str, Any]:
+    return {"breaker": BREAKER.stats(), "latency": LATENCY.stats(), "timeout_sec": request_timeout()}
+
+
+def _budget_sec() -> Optional[float]:
+    return LLM_BUDGET_MS / 1000 if LLM_BUDGET_MS > 0 else None
+
+
+def _over_budget() -> LLMTimeout:
+    return LLMTimeout(f"Sin respuesta en {LLM_BUDGET_MS:.0f} ms; se usan reglas locales.")
 
 
 def enrich_query(user_text: str, context: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    """Plan del LLM, o `LLMTimeout` si no llega dentro de `LLM_BUDGET_MS`."""
     if not llm_enabled():
         return None
-    return request_plan(user_text, context)
+    provider = _provider()
+    budget = _budget_sec()
+    if budget is None or provider == "stub":
+        return request_plan(user_text, context)
+    # los mensajes se arman antes de volver: el parser sigue modificando `context`
+    future = _BACKGROUND.submit(_plan_for_messages, provider, _build_messages(user_text, context))
+    try:
+        return future.result(timeout=budget)
+    except FutureTimeout:
+        raise _over_budget() from None
+
+
+def _forget(task: asyncio.Task) -> None:
+    _PENDING.discard(task)
+    if not task.cancelled():
+        task.exception()  # una respuesta tardía fallida no es un error sin atender
+
+
+async def enrich_query_async(
+    user_text: str, context: Dict[str, Any], within_budget: bool = True
+) -> Optional[Dict[str, Any]]:
+    if not llm_enabled():
+        return None
+    budget = _budget_sec() if within_budget else None
+    if budget is None:
+        return await request_plan_async(user_text, context)
+    task = asyncio.ensure_future(request_plan_async(user_text, context))
+    try:
+        return await asyncio.wait_for(asyncio.shield(task), budget)
+    except asyncio.TimeoutError:
+        _PENDING.add(task)
+        task.add_done_callback(_forget)
+        raise _over_budget() from None
 
 
 def _extract_json_payload(raw: str) -> str:
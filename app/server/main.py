@@ -1,15 +1,32 @@
 
-from fastapi import FastAPI, Body
+import json, os
+from contextlib import asynccontextmanager
+
+from fastapi import FastAPI, Body, Header, HTTPException, Query, Request
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import RedirectResponse
+from fastapi.responses import RedirectResponse, Response, StreamingResponse
+from fastapi.concurrency import run_in_threadpool
+from fastapi.encoders import jsonable_encoder
 from fastapi.staticfiles import StaticFiles
-from .parser import parse as parse_text
-from .search import search as search_logic
-from .schema import SearchRequest
-import json
+from .parser import parse_async as parse_text, parse_stages, cache_stats as parse_cache_stats
+from .search import search as search_logic, cache_stats as search_cache_stats
+from .schema import QUERY_MAX_LIMIT, QUERY_PAGE_SIZE, CatalogDeltaRequest, QueryRequest, SearchRequest
+from . import llm, snapshot
 from pathlib import Path
 
-app = FastAPI(title="Food Search v2", version="0.3.0")
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Carga inicial antes de aceptar requests y recarga en caliente mientras corre
+    snapshot.current()
+    watcher = snapshot.Watcher().start()
+    try:
+        yield
+    finally:
+        watcher.stop()
+        llm.close_clients()
+        await llm.aclose_clients()
+
+app = FastAPI(title="Food Search v2", version="0.3.0", lifespan=lifespan)
 
 app.add_middleware(
     CORSMiddleware,
@@ -27,17 +44,136 @@ app.mount("/web", StaticFiles(directory=WEB_DIR, html=True), name="web")
 def root():
     return RedirectResponse(url="/web/index.html")
 
+# Endpoints async: mientras una request espera al LLM el event loop sigue atendiendo
+# las demás; el trabajo de CPU (reglas, ranking) corre en el threadpool.
 @app.post("/parse")
-def parse_endpoint(payload: dict = Body(...)):
+async def parse_endpoint(payload: dict = Body(...)):
     text = payload.get("text","")
-    parsed = parse_text(text)
+    parsed = await parse_text(text)
     return parsed
 
 @app.post("/search")
-def search_endpoint(payload: dict = Body(...)):
-    return search_logic(payload)
+async def search_endpoint(payload: SearchRequest):
+    return await run_in_threadpool(search_logic, payload.dict())
+
+@app.post("/query")
+async def query_endpoint(payload: QueryRequest):
+    """Interpreta y busca en un solo viaje, con la misma versión del catálogo. La
+    interpretación intermedia solo viaja en la respuesta con `include_parse`."""
+    with snapshot.pinned():
+        parsed = await parse_text(payload.text)
+        searched = await run_in_threadpool(
+            search_logic,
+            {"query": parsed["query"], "limit": payload.limit, "offset": payload.offset, "explain": payload.explain},
+        )
+    if payload.include_parse:
+        searched["parsed"] = parsed
+    return searched
+
+def _sse(event: str, event_id: int, data: dict) -> str:
+    return f"id: {event_id}\nevent: {event}\ndata: {json.dumps(jsonable_encoder(data), ensure_ascii=False)}\n\n"
+
+@app.get("/search/stream")
+async def search_stream(
+    text: str, limit: int = Query(QUERY_PAGE_SIZE, ge=0, le=QUERY_MAX_LIMIT), offset: int = Query(0, ge=0)
+):
+    """Server-sent events: resultados con las reglas locales apenas están y, cuando responde
+    el LLM, la búsqueda refinada. Cada evento `results` lleva `version` creciente y `final`."""
+    async def events():
+        version = 0
+        async for stage, parsed in parse_stages(text):
+            version += 1
+            searched = await run_in_threadpool(
+                search_logic, {"query": parsed["query"], "limit": limit, "offset": offset}
+            )
+            payload = {"version": version, "stage": stage, "final": stage == "final", "parsed": parsed, "search": searched}
+            yield _sse("results", version, payload)
+
+    # sin buffering de proxies (nginx) para que el primer evento llegue enseguida
+    headers = {"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    return StreamingResponse(events(), media_type="text/event-stream", headers=headers)
+
+CATALOG_CACHE_CONTROL = "public, max-age=60, must-revalidate"
+# preferencia del servidor cuando el cliente acepta varias codificaciones
+CATALOG_ENCODINGS = ("br", "gzip")
+
+def _accepted_encodings(header: str) -> set:
+    accepted = set()
+    for part in (header or "").split(","):
+        coding, _, params = part.strip().partition(";")
+        coding = coding.strip().lower()
+        q = params.strip().lower()
+        if q.startswith("q="):
+            try:
+                if float(q[2:]) <= 0:
+                    continue
+            except ValueError:
+                continue
+        if coding:
+            accepted.add(coding)
+    return accepted
+
+def _etag_matches(header: str, etag: str) -> bool:
+    # If-None-Match usa comparación débil: se ignora el prefijo W/
+    for candidate in (header or "").split(","):
+        candidate = candidate.strip()
+        if candidate == "*" or candidate.removeprefix("W/") == etag:
+            return True
+    return False
 
 @app.get("/catalog")
-def catalog():
-    data = json.loads((Path(__file__).resolve().parent.parent / "data" / "catalog.json").read_text(encoding="utf-8"))
-    return {"count": len(data), "items": data}
+def catalog(request: Request):
+    payload = snapshot.current().catalog_payload
+    accepted = _accepted_encodings(request.headers.get("accept-encoding"))
+    coding = next((c for c in CATALOG_ENCODINGS if c in accepted and c in payload["encoded"]), "identity")
+    etag = payload["etags"][coding]
+    headers = {
+        "ETag": etag,
+        "Cache-Control": CATALOG_CACHE_CONTROL,
+        "Vary": "Accept-Encoding",
+    }
+    if _etag_matches(request.headers.get("if-none-match"), etag):
+        return Response(status_code=304, headers=headers)
+    if coding == "identity":
+        return Response(payload["body"], media_type="application/json", headers=headers)
+    headers["Content-Encoding"] = coding
+    return Response(payload["encoded"][coding], media_type="application/json", headers=headers)
+
+def _require_admin(x_admin_token: str) -> None:
+    # Sin ADMIN_TOKEN configurado los endpoints de administración quedan deshabilitados
+    token = os.getenv("ADMIN_TOKEN")
+    if not token or x_admin_token != token:
+        raise HTTPException(status_code=403, detail="Token de administración inválido.")
+
+@app.patch("/catalog/items")
+def catalog_items_patch(payload: CatalogDeltaRequest, x_admin_token: str = Header(default="")):
+    _require_admin(x_admin_token)
+    deltas = [item.dict() for item in payload.items]
+    try:
+        snap = snapshot.apply_deltas(deltas)
+    except KeyError as exc:
+        raise HTTPException(status_code=404, detail={"message": "Platos inexistentes.", "ids": exc.args[0]})
+    return {**snap.status(), "updated": len(deltas)}
+
+@app.post("/admin/reload")
+def admin_reload(x_admin_token: str = Header(default="")):
+    _require_admin(x_admin_token)
+    try:
+        snap = snapshot.reload(force=True)
+    except Exception as exc:
+        raise HTTPException(
+            status_code=422,
+            detail={"message": f"No se pudo recargar: {exc}", "current": snapshot.current().status()},
+        )
+    return snap.status()
+
+@app.get("/admin/stats")
+def admin_stats(x_admin_token: str = Header(default="")):
+    _require_admin(x_admin_token)
+    return {
+        "snapshot": snapshot.current().status(),
+        "search_cache": search_cache_stats(),
+        "parse_cache": parse_cache_stats(),
+        "llm_cache": llm.cache_stats(),
+        "llm_provider": llm.provider_stats(),
+    }
@@ -0,0 +1,74 @@
+from collections import deque
+from typing import Dict, Iterable, Iterator, List, Tuple
+
+
+class AhoCorasick:
+    """Autómata Aho-Corasick por caracteres.
+
+    Encuentra en una sola pasada todas las ocurrencias (incluso solapadas) de un
+    conjunto de patrones. Cada coincidencia se reporta como (inicio, fin, patrón).
+    """
+
+    def __init__(self, patterns: Iterable[str] = ()):
+        self._goto: List[Dict[str, int]] = [{}]
+        self._fail: List[int] = [0]
+        self._out: List[List[str]] = [[]]
+        self._built = False
+        for pattern in patterns:
+            self.add(pattern)
+
+    def add(self, pattern: str) -> None:
+        if not pattern:
+            return
+        state = 0
+        for ch in pattern:
+            nxt = self._goto[state].get(ch)
+            if nxt is None:
+                nxt = len(self._goto)
+                self._goto[state][ch] = nxt
+                self._goto.append({})
+                self._fail.append(0)
+                self._out.append([])
+            state = nxt
+        if pattern not in self._out[state]:
+            self._out[state].append(pattern)
+        self._built = False
+
+    def build(self) -> "AhoCorasick":
+        queue = deque(self._goto[0].values())
+        for state in queue:
+            self._fail[state] = 0
+        while queue:
+            state = queue.popleft()
+            for ch, nxt in self._goto[state].items():
+                queue.append(nxt)
+                fail = self._fail[state]
+                while fail and ch not in self._goto[fail]:
+                    fail = self._fail[fail]
+                self._fail[nxt] = self._goto[fail].get(ch, 0)
+                self._out[nxt].extend(p for p in self._out[self._fail[nxt]] if p not in self._out[nxt])
+        self._built = True
+        return self
+
+    def iter_matches(self, text: str) -> Iterator[Tuple[int, int, str]]:
+        if not self._built:
+            self.build()
+        goto, fail, out = self._goto, self._fail, self._out
+        state = 0
+        for idx, ch in enumerate(text):
+            while state and ch not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(ch, 0)
+            for pattern in out[state]:
+                yield idx + 1 - len(pattern), idx + 1, pattern
+
+
+def _is_word_char(ch: str) -> bool:
+    return ch.isalnum() or ch == "_"
+
+
+def is_word_boundary(text: str, idx: int) -> bool:
+    """Misma semántica que `\\b` de `re` en la posición `idx` de `text`."""
+    left = idx > 0 and _is_word_char(text[idx - 1])
+    right = idx < len(text) and _is_word_char(text[idx])
+    return left != right
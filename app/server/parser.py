@@ -1,22 +1,28 @@
 
-import json, re
-from pathlib import Path
-from typing import Dict, Any, List, Iterable, Optional
+import asyncio, json, os, re
+from typing import Dict, Any, AsyncIterator, Awaitable, Generator, List, Iterable, Optional, Tuple
 from copy import deepcopy
+from functools import lru_cache, partial
 from .schema import ParsedQuery, ParseFilters, RankingOverrides
+from .matcher import AhoCorasick, is_word_boundary
 from . import llm
+from . import snapshot
+from .cache import LRUCache
 
-DATA_DIR = Path(__file__).resolve().parent.parent / "data" / "dictionaries"
+def _state() -> Dict[str, Any]:
+    # Diccionarios e índices del snapshot vigente (ver snapshot.py y build_state)
+    return snapshot.current().parser
 
-def load_json(name: str):
-    return json.loads((DATA_DIR / name).read_text(encoding="utf-8"))
+def __getattr__(name: str):
+    # Compatibilidad: CATEGORIES, RESTAURANT_NAMES, CATALOG_METRICS, ... se leen del snapshot vigente
+    if name.isupper() and name.lower() in _state():
+        return _state()[name.lower()]
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
-CATEGORIES = load_json("categories.json")
-INGREDIENTS = load_json("ingredients.json")
-DIETS = load_json("diets.json")
-ALLERGENS = load_json("allergens.json")
-HEALTH = load_json("health.json")
-INTENTS = load_json("intents.json")
+# Memoización de `parse`: la web repite el mismo texto (autocompletado, reintentos)
+PARSE_CACHE_SIZE = int(os.getenv("PARSE_CACHE_SIZE", "512"))
+PARSE_CACHE_TTL_SEC = float(os.getenv("PARSE_CACHE_TTL_SEC", "600"))
+PARSE_CACHE = LRUCache(PARSE_CACHE_SIZE, PARSE_CACHE_TTL_SEC)
 
 NEIGHBORHOODS = [
     "Palermo","Belgrano","Colegiales","Recoleta","Chacarita","Villa Crespo","Almagro",
@@ -30,47 +36,23 @@ CUISINES = [
     "Mariscos","Pollo","Wraps","Poke","Veggie"
 ]
 
-CATALOG_FACETS = {
-    "categories": sorted(CATEGORIES.keys()),
-    "diets": sorted(DIETS.keys()),
-    "allergens": sorted(ALLERGENS.keys()),
-    "health_tags": sorted(HEALTH["tags"].keys()),
-    "neighborhoods": NEIGHBORHOODS,
-    "cuisines": CUISINES,
-    "ingredients": sorted(INGREDIENTS.keys()),
-}
-
-# Cargar nombres de restaurantes desde el catálogo para detectar coincidencias exactas en la consulta
-CATALOG_PATH = Path(__file__).resolve().parent.parent / "data" / "catalog.json"
-def get_restaurant_names():
-    try:
-        data = json.loads(CATALOG_PATH.read_text(encoding="utf-8"))
-        names = sorted({ d["restaurant"]["name"] for d in data })
-        return names
-    except Exception:
-        return []
-
-RESTAURANT_NAMES = get_restaurant_names()
-
-def load_catalog_metrics():
-    try:
-        data = json.loads(CATALOG_PATH.read_text(encoding="utf-8"))
-    except Exception:
-        return {"prices": [], "etas": [], "ratings": []}
-    prices = sorted(d.get("price_ars", 0) for d in data)
-    etas = sorted(d.get("restaurant", {}).get("eta_min", 0) for d in data)
-    ratings = sorted(d.get("restaurant", {}).get("rating", 0.0) for d in data)
-    return {"prices": prices, "etas": etas, "ratings": ratings}
-
-CATALOG_METRICS = load_catalog_metrics()
+def _catalog_facets(dictionaries: Dict[str, Any]) -> Dict[str, List[str]]:
+    return {
+        "categories": sorted(dictionaries["categories"].keys()),
+        "diets": sorted(dictionaries["diets"].keys()),
+        "allergens": sorted(dictionaries["allergens"].keys()),
+        "health_tags": sorted(dictionaries["health"]["tags"].keys()),
+        "neighborhoods": NEIGHBORHOODS,
+        "cuisines": CUISINES,
+        "ingredients": sorted(dictionaries["ingredients"].keys()),
+    }
 
 def parse_restaurants(text_raw: str, plan: List[str]) -> List[str]:
     t = normalize_soft(text_raw)
-    hits = []
-    for rn in RESTAURANT_NAMES:
-        rnn = normalize_soft(rn)
-        if rnn and rnn in t:
-            hits.append(rn)
+    # mismo criterio que antes (nombre normalizado contenido en el texto), en una sola pasada
+    state = _state()
+    found = {pattern for _, _, pattern in state["restaurant_matcher"].iter_matches(t)}
+    hits = [rn for order, rn in sorted(o for pattern in found for o in state["restaurant_name_index"][pattern])]
     if hits:
         plan.append(f"Restaurantes detectados: {hits}")
     return hits
@@ -96,6 +78,66 @@ def normalize_soft(s: str) -> str:
     s = re.sub(r"[^a-z0-9\s\.,]", " ", s)
     return s
 
+def _dictionary_index(dictionaries: Dict[str, Any]) -> Dict[str, List[tuple]]:
+    """Sinónimo normalizado -> [(diccionario, canónico, orden)]. `orden` respeta el recorrido
+    de los diccionarios, así los parse_* deciden igual que iterando las listas de sinónimos."""
+    sources = (
+        ("categories", dictionaries["categories"].items()),
+        ("diets", ((k, d["synonyms"]) for k, d in dictionaries["diets"].items())),
+        ("health", dictionaries["health"]["tags"].items()),
+        ("meal_moments", MEAL_MOMENTS.items()),
+        ("neighborhoods", ((n, [n]) for n in NEIGHBORHOODS)),
+        ("cuisines", ((c, [c]) for c in CUISINES)),
+    )
+    index: Dict[str, List[tuple]] = {}
+    order = 0
+    for name, entries in sources:
+        for canonical, syns in entries:
+            for s in syns:
+                index.setdefault(normalize(s), []).append((name, canonical, order))
+                order += 1
+    return index
+
+def _restaurant_name_index(names: List[str]) -> Dict[str, List[tuple]]:
+    # nombre normalizado -> [(orden en RESTAURANT_NAMES, nombre original)]
+    index: Dict[str, List[tuple]] = {}
+    for order, rn in enumerate(names):
+        rnn = normalize_soft(rn)
+        if rnn:
+            index.setdefault(rnn, []).append((order, rn))
+    return index
+
+def _dictionary_hits(matcher: AhoCorasick, text_norm: str) -> Dict[str, str]:
+    """Patrón -> "word" si aparece como palabra completa, "prefix" si solo aparece como
+    comienzo de una palabra más larga. Se cachea por snapshot: no modificar el resultado."""
+    hits: Dict[str, str] = {}
+    for start, end, pattern in matcher.iter_matches(text_norm):
+        if not is_word_boundary(text_norm, start):
+            continue
+        if is_word_boundary(text_norm, end):
+            hits[pattern] = "word"
+        else:
+            hits.setdefault(pattern, "prefix")
+    return hits
+
+def _dictionary_matches(text_norm: str, dictionary: str, prefix: bool = False) -> List[tuple]:
+    """(canónico, sinónimo normalizado) de `dictionary` presentes en el texto, en el orden del
+    diccionario. Con `prefix` también cuentan los sinónimos que solo abren una palabra más larga."""
+    state = _state()
+    index = state["dictionary_index"]
+    found = []
+    for pattern, kind in state["dictionary_hits"](text_norm).items():
+        if kind == "word" or prefix:
+            found.extend((order, canonical, pattern) for name, canonical, order in index[pattern] if name == dictionary)
+    found.sort()
+    return [(canonical, pattern) for _, canonical, pattern in found]
+
+@lru_cache(maxsize=None)
+def _negative_context_regex(s_norm: str):
+    return re.compile(
+        rf"(sin|evitar|alergia(?:s)?|intoleranc(?:ia|ias)|no\s+quiero)(?:\s+\w+){{0,5}}\s+{re.escape(s_norm)}"
+    )
+
 def percentile_value(values: List[Any], pct: float):
     if not values:
         return None
@@ -105,13 +147,13 @@ def percentile_value(values: List[Any], pct: float):
     return values[idx]
 
 def price_from_percentile(pct: float):
-    return percentile_value(CATALOG_METRICS.get("prices", []), pct)
+    return percentile_value(_state()["catalog_metrics"].get("prices", []), pct)
 
 def eta_from_percentile(pct: float):
-    return percentile_value(CATALOG_METRICS.get("etas", []), pct)
+    return percentile_value(_state()["catalog_metrics"].get("etas", []), pct)
 
 def rating_from_percentile(pct: float):
-    return percentile_value(CATALOG_METRICS.get("ratings", []), pct)
+    return percentile_value(_state()["catalog_metrics"].get("ratings", []), pct)
 
 def tighten_min_limit(current, new_value):
     if new_value is None:
@@ -261,30 +303,20 @@ def parse_rating(text_raw: str, plan: List[str]):
 
 def parse_category(text_norm: str, plan: List[str]):
     cats = []
-    for cat, syns in CATEGORIES.items():
-        for s in syns:
-            s_norm = normalize(s)
-            pattern = rf"\b{re.escape(s_norm)}\b"
-            if re.search(pattern, text_norm):
-                negative = re.search(
-                    rf"(sin|evitar|alergia(?:s)?|intoleranc(?:ia|ias)|no\s+quiero)(?:\s+\w+){{0,5}}\s+{re.escape(s_norm)}",
-                    text_norm,
-                )
-                if negative:
-                    plan.append(f"Categoría omitida por contexto negativo: {cat}")
-                    continue
-                cats.append(cat)
-                break
+    for cat, s_norm in _dictionary_matches(text_norm, "categories"):
+        if cat in cats:
+            continue
+        negative = _negative_context_regex(s_norm).search(text_norm)
+        if negative:
+            plan.append(f"Categoría omitida por contexto negativo: {cat}")
+            continue
+        cats.append(cat)
     if cats:
         plan.append(f"Categorias: {sorted(set(cats))}")
     return sorted(set(cats))
 
 def parse_neighborhoods(text: str, plan: List[str]):
-    selected = []
-    t = normalize(text)
-    for n in NEIGHBORHOODS:
-        if re.search(rf"\b{re.escape(normalize(n))}\b", t):
-            selected.append(n)
+    selected = [n for n, _ in _dictionary_matches(normalize(text), "neighborhoods")]
     if selected:
         plan.append(f"Barrios: {selected}")
     return selected
@@ -293,25 +325,85 @@ def parse_neighborhoods(text: str, plan: List[str]):
 def parse_cuisines(text: str, plan: List[str]):
     selected = []
     t = normalize(text)
-    for c in CUISINES:
-        c_norm = normalize(c)
+    for c, c_norm in _dictionary_matches(t, "cuisines"):
         if c in ["Vegana","Vegetariana"]:
             if re.search(rf"\bcocina\s+{re.escape(c_norm)}\b", t):
                 selected.append(c)
         else:
-            if re.search(rf"\b{re.escape(c_norm)}\b", t):
-                negative = re.search(
-                    rf"(sin|evitar|alergia(?:s)?|intoleranc(?:ia|ias)|no\s+quiero)(?:\s+\w+){{0,5}}\s+{re.escape(c_norm)}",
-                    t,
-                )
-                if negative:
-                    plan.append(f"Cocina omitida por contexto negativo: {c}")
-                    continue
-                selected.append(c)
+            negative = _negative_context_regex(c_norm).search(t)
+            if negative:
+                plan.append(f"Cocina omitida por contexto negativo: {c}")
+                continue
+            selected.append(c)
     if selected:
         plan.append(f"Cocinas: {selected}")
     return selected
 
+NEGATIVE_TRIGGERS = [
+    ("sin",),
+    ("ni",),
+    ("odio",),
+    ("no", "quiero"),
+    ("evito",),
+    ("evitar",),
+    ("alergia",),
+    ("alergias",),
+    ("intolerancia",),
+    ("intolerancias",),
+    ("nada", "de"),
+    ("nada", "con"),
+]
+# Cantidad de palabras que pueden separar el disparador negativo del ingrediente
+NEGATION_WINDOW = 5
+SYNONYM_SUFFIXES = ("s", "es", "ito", "itos", "ita", "itas")
+
+def _build_synonym_index(source: Dict[str, Any]) -> Dict[str, List[tuple]]:
+    """Primer token del sinónimo normalizado -> [(tokens del sinónimo, canónico)]."""
+    syn_map: Dict[str, str] = {}
+    for token, group in source.items():
+        for s in group["synonyms"]:
+            syn_map[normalize(s)] = token
+    index: Dict[str, List[tuple]] = {}
+    for syn_norm, token in syn_map.items():
+        syn_tokens = tuple(syn_norm.split())
+        if syn_tokens:
+            index.setdefault(syn_tokens[0], []).append((syn_tokens, token))
+    return index
+
+
+def _word_matches(word: str, syn_word: str) -> bool:
+    # último token del sinónimo: admite plural/diminutivo ("tomates", "cebollita")
+    return word == syn_word or (word.startswith(syn_word) and word[len(syn_word):] in SYNONYM_SUFFIXES)
+
+def _synonym_hits(tokens: List[str], index: Dict[str, List[tuple]]) -> List[tuple]:
+    """(posición de inicio, canónico) de cada sinónimo presente en la lista de tokens."""
+    hits = set()
+    for j, word in enumerate(tokens):
+        keys = {word}
+        keys.update(word[: -len(suf)] for suf in SYNONYM_SUFFIXES if word.endswith(suf) and len(word) > len(suf))
+        for key in keys:
+            for syn_tokens, canonical in index.get(key, ()):
+                m = len(syn_tokens)
+                if m == 1:
+                    hits.add((j, canonical))
+                    continue
+                if key != word or j + m > len(tokens):
+                    continue
+                if list(syn_tokens[1:-1]) == tokens[j + 1 : j + m - 1] and _word_matches(tokens[j + m - 1], syn_tokens[-1]):
+                    hits.add((j, canonical))
+    return sorted(hits)
+
+def negative_scope(tokens: List[str]) -> List[bool]:
+    """Marca los tokens que caen dentro del alcance de un disparador negativo ("sin", "ni", "odio"...)."""
+    scope = [False] * len(tokens)
+    for i in range(len(tokens)):
+        for trigger in NEGATIVE_TRIGGERS:
+            if tuple(tokens[i : i + len(trigger)]) != trigger:
+                continue
+            first = i + len(trigger)
+            for j in range(first, min(len(tokens), first + NEGATION_WINDOW + 1)):
+                scope[j] = True
+    return scope
 
 def extract_include_exclude(text_norm: str, plan: List[str]):
     include, exclude, allergens_ex = [], [], []
@@ -319,67 +411,22 @@ def extract_include_exclude(text_norm: str, plan: List[str]):
     # First: map "poca sal" or "sin sal" to low_sodium and prevent 'sal' as ingredient include
     low_sodium_hit = bool(re.search(r"\b(poca|baja)\s+sal\b", text_norm) or re.search(r"\bsin\s+sal\b", text_norm))
 
-    # Build normalized synonym maps
-    ing_map = {}
-    for token, group in INGREDIENTS.items():
-        for s in group["synonyms"]:
-            ing_map[normalize(s)] = token
-    allerg_map = {}
-    for token, group in ALLERGENS.items():
-        for s in group["synonyms"]:
-            allerg_map[normalize(s)] = token
-
-    def pat(syn):
-        return rf"\b{re.escape(syn)}(?:s|es|ito|itos|ita|itas)?\b"
-
-    negative_prefixes = [
-        r"sin",
-        r"ni",
-        r"odio",
-        r"odio\s+la",
-        r"odio\s+el",
-        r"no\s+quiero",
-        r"evito",
-        r"evitar",
-        r"alergia",
-        r"alergias",
-        r"intolerancia",
-        r"intolerancias",
-        r"nada\s+de",
-        r"nada\s+con",
-    ]
-
-    def in_negative_context(pattern: str) -> bool:
-        for prefix in negative_prefixes:
-            if re.search(rf"{prefix}(?:\s+\w+){{0,5}}\s+{pattern}", text_norm):
-                return True
-        return False
+    # Una sola pasada: tokens, alcance negativo y búsqueda de sinónimos por token
+    tokens = re.findall(r"\w+", text_norm)
+    negative = negative_scope(tokens)
 
-    for syn_norm, token in ing_map.items():
-        token_pattern = pat(syn_norm)
-        if in_negative_context(token_pattern):
+    state = _state()
+    for j, token in _synonym_hits(tokens, state["ingredient_synonym_index"]):
+        if negative[j]:
             exclude.append(token)
+        # Solo incluir ingredientes que aparecen explícitamente con "con"
+        if j > 0 and tokens[j - 1] == "con" and not (low_sodium_hit and token == "sal"):
+            include.append(token)
 
-    for syn_norm, token in allerg_map.items():
-        token_pattern = pat(syn_norm)
-        if in_negative_context(token_pattern):
+    for j, token in _synonym_hits(tokens, state["allergen_synonym_index"]):
+        if negative[j]:
             allergens_ex.append(token)
 
-    # "con X"
-    for syn_norm, token in ing_map.items():
-        if re.search(rf"\bcon\s+{pat(syn_norm)}", text_norm):
-            if not (low_sodium_hit and syn_norm == "sal"):
-                include.append(token)
-
-    # Solo incluir ingredientes que aparecen explícitamente con "con" o en contextos positivos
-    # NO incluir ingredientes que aparecen en contextos de exclusión
-    for syn_norm, token in ing_map.items():
-        if syn_norm == "sal" and low_sodium_hit:
-            continue
-        # Solo incluir si aparece con "con" y no con "sin"
-        if re.search(rf"\bcon\s+{pat(syn_norm)}", text_norm) and not re.search(rf"\bsin\s+{pat(syn_norm)}", text_norm):
-            include.append(token)
-
     include = sorted(set(include))
     exclude = sorted(set(exclude))
     allergens_ex = sorted(set(allergens_ex))
@@ -392,13 +439,7 @@ def extract_include_exclude(text_norm: str, plan: List[str]):
         plan.append(f"Excluir alergenos: {allergens_ex}")
     return include, exclude, allergens_ex
 def parse_diets(text_norm: str, plan: List[str]):
-    must = []
-    for dkey, dobj in DIETS.items():
-        for s in dobj["synonyms"]:
-            s_norm = normalize(s)
-            if re.search(rf"\b{re.escape(s_norm)}\w*\b", text_norm):
-                must.append(dkey)
-                break
+    must = [dkey for dkey, _ in _dictionary_matches(text_norm, "diets", prefix=True)]
     if "apto celiacos" in text_norm or "apto celiaco" in text_norm or "sin gluten" in text_norm:
         if "gluten_free" not in must:
             must.append("gluten_free")
@@ -407,13 +448,8 @@ def parse_diets(text_norm: str, plan: List[str]):
     return sorted(set(must))
 
 def parse_health_and_intents(text_norm: str, plan: List[str]):
-    health_any, hints, boost, penal = [], [], [], []
-    for tag, syns in HEALTH["tags"].items():
-        for s in syns:
-            s_norm = normalize(s)
-            if re.search(rf"\b{re.escape(s_norm)}\w*\b", text_norm):
-                health_any.append(tag)
-                break
+    hints, boost, penal = [], [], []
+    health_any = [tag for tag, _ in _dictionary_matches(text_norm, "health", prefix=True)]
     if "saludable" in text_norm or "saludables" in text_norm or re.search(r"\b(poca|baja)\s+sal\b", text_norm) or re.search(r"\bsin\s+sal\b", text_norm):
         if "no_fry" not in health_any:
             health_any.append("no_fry")
@@ -582,7 +618,121 @@ def apply_conversation_scenarios(
             seen.add(tag)
     return summaries, dedup_tags
 
+def _cached_parse(key: tuple, text: str) -> Optional[Dict[str, Any]]:
+    cached = PARSE_CACHE.get(key)
+    if cached is None:
+        return None
+    result = deepcopy(cached)
+    result["query"]["q"] = text
+    return result
+
+def _store_parse(key: tuple, result: Dict[str, Any]) -> None:
+    # Sin respuesta del LLM (error o fuera de presupuesto) no se guarda: el reintento vuelve a
+    # consultarlo y, si la respuesta tardía ya llegó, la toma de RESPONSE_CACHE
+    if result["status"]["llm"].get("status") not in {"error", "timeout"}:
+        PARSE_CACHE.put(key, deepcopy(result))
+
 def parse(text: str):
+    """Interpreta `text`, memoizado por texto normalizado, versión de datos y LLM.
+
+    Devuelve siempre una copia: quien la modifique no altera la entrada cacheada.
+    """
+    # Toda la interpretación usa una misma versión de diccionarios y catálogo
+    with snapshot.pinned() as snap:
+        key = (normalize_soft(text), snap.version, llm.cache_identity())
+        result = _cached_parse(key, text)
+        if result is None:
+            result = _run_steps(_parse_steps(text))
+            _store_parse(key, result)
+        return result
+
+async def parse_async(text: str):
+    """`parse` para endpoints async: la consulta al LLM se espera sin bloquear el event
+    loop y las reglas locales (CPU) corren en un hilo aparte."""
+    with snapshot.pinned() as snap:
+        key = (normalize_soft(text), snap.version, llm.cache_identity())
+        result = _cached_parse(key, text)
+        if result is None:
+            result = await _run_steps_async(_parse_steps(text))
+            _store_parse(key, result)
+        return result
+
+def _run_steps(steps: Generator) -> Dict[str, Any]:
+    # `_parse_steps` entrega (texto, contexto) cuando necesita al LLM y recibe su respuesta
+    try:
+        request = next(steps)
+        while True:
+            try:
+                enrichment = llm.enrich_query(*request)
+            except Exception as exc:
+                request = steps.throw(exc)
+            else:
+                request = steps.send(enrichment)
+    except StopIteration as stop:
+        return stop.value
+
+def _advance(resume, value) -> tuple:
+    # StopIteration no puede cruzar un Future: se devuelve como (terminado, valor)
+    try:
+        return False, resume(value)
+    except StopIteration as stop:
+        return True, stop.value
+
+async def _reply_async(steps: Generator, enrichment: Awaitable) -> tuple:
+    # to_thread copia el contexto, así el snapshot fijado sigue visible en el hilo
+    try:
+        reply = await enrichment
+    except Exception as exc:
+        return await asyncio.to_thread(_advance, steps.throw, exc)
+    return await asyncio.to_thread(_advance, steps.send, reply)
+
+async def _run_steps_async(steps: Generator, within_budget: bool = True) -> Dict[str, Any]:
+    done, value = await asyncio.to_thread(_advance, steps.send, None)
+    while not done:
+        done, value = await _reply_async(steps, llm.enrich_query_async(*value, within_budget=within_budget))
+    return value
+
+def _local_parse(text: str, rules: Dict[str, Any]) -> Dict[str, Any]:
+    """Vista previa con las reglas ya calculadas, para mostrar mientras responde el LLM."""
+    value = _merge_llm(text, deepcopy(rules), {})
+    pending = {"status": "pending", "provider": llm.provider_name() or "desconocido"}
+    value["status"]["llm"] = pending
+    value["query"]["metadata"]["llm"] = dict(pending)
+    return value
+
+async def parse_stages(text: str) -> AsyncIterator[Tuple[str, Dict[str, Any]]]:
+    """Interpretación progresiva: ("local", solo reglas, con `llm.status = "pending"`) y
+    después ("final", combinada con el LLM, sin presupuesto de latencia). Si no hace falta
+    esperar al LLM (deshabilitado o ya memoizado) entrega solo "final"."""
+    with snapshot.pinned() as snap:
+        key = (normalize_soft(text), snap.version, llm.cache_identity())
+        result = _cached_parse(key, text)
+        if result is not None:
+            yield "final", result
+            return
+        # las reglas locales corren una sola vez: la vista previa y el resultado final parten de ellas
+        rules = await asyncio.to_thread(_parse_rules, text)
+        steps = _parse_steps(text, rules)
+        done, value = await asyncio.to_thread(_advance, steps.send, None)
+        if not done:
+            # el LLM arranca ya; mientras responde se arma la vista previa local
+            pending = asyncio.ensure_future(llm.enrich_query_async(*value, within_budget=False))
+            try:
+                yield "local", await asyncio.to_thread(_local_parse, text, rules)
+                done, value = await _reply_async(steps, pending)
+            finally:
+                pending.cancel()
+            while not done:
+                done, value = await _reply_async(steps, llm.enrich_query_async(*value, within_budget=False))
+        _store_parse(key, value)
+        yield "final", value
+
+def cache_stats() -> Dict[str, Any]:
+    return PARSE_CACHE.stats()
+
+def _parse_rules(text: str) -> Dict[str, Any]:
+    """Reglas locales: todo lo que no depende del LLM. Su resultado se combina con la
+    respuesta en `_merge_llm`; `parse_stages` lo reutiliza para la vista previa."""
     plan = []
     tn = normalize(text)
     text_soft = normalize_soft(text)
@@ -645,10 +795,6 @@ def parse(text: str):
         filters["intent_tags_any"] = sorted(set((filters.get("intent_tags_any") or []) + intent_tags_local))
     advisor_summary = " ".join(scenario_summaries).strip() or None
 
-    llm_headline = None
-    llm_details = None
-    llm_notes_accum: List[str] = []
-    llm_info: Dict[str, Any]
     llm_provider = llm.provider_name()
     llm_enabled_flag = llm.llm_enabled()
     if llm_enabled_flag:
@@ -656,30 +802,69 @@ def parse(text: str):
     else:
         llm_info = {"status": "disabled"}
         plan.append("LLM deshabilitado: se utilizan únicamente reglas locales.")
+    return {
+        "plan": plan,
+        "text_soft": text_soft,
+        "rest_hits": rest_hits,
+        "filters": filters,
+        "filters_before_llm": filters_before_llm,
+        "auto_constraints": auto_constraints,
+        "hints": hints,
+        "ranking_overrides": ranking_overrides,
+        "scenario_tags": scenario_tags,
+        "advisor_summary": advisor_summary,
+        "llm_provider": llm_provider,
+        "llm_enabled": llm_enabled_flag,
+        "llm_info": llm_info,
+    }
 
+def _parse_steps(text: str, rules: Optional[Dict[str, Any]] = None) -> Generator[tuple, Optional[Dict[str, Any]], Dict[str, Any]]:
+    """Interpretación completa. Cede `(texto, contexto)` cuando hace falta el LLM y
+    recibe el enriquecimiento (o la excepción) de quien la ejecuta: `_run_steps`
+    o `_run_steps_async`. Con `rules` no se vuelven a correr las reglas locales."""
+    if rules is None:
+        rules = _parse_rules(text)
+    plan = rules["plan"]
+    llm_provider = rules["llm_provider"]
     enrichment: Dict[str, Any] = {}
-    llm_raw_snapshot: Dict[str, Any] = {}
-    llm_applied_filters: Dict[str, Any] = {}
-    llm_overrides_applied: Dict[str, Any] = {}
-    if llm_enabled_flag:
+    if rules["llm_enabled"]:
         try:
-            enrichment = llm.enrich_query(
+            enrichment = (yield (
                 text,
                 {
-                    "filters": filters,
-                    "hints": hints,
-                    "scenario_tags": scenario_tags,
-                    "catalog_facets": CATALOG_FACETS,
+                    "filters": rules["filters"],
+                    "hints": rules["hints"],
+                    "scenario_tags": rules["scenario_tags"],
+                    "catalog_facets": _state()["catalog_facets"],
                 },
-            ) or {}
+            )) or {}
+        except llm.LLMTimeout as exc:
+            rules["llm_info"] = {"status": "timeout", "provider": llm_provider or "Groq", "message": str(exc)}
+            plan.append(f"⏱️ IA ({llm_provider or 'Groq'}) fuera de presupuesto: {exc}")
         except llm.LLMError as exc:
             error_msg = f"Error de IA ({llm_provider or 'Groq'}): {str(exc)}"
-            llm_info = {"status": "error", "provider": llm_provider or "Groq", "message": error_msg}
+            rules["llm_info"] = {"status": "error", "provider": llm_provider or "Groq", "message": error_msg}
             plan.append(f"❌ {error_msg}")
         except Exception as exc:
             error_msg = f"Error inesperado de IA ({llm_provider or 'Groq'}): {str(exc)}"
-            llm_info = {"status": "error", "provider": llm_provider or "Groq", "message": error_msg}
+            rules["llm_info"] = {"status": "error", "provider": llm_provider or "Groq", "message": error_msg}
             plan.append(f"❌ {error_msg}")
+    return _merge_llm(text, rules, enrichment)
+
+def _merge_llm(text: str, rules: Dict[str, Any], enrichment: Dict[str, Any]) -> Dict[str, Any]:
+    """Combina el enriquecimiento del LLM (vacío si no hubo) con `rules` y arma la respuesta.
+    Modifica `rules`: para reutilizarlas después, pasar una copia."""
+    plan, filters, hints = rules["plan"], rules["filters"], rules["hints"]
+    ranking_overrides, scenario_tags = rules["ranking_overrides"], rules["scenario_tags"]
+    text_soft, rest_hits = rules["text_soft"], rules["rest_hits"]
+    auto_constraints, filters_before_llm = rules["auto_constraints"], rules["filters_before_llm"]
+    advisor_summary, llm_info, llm_enabled_flag = rules["advisor_summary"], rules["llm_info"], rules["llm_enabled"]
+    llm_headline = None
+    llm_details = None
+    llm_notes_accum: List[str] = []
+    llm_raw_snapshot: Dict[str, Any] = {}
+    llm_applied_filters: Dict[str, Any] = {}
+    llm_overrides_applied: Dict[str, Any] = {}
 
     if enrichment:
         llm_raw_snapshot = deepcopy(enrichment)
@@ -809,7 +994,7 @@ def parse(text: str):
                     val = _numeric_value(wv)
                     if val is not None:
                         ranking_overrides["weights"][wk] = val
-    elif llm_enabled_flag and llm_info.get("status") not in {"error"}:
+    elif llm_enabled_flag and llm_info.get("status") not in {"error", "timeout"}:
         llm_info["status"] = "no_data"
 
     def _enforce_course_preferences() -> None:
@@ -869,7 +1054,7 @@ def parse(text: str):
         filters["intent_tags_any"] = sorted(set(filters["intent_tags_any"]))
 
     catalog_min_price = None
-    prices_snapshot = CATALOG_METRICS.get("prices") or []
+    prices_snapshot = _state()["catalog_metrics"].get("prices") or []
     if prices_snapshot:
         catalog_min_price = prices_snapshot[0]
     price_filter_value = _numeric_value(filters.get("price_max"))
@@ -924,12 +1109,7 @@ def parse(text: str):
     }
 
 def parse_meal_moments(text_norm: str, plan: List[str]):
-    mm = []
-    for tag, syns in MEAL_MOMENTS.items():
-        for s in syns:
-            if re.search(rf"\b{re.escape(s)}\b", text_norm):
-                mm.append(tag)
-                break
+    mm = [tag for tag, _ in _dictionary_matches(text_norm, "meal_moments")]
     if mm:
         plan.append(f"Meal moments: {sorted(set(mm))}")
     extra = []
@@ -954,11 +1134,6 @@ def _build_synonym_lookup(source: Dict[str, Any]) -> Dict[str, str]:
                 lookup[norm] = canonical
     return lookup
 
-
-INGREDIENT_LOOKUP = _build_synonym_lookup(INGREDIENTS)
-ALLERGEN_LOOKUP = _build_synonym_lookup(ALLERGENS)
-DIET_LOOKUP = _build_synonym_lookup(DIETS)
-HEALTH_LOOKUP = _build_synonym_lookup(HEALTH.get("tags", {}))
 def _sanitize_llm_list_values(key: str, values: Any) -> List[str]:
     raw_values = [v for v in _as_list(values) if v]
     if not raw_values:
@@ -970,32 +1145,71 @@ def _sanitize_llm_list_values(key: str, values: Any) -> List[str]:
             return None
         return lookup.get(norm)
 
+    state = _state()
     if key in {"ingredients_include", "ingredients_exclude"}:
         sanitized = []
         for token in raw_values:
-            canonical = canon_from_lookup(token, INGREDIENT_LOOKUP)
+            canonical = canon_from_lookup(token, state["ingredient_lookup"])
             if canonical:
                 sanitized.append(canonical)
         return sanitized
     if key == "diet_must":
         sanitized = []
         for token in raw_values:
-            canonical = canon_from_lookup(token, DIET_LOOKUP)
+            canonical = canon_from_lookup(token, state["diet_lookup"])
             if canonical:
                 sanitized.append(canonical)
         return sanitized
     if key == "allergens_exclude":
         sanitized = []
         for token in raw_values:
-            canonical = canon_from_lookup(token, ALLERGEN_LOOKUP)
+            canonical = canon_from_lookup(token, state["allergen_lookup"])
             if canonical:
                 sanitized.append(canonical)
         return sanitized
     if key == "health_any":
         sanitized = []
         for token in raw_values:
-            canonical = canon_from_lookup(token, HEALTH_LOOKUP)
+            canonical = canon_from_lookup(token, state["health_lookup"])
             if canonical:
                 sanitized.append(canonical)
         return sanitized
     return [str(v) for v in raw_values if v]
+
+
+def build_state(snap) -> Dict[str, Any]:
+    """Diccionarios e índices del parser para un snapshot (se llama al publicar cada versión)."""
+    dictionaries = snap.dictionaries
+    restaurant_name_index = _restaurant_name_index(snap.restaurant_names)
+    # Un único autómata con todos los sinónimos de diccionario: cada consulta se recorre una vez
+    dictionary_index = _dictionary_index(dictionaries)
+    dictionary_matcher = AhoCorasick(sorted(dictionary_index)).build()
+    return {
+        "categories": dictionaries["categories"],
+        "ingredients": dictionaries["ingredients"],
+        "diets": dictionaries["diets"],
+        "allergens": dictionaries["allergens"],
+        "health": dictionaries["health"],
+        "intents": dictionaries["intents"],
+        "catalog_facets": _catalog_facets(dictionaries),
+        "restaurant_names": snap.restaurant_names,
+        "catalog_metrics": snap.catalog_metrics,
+        "restaurant_name_index": restaurant_name_index,
+        "restaurant_matcher": AhoCorasick(restaurant_name_index).build(),
+        "dictionary_matcher": dictionary_matcher,
+        "dictionary_index": dictionary_index,
+        "dictionary_hits": lru_cache(maxsize=256)(partial(_dictionary_hits, dictionary_matcher)),
+        "ingredient_synonym_index": _build_synonym_index(dictionaries["ingredients"]),
+        "allergen_synonym_index": _build_synonym_index(dictionaries["allergens"]),
+        "ingredient_lookup": _build_synonym_lookup(dictionaries["ingredients"]),
+        "allergen_lookup": _build_synonym_lookup(dictionaries["allergens"]),
+        "diet_lookup": _build_synonym_lookup(dictionaries["diets"]),
+        "health_lookup": _build_synonym_lookup(dictionaries["health"].get("tags", {})),
+    }
+
+
+def update_state(state: Dict[str, Any], snap) -> Dict[str, Any]:
+    """Estado del parser tras deltas de catálogo: solo cambian las distribuciones de precio y ETA."""
+    out = dict(state)
+    out["catalog_metrics"] = snap.catalog_metrics
+    return out
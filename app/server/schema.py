@@ -48,6 +48,7 @@ class RankingOverrides(BaseModel):
     boost_tags: List[str] = Field(default_factory=list)
     penalize_tags: List[str] = Field(default_factory=list)
     weights: Dict[str, float] = Field(default_factory=dict)
+    lexical: Optional[str] = None  # "overlap" (por defecto) o "bm25"
 
 class ParsedQuery(BaseModel):
     q: str
@@ -60,14 +61,43 @@ class ParsedQuery(BaseModel):
     metadata: Dict[str, Any] = Field(default_factory=dict)
 
 class SearchRequest(BaseModel):
-    query: Optional[ParsedQuery] = None
-    filters: Optional[ParseFilters] = None
+    # la consulta viaja tal como la devuelve /parse (ParsedQuery más metadatos propios)
+    query: Optional[Dict[str, Any]] = None
+    filters: Optional[Dict[str, Any]] = None
+    limit: Optional[int] = Field(None, ge=0)  # None devuelve todos los resultados
+    offset: int = Field(0, ge=0)
+    explain: bool = False  # agrega componentes, pesos y aportes por resultado
+
+# página por defecto y máxima de /query y /search/stream: un viaje barato, nunca el ranking entero
+QUERY_PAGE_SIZE = 20
+QUERY_MAX_LIMIT = 100
+
+class QueryRequest(BaseModel):
+    text: str
+    limit: int = Field(QUERY_PAGE_SIZE, ge=0, le=QUERY_MAX_LIMIT)
+    offset: int = Field(0, ge=0)
+    explain: bool = False
+    include_parse: bool = False  # suma la interpretación completa en `parsed`
 
 class SearchResult(BaseModel):
     item: Dish
     score: float
     reasons: List[str]
+    explanation: Optional[Dict[str, Any]] = None
 
 class SearchResponse(BaseModel):
     results: List[SearchResult]
+    total: int = 0
+    offset: int = 0
+    limit: Optional[int] = None
     plan: Dict[str, Any]
+
+class CatalogItemDelta(BaseModel):
+    id: str
+    available: Optional[bool] = None
+    price_ars: Optional[int] = Field(None, ge=0)
+    discount_pct: Optional[int] = Field(None, ge=0, le=100)
+    eta_min: Optional[int] = Field(None, ge=0)  # ETA del restaurante para este plato
+
+class CatalogDeltaRequest(BaseModel):
+    items: List[CatalogItemDelta] = Field(default_factory=list)
@@ -0,0 +1,222 @@
+import copy
+from typing import TYPE_CHECKING, Any, Dict, Iterable, List, Tuple
+
+import numpy as np
+
+if TYPE_CHECKING:
+    from .columnar import ColumnarCatalog
+
+
+def _norm_column(values: List[float], vmin: float, vmax: float) -> np.ndarray:
+    # (val - vmin) / (vmax - vmin) acotado a [0, 1], aplicado a toda la columna de una vez
+    arr = np.asarray(values, dtype=np.float64)
+    if vmax == vmin:
+        return np.zeros(len(arr), dtype=np.float64)
+    return np.clip((arr - vmin) / (vmax - vmin), 0.0, 1.0)
+
+
+def positions_by_key(pairs: Iterable[Tuple[int, Iterable[str]]]) -> Dict[str, np.ndarray]:
+    # clave -> posiciones ordenadas en que aparece
+    postings: Dict[str, List[int]] = {}
+    for pos, keys in pairs:
+        for key in set(keys):
+            postings.setdefault(key, []).append(pos)
+    return {key: np.asarray(p, dtype=np.intp) for key, p in postings.items()}
+
+
+# combinaciones de pesos con score estático memoizado por snapshot
+STATIC_CACHE_SIZE = 32
+
+# columnas que pueden cambiar por deltas: atributo, columna del catálogo, límites en IDX, invertida
+DELTA_COLUMNS = (
+    ("price_inv", "price_ars", "price_min", "price_max", True),
+    ("eta_inv", "restaurant.eta_min", "eta_min", "eta_max", True),
+    ("promo_n", "discount_pct", "discount_min", "discount_max", False),
+)
+
+
+class ColumnarScorer:
+    """Scoring vectorizado sobre columnas NumPy del catálogo.
+
+    Las columnas numéricas se normalizan una sola vez contra los límites de `IDX`;
+    cada consulta es una suma ponderada sobre las posiciones candidatas, con
+    boosts y penalizaciones aplicados como máscaras de tags.
+    """
+
+    def __init__(self, catalog: "ColumnarCatalog", idx: Dict[str, Any]):
+        self.size = len(catalog)
+        self.bounds = {key: idx[key] for _, _, lo, hi, _ in DELTA_COLUMNS for key in (lo, hi)}
+        self.rating_n = _norm_column(catalog.column("restaurant.rating"), idx["rating_min"], idx["rating_max"])
+        for attr, field, lo, hi, inverted in DELTA_COLUMNS:
+            normed = _norm_column(catalog.column(field, default=0), idx[lo], idx[hi])
+            setattr(self, attr, 1 - normed if inverted else normed)
+        self.pop_n = catalog.column("popularity", default=0).astype(np.float64) / 100.0
+        self.fee_inv = 1 - _norm_column(
+            catalog.column("delivery_fee", default=idx["fee_max"]), idx["fee_min"], idx["fee_max"]
+        )
+        self.neighborhoods = positions_by_key(
+            (pos, [name]) for pos, name in enumerate(catalog.strings("restaurant.neighborhood"))
+        )
+        self.restaurants = positions_by_key(
+            (pos, [name]) for pos, name in enumerate(catalog.strings("restaurant.name"))
+        )
+        self._static: Dict[tuple, np.ndarray] = {}
+        self.tags = positions_by_key(
+            (pos, health + categories + experience + [cuisines.lower()])
+            for pos, (health, categories, experience, cuisines) in enumerate(zip(
+                catalog.lists("health_tags"), catalog.lists("categories"),
+                catalog.lists("experience_tags"), catalog.strings("restaurant.cuisines"),
+            ))
+        )
+
+    def updated(self, catalog: "ColumnarCatalog", idx: Dict[str, Any], positions: List[int]) -> "ColumnarScorer":
+        """Copia con precio, ETA y descuento actualizados para `positions`.
+
+        Si cambiaron los límites de normalización de una columna se recalcula
+        completa; si no, solo las posiciones modificadas. El original no se toca.
+        """
+        new = copy.copy(self)
+        new.bounds = {key: idx[key] for key in self.bounds}
+        for attr, field, lo, hi, inverted in DELTA_COLUMNS:
+            vmin, vmax = idx[lo], idx[hi]
+            values = catalog.column(field, default=0)
+            if (vmin, vmax) != (self.bounds[lo], self.bounds[hi]):
+                normed = _norm_column(values, vmin, vmax)
+                column = 1 - normed if inverted else normed
+            else:
+                normed = _norm_column(values[positions], vmin, vmax)
+                column = getattr(self, attr).copy()
+                column[positions] = 1 - normed if inverted else normed
+            setattr(new, attr, column)
+        new._static = {}
+        return new
+
+    def static_scores(self, weights: Dict[str, float]) -> np.ndarray:
+        """Score sin léxico ni boosts (distancia 0.5) de todo el catálogo para `weights`.
+
+        Se calcula una vez por snapshot y combinación de pesos; las consultas solo
+        leen las posiciones que les interesan.
+        """
+        key = tuple(weights[k] for _, k in COMPONENT_WEIGHTS)
+        static = self._static.get(key)
+        if static is None:
+            static = (
+                weights["rating"] * self.rating_n +
+                weights["price"] * self.price_inv +
+                weights["eta"] * self.eta_inv +
+                weights["pop"] * self.pop_n +
+                weights["dist"] * 0.5 +
+                weights["promo"] * self.promo_n +
+                weights["fee"] * self.fee_inv
+            )
+            if len(self._static) >= STATIC_CACHE_SIZE:
+                self._static.clear()
+            self._static[key] = static
+        return static
+
+    def upper_bound(
+        self,
+        positions: np.ndarray,
+        lex: np.ndarray,
+        weights: Dict[str, float],
+        filters: Dict[str, Any],
+        query: Dict[str, Any],
+    ) -> np.ndarray:
+        """Cota superior de `score` para `positions` sin armar sus componentes: el
+        score estático más lo máximo que pueden sumar distancia, restaurante y boosts."""
+        base = self.static_scores(weights)[positions] + weights["lex"] * np.asarray(lex, dtype=np.float64)
+        if (filters or {}).get("neighborhood_any"):
+            base = base + abs(weights["dist"]) * 0.5
+        if (query.get("metadata") or {}).get("restaurant_hits"):
+            base = base + 0.4
+        ro = query.get("ranking_overrides") or {}
+        multipliers = [1.0]
+        if ro.get("boost_tags"):
+            multipliers.append(1.10)
+        if ro.get("penalize_tags"):
+            multipliers += [0.85, 1.10 * 0.85] if ro.get("boost_tags") else [0.85]
+        return np.max([m * base for m in multipliers], axis=0)
+
+    def _mask(self, postings: Dict[str, np.ndarray], keys: Iterable[str], positions: np.ndarray) -> np.ndarray:
+        # alineada con `positions`: no arma máscaras del tamaño del catálogo
+        hits = [postings[key] for key in keys if key in postings]
+        if not hits:
+            return np.zeros(len(positions), dtype=bool)
+        return np.isin(positions, np.concatenate(hits))
+
+    def score(
+        self,
+        positions: np.ndarray,
+        weights: Dict[str, float],
+        filters: Dict[str, Any],
+        query: Dict[str, Any],
+        lex: np.ndarray,
+    ) -> Tuple[np.ndarray, Dict[str, np.ndarray]]:
+        """Devuelve scores y componentes alineados con `positions`."""
+        nhs = (filters or {}).get("neighborhood_any") or []
+        if nhs:
+            dist = self._mask(self.neighborhoods, nhs, positions).astype(np.float64)
+        else:
+            dist = np.full(len(positions), 0.5)
+        components = {
+            "rating": self.rating_n[positions],
+            "price_inv": self.price_inv[positions],
+            "eta_inv": self.eta_inv[positions],
+            "pop": self.pop_n[positions],
+            "dist": dist,
+            "lex": np.asarray(lex, dtype=np.float64),
+            "promo": self.promo_n[positions],
+            "fee_inv": self.fee_inv[positions],
+        }
+        # Mismo orden de operaciones que la fórmula por plato (ver tests) para resultados idénticos
+        scores = (
+            weights["rating"] * components["rating"] +
+            weights["price"] * components["price_inv"] +
+            weights["eta"] * components["eta_inv"] +
+            weights["pop"] * components["pop"] +
+            weights["dist"] * components["dist"] +
+            weights["lex"] * components["lex"] +
+            weights["promo"] * components["promo"] +
+            weights["fee"] * components["fee_inv"]
+        )
+        restaurant_hits = (query.get("metadata") or {}).get("restaurant_hits") or []
+        components["rest_hit"] = self._mask(self.restaurants, restaurant_hits, positions)
+        scores = np.where(components["rest_hit"], scores + 0.4, scores)
+        ro = query.get("ranking_overrides") or {}
+        components["boost"] = self._mask(self.tags, ro.get("boost_tags") or [], positions)
+        components["penal"] = self._mask(self.tags, ro.get("penalize_tags") or [], positions)
+        scores = np.where(components["boost"], scores * 1.10, scores)
+        scores = np.where(components["penal"], scores * 0.85, scores)
+        return scores, components
+
+
+# componente -> clave de peso, en el orden en que se reportan las razones
+COMPONENT_WEIGHTS = (
+    ("rating", "rating"),
+    ("price_inv", "price"),
+    ("eta_inv", "eta"),
+    ("pop", "pop"),
+    ("dist", "dist"),
+    ("lex", "lex"),
+    ("promo", "promo"),
+    ("fee_inv", "fee"),
+)
+FLAG_COMPONENTS = ("rest_hit", "boost", "penal")
+
+
+def format_reasons(components: Dict[str, np.ndarray], i: int) -> List[str]:
+    """Razones compactas de un resultado; se formatean solo para la página devuelta."""
+    reasons = [f"{name}:{components[name][i]:.2f}" for name, _ in COMPONENT_WEIGHTS]
+    reasons.extend(flag for flag in FLAG_COMPONENTS if components[flag][i])
+    return reasons
+
+
+def explain_score(components: Dict[str, np.ndarray], weights: Dict[str, float], i: int) -> Dict[str, Any]:
+    """Explicación completa de un resultado: valores crudos, pesos y aportes."""
+    values = {name: float(components[name][i]) for name, _ in COMPONENT_WEIGHTS}
+    return {
+        "components": values,
+        "weights": {name: weights[key] for name, key in COMPONENT_WEIGHTS},
+        "contributions": {name: weights[key] * values[name] for name, key in COMPONENT_WEIGHTS},
+        "flags": {flag: bool(components[flag][i]) for flag in FLAG_COMPONENTS},
+    }
@@ -1,64 +1,30 @@
 
-import json, math, re
-from typing import Dict, Any, List, Tuple, Set
-from pathlib import Path
-from .schema import Dish, SearchRequest, SearchResponse, SearchResult
+import heapq, json, os, re
+from typing import Dict, Any, FrozenSet, Iterable, List, Optional, Tuple, Set
+from .scoring import ColumnarScorer, explain_score, format_reasons, positions_by_key
+from .lexical import BM25Index
+from .columnar import ColumnarCatalog, DishRecord
+from .cache import LRUCache, canonical_hash
+from . import snapshot
+import numpy as np
 
 def _norm_str(t: str) -> str:
     return (t or "").lower()\
         .replace("á","a").replace("é","e").replace("í","i")\
         .replace("ó","o").replace("ú","u").replace("ñ","n")
 
-DATA_DIR = Path(__file__).resolve().parent.parent / "data"
-DICT_DIR = DATA_DIR / "dictionaries"
-
-CATALOG: List[Dict[str, Any]] = json.loads((DATA_DIR / "catalog.json").read_text(encoding="utf-8"))
-
-ROMANTIC_CATEGORIES = {"pasta", "sushi", "parrilla", "wok", "postres"}
-FRIENDS_CATEGORIES = {"pizza", "hamburguesas", "tacos", "sandwiches", "empanadas"}
-FAMILY_CATEGORIES = {"parrilla", "pasta", "sopas", "bowls"}
-HEALTH_CATEGORIES = {"ensaladas", "bowls", "wok"}
-
-
-def augment_catalog_intents() -> None:
-    for dish in CATALOG:
-        tags = set(dish.get("intent_tags") or dish.get("experience_tags") or [])
-        tags.add("delivery_dining")
-        categories = {c.lower() for c in dish.get("categories", [])}
-        cuisine = _norm_str(dish.get("restaurant", {}).get("cuisines", ""))
-        rating = dish.get("restaurant", {}).get("rating", 0)
-        price = dish.get("price_ars", 0)
-        eta = dish.get("restaurant", {}).get("eta_min", 60)
-        health_tags = set(_norm_str(t) for t in dish.get("health_tags", []))
-
-        if rating >= 4.4 and (categories & ROMANTIC_CATEGORIES or cuisine in {"italiana", "sushi", "parrilla"}):
-            tags.update({"romantic_evening", "date_night"})
-        if categories & FRIENDS_CATEGORIES:
-            tags.update({"friends_gathering", "movie_night"})
-        if categories & FAMILY_CATEGORIES:
-            tags.add("family_sharing")
-        if categories & HEALTH_CATEGORIES or health_tags & {"no_fry", "low_sodium"}:
-            tags.add("healthy_choice")
-        if price <= 6000:
-            tags.add("budget_friendly")
-        if eta <= 25:
-            tags.update({"express_delivery", "quick_lunch"})
-        if rating >= 4.7:
-            tags.add("top_rated")
-        if "postres" in categories:
-            tags.add("sweet_treat")
-
-        dish["intent_tags"] = sorted(tags)
-
-
-augment_catalog_intents()
-
-def load_ingredient_synonyms() -> Dict[str, str]:
+def _state() -> Dict[str, Any]:
+    # Catálogo e índices del snapshot vigente (ver snapshot.py y build_state)
+    return snapshot.current().search
+
+def __getattr__(name: str):
+    # Compatibilidad: CATALOG, IDX, FILTER_INDEX, ... se leen del snapshot vigente
+    if name.isupper() and name.lower() in _state():
+        return _state()[name.lower()]
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+def load_ingredient_synonyms(data: Dict[str, Any]) -> Dict[str, str]:
     mapping: Dict[str, str] = {}
-    try:
-        data = json.loads((DICT_DIR / "ingredients.json").read_text(encoding="utf-8"))
-    except FileNotFoundError:
-        return mapping
     for canonical, obj in data.items():
         norm_canon = _norm_str(canonical)
         mapping.setdefault(norm_canon, canonical)
@@ -66,14 +32,8 @@ def load_ingredient_synonyms() -> Dict[str, str]:
             mapping.setdefault(_norm_str(syn), canonical)
     return mapping
 
-INGREDIENT_SYNONYM_MAP = load_ingredient_synonyms()
-
-def load_ingredient_groups() -> Dict[str, Set[str]]:
+def load_ingredient_groups(data: Dict[str, Any]) -> Dict[str, Set[str]]:
     groups: Dict[str, Set[str]] = {}
-    try:
-        data = json.loads((DICT_DIR / "ingredients.json").read_text(encoding="utf-8"))
-    except FileNotFoundError:
-        return groups
     for canonical, obj in data.items():
         normalized = { _norm_str(canonical) }
         for syn in obj.get("synonyms", []):
@@ -81,129 +41,180 @@ def load_ingredient_groups() -> Dict[str, Set[str]]:
         groups[canonical] = normalized
     return groups
 
-INGREDIENT_GROUPS = load_ingredient_groups()
-
-def norm(val, vmin, vmax):
-    if vmax == vmin:
-        return 0.0
-    return max(0.0, min(1.0, (val - vmin) / (vmax - vmin)))
+# Caché de rankings (posiciones + scores de la página, nunca copias de platos).
+# La clave incluye la versión del snapshot, así que cada recarga o delta la invalida.
+RESULT_CACHE_SIZE = int(os.getenv("SEARCH_CACHE_SIZE", "1024"))
+RESULT_CACHE_TTL_SEC = float(os.getenv("SEARCH_CACHE_TTL_SEC", "300"))
+# Páginas más largas no se guardan (búsquedas sin `limit` que devuelven miles de platos)
+RESULT_CACHE_MAX_RESULTS = int(os.getenv("SEARCH_CACHE_MAX_RESULTS", "200"))
+RESULT_CACHE = LRUCache(RESULT_CACHE_SIZE, RESULT_CACHE_TTL_SEC)
 
 BASE_WEIGHTS = {"rating":0.25,"price":0.2,"eta":0.1,"pop":0.1,"dist":0.1,"lex":0.1,"promo":0.1,"fee":0.05}
 
-def build_indexes():
-    prices = [d["price_ars"] for d in CATALOG]
-    etas = [d["restaurant"]["eta_min"] for d in CATALOG]
-    ratings = [d["restaurant"]["rating"] for d in CATALOG]
-    fees = [d.get("delivery_fee", 0) for d in CATALOG]
-    discounts = [d.get("discount_pct", 0) for d in CATALOG]
-    return {
-        "price_min": min(prices), "price_max": max(prices),
-        "eta_min": min(etas), "eta_max": max(etas),
-        "rating_min": min(ratings), "rating_max": max(ratings),
-        "fee_min": min(fees), "fee_max": max(fees),
-        "discount_min": min(discounts), "discount_max": max(discounts),
-        "prices_sorted": sorted(prices)
-    }
-
-IDX = build_indexes()
-
 def percentile_price(label: str) -> int:
     # label like "p20"
     try:
+        prices_sorted = _state()["idx"]["prices_sorted"]
         p = int(label[1:]) / 100.0
-        idx = max(0, min(len(IDX["prices_sorted"])-1, int(p * len(IDX["prices_sorted"]))-1))
-        return IDX["prices_sorted"][idx]
+        idx = max(0, min(len(prices_sorted)-1, int(p * len(prices_sorted))-1))
+        return prices_sorted[idx]
     except Exception:
         return None
 
 
 
-def lex_score(q: str, dish: Dict[str, Any], filters: Dict[str, Any]) -> float:
+def _lex_text(name: str, description: str, synonyms: Iterable[str], ingredients: Iterable[str], restaurant: str) -> FrozenSet[str]:
+    base = " ".join([name, description, " ".join(synonyms), " ".join(ingredients), restaurant])
+    return frozenset(re.findall(r"\w+", _norm_str(base)))
+
+def build_lexical_index(catalog: ColumnarCatalog) -> Dict[str, Any]:
+    """Postings token -> posiciones para `lex_scores`; los tokens por plato no se guardan."""
+    restaurant_names = catalog.strings("restaurant.name")
+    tokens = [
+        _lex_text(*fields)
+        for fields in zip(
+            catalog.strings("dish_name"),
+            catalog.strings("description"),
+            catalog.lists("synonyms"),
+            catalog.lists("ingredients"),
+            restaurant_names,
+        )
+    ]
+    postings: Dict[str, List[int]] = {}
+    for pos, dish_tokens in enumerate(tokens):
+        for token in dish_tokens:
+            postings.setdefault(token, []).append(pos)
+    restaurants: Dict[str, List[int]] = {}
+    for pos, name in enumerate(restaurant_names):
+        restaurants.setdefault(_norm_str(name), []).append(pos)
+    return {
+        "size": len(catalog),
+        "postings": {token: np.asarray(p, dtype=np.intp) for token, p in postings.items()},
+        "restaurants": {rn: np.asarray(p, dtype=np.intp) for rn, p in restaurants.items() if rn},
+    }
+
+def lex_scores(q: str, positions: np.ndarray, filters: Dict[str, Any]) -> np.ndarray:
+    """Componente `lex` de las posiciones candidatas: fracción de palabras de la
+    consulta presentes en el plato, +0.4 si nombra a su restaurante.
+
+    La consulta se tokeniza una sola vez y solo se acumula solapamiento para los
+    platos que comparten al menos un token (vía postings).
+    """
     if not q:
-        return 0.0
+        return np.zeros(len(positions))
     qn = _norm_str(q)
     q_words = set(re.findall(r"\w+", qn))
-
-    base = " ".join([
-        dish["dish_name"],
-        dish["description"],
-        " ".join(dish.get("synonyms", [])),
-        " ".join(dish.get("ingredients", [])),
-        dish["restaurant"]["name"],
-    ])
-    base = _norm_str(base)
-    base_words = set(re.findall(r"\w+", base))
-
     if not q_words:
-        return 0.0
-
-    inter = q_words & base_words
-    score = len(inter) / max(1, len(q_words))
+        return np.zeros(len(positions))
+    state = _state()
+    lex_index = state["lex_index"]
+    counts = np.zeros(lex_index["size"])
+    for word in q_words:
+        hit = lex_index["postings"].get(word)
+        if hit is not None:
+            counts[hit] += 1
+    scores = counts / max(1, len(q_words))
 
     # boost por nombre de restaurante exacto, pero solo si no contradice categorías pedidas
-    rn = _norm_str(dish["restaurant"]["name"])
     cat_filter = set((filters or {}).get("category_any") or [])
-    if rn and rn in qn and (not cat_filter or any(c in dish.get("categories", []) for c in cat_filter)):
-        score = min(1.0, score + 0.4)
-    return score
-
-
-
-def expand_ingredients(ingredients: List[str]) -> Set[str]:
+    allowed = _union(state["filter_index"], "category", cat_filter) if cat_filter else None
+    for rn, hit in lex_index["restaurants"].items():
+        if rn not in qn:
+            continue
+        if allowed is not None:
+            hit = hit[allowed[hit]]
+        scores[hit] = np.minimum(1.0, scores[hit] + 0.4)
+    return scores[positions]
+
+def build_ingredient_canonicals(groups: Dict[str, Set[str]]) -> Dict[str, Set[str]]:
+    # Inverso de los grupos de ingredientes: token normalizado -> canónicos cuyo grupo lo contiene
+    reverse: Dict[str, Set[str]] = {}
+    for canonical, group in groups.items():
+        for token in group:
+            reverse.setdefault(token, set()).add(canonical)
+    return reverse
+
+def expand_ingredients(ingredients: List[str], canonicals: Optional[Dict[str, Set[str]]] = None) -> Set[str]:
+    if canonicals is None:
+        canonicals = _state()["ingredient_canonicals"]
     tokens = {_norm_str(raw) for raw in ingredients}
     canonical_hits = set()
-    for canonical, group in INGREDIENT_GROUPS.items():
-        if group & tokens:
-            canonical_hits.add(canonical)
+    for token in tokens:
+        canonical_hits |= canonicals.get(token, set())
     return tokens | canonical_hits
 
-def apply_filters(d: Dict[str, Any], f: Dict[str, Any]) -> Tuple[bool, List[str]]:
+def build_dish_ingredients(catalog: ColumnarCatalog, canonicals: Dict[str, Set[str]]) -> List[FrozenSet[str]]:
+    """Ingredientes normalizados + canónicos de cada plato, alineados por posición.
+
+    Platos con la misma lista de ingredientes comparten el mismo frozenset.
+    """
+    shared: Dict[Tuple[str, ...], FrozenSet[str]] = {}
+    expanded: List[FrozenSet[str]] = []
+    for ingredients in catalog.lists("ingredients"):
+        key = tuple(ingredients)
+        if key not in shared:
+            shared[key] = frozenset(expand_ingredients(list(key), canonicals))
+        expanded.append(shared[key])
+    return expanded
+
+def dish_ingredients(d: DishRecord) -> FrozenSet[str]:
+    return _state()["dish_ingredients"][d.pos]
+
+def _ingredient_keys(i: str) -> Set[str]:
+    ni = _norm_str(i)
+    keys = {ni, i}
+    canonical = _state()["ingredient_synonym_map"].get(ni)
+    if canonical is not None:
+        keys.add(canonical)
+    return keys
+
+def apply_filters(d: DishRecord, f: Dict[str, Any]) -> Tuple[bool, List[str]]:
     reasons = []
-    dish_ingredients = expand_ingredients(d.get("ingredients", []))
-    if f.get("available_only", True) and not d.get("available", True):
+    if f.get("available_only", True) and not d.available:
         return False, ["No disponible"]
     # categories
     mm = f.get("meal_moments_any") or []
-    if mm and not any(m in d.get("meal_moments", []) for m in mm):
+    if mm and not any(m in d.meal_moments for m in mm):
         return False, [f"Meal moment no coincide {mm}"]
     # categories
     cats = f.get("category_any") or []
-    if cats and not any(c in d["categories"] for c in cats):
+    if cats and not any(c in d.categories for c in cats):
         return False, [f"Categoria no coincide {cats}"]
     # neighborhood
     nhs = f.get("neighborhood_any") or []
-    if nhs and d["restaurant"]["neighborhood"] not in nhs:
+    if nhs and d.restaurant.neighborhood not in nhs:
         return False, [f"Barrio no coincide {nhs}"]
     # cuisines
     cu = f.get("cuisines_any") or []
-    if cu and d["restaurant"]["cuisines"] not in cu:
+    if cu and d.restaurant.cuisines not in cu:
         return False, [f"Cocina no coincide {cu}"]
     rest_any = f.get("restaurant_any") or []
-    if rest_any and d["restaurant"]["name"] not in rest_any:
+    if rest_any and d.restaurant.name not in rest_any:
         return False, [f"Restaurante no coincide {rest_any}"]
     # include ingredients
     inc = f.get("ingredients_include") or []
-    if inc and not all((_norm_str(i) in dish_ingredients) or (INGREDIENT_SYNONYM_MAP.get(_norm_str(i)) in dish_ingredients) or (i in dish_ingredients) for i in inc):
+    exc = f.get("ingredients_exclude") or []
+    expanded = dish_ingredients(d) if (inc or exc) else frozenset()
+    if inc and not all(not expanded.isdisjoint(_ingredient_keys(i)) for i in inc):
         return False, [f"Falta ingrediente requerido"]
     # exclude ingredients
-    exc = f.get("ingredients_exclude") or []
-    if exc and any((_norm_str(i) in dish_ingredients) or (INGREDIENT_SYNONYM_MAP.get(_norm_str(i)) in dish_ingredients) or (i in dish_ingredients) for i in exc):
+    if exc and any(not expanded.isdisjoint(_ingredient_keys(i)) for i in exc):
         return False, [f"Contiene ingrediente excluido"]
     # diet must
     dm = f.get("diet_must") or []
-    if dm and not all(d["diet_flags"].get(flag, False) for flag in dm):
+    if dm and not all(flag in d.diets for flag in dm):
         return False, [f"No cumple dietas requeridas {dm}"]
     # allergens exclude
     ae = f.get("allergens_exclude") or []
-    if ae and any(a in d["allergens"] for a in ae):
+    if ae and any(a in d.allergens for a in ae):
         return False, [f"Contiene alergenos excluidos {ae}"]
     # health any
     ha = f.get("health_any") or []
-    if ha and not any(h in d.get("health_tags", []) for h in ha):
+    if ha and not any(h in d.health_tags for h in ha):
         return False, [f"No coincide salud {ha}"]
     intent_any = f.get("intent_tags_any") or []
     if intent_any:
-        dish_intents = d.get("intent_tags") or d.get("experience_tags") or []
+        dish_intents = _dish_intents(d)
         if not any(tag in dish_intents for tag in intent_any):
             return False, [f"No coincide intención {intent_any}"]
     # price max
@@ -212,83 +223,178 @@ def apply_filters(d: Dict[str, Any], f: Dict[str, Any]) -> Tuple[bool, List[str]
         pm_val = percentile_price(pm)
     else:
         pm_val = pm
-    if pm_val is not None and d["price_ars"] > pm_val:
+    if pm_val is not None and d.price_ars > pm_val:
         return False, [f"Precio mayor a limite"]
     # eta max
     em = f.get("eta_max")
-    eta_value = min(
-        d.get("delivery_eta_min", float("inf")),
-        d["restaurant"].get("eta_min", float("inf"))
-    )
-    if em is not None and eta_value > em:
+    if em is not None and _dish_eta(d) > em:
         return False, [f"ETA mayor a limite"]
     # rating min
     rm = f.get("rating_min")
-    if rm is not None and d["restaurant"]["rating"] < rm:
+    if rm is not None and d.rating < rm:
         return False, [f"Rating menor a minimo"]
     return True, reasons
 
-def distance_score(d: Dict[str, Any], f: Dict[str, Any]) -> float:
-    # simple proxy: if neighborhood matches any, score 1 else 0.5
-    nhs = f.get("neighborhood_any") or []
-    if not nhs:
-        return 0.5
-    return 1.0 if d["restaurant"]["neighborhood"] in nhs else 0.0
+def _dish_intents(d: DishRecord) -> Tuple[str, ...]:
+    return d.intent_tags or d.experience_tags
+
+def _dish_eta(d: DishRecord) -> float:
+    delivery = d.delivery_eta_min
+    return d.eta_min if delivery is None else min(delivery, d.eta_min)
+
+def build_filter_index(catalog: ColumnarCatalog, dish_ingredients: List[FrozenSet[str]]) -> Dict[str, Any]:
+    """Índice invertido valor -> posiciones (arrays ordenados) para los filtros duros.
+
+    Disponibilidad, precio, ETA y rating quedan como columnas NumPy alineadas por
+    posición; precio y rating son vistas del archivo mapeado, sin copia.
+    """
+    index: Dict[str, Any] = {
+        "size": len(catalog),
+        "available": catalog.column("available", default=True).astype(bool),
+        "meal_moment": positions_by_key(enumerate(catalog.lists("meal_moments"))),
+        "category": positions_by_key(enumerate(catalog.lists("categories"))),
+        "neighborhood": positions_by_key(enumerate([n] for n in catalog.strings("restaurant.neighborhood"))),
+        "cuisine": positions_by_key(enumerate([c] for c in catalog.strings("restaurant.cuisines"))),
+        "restaurant": positions_by_key(enumerate([r] for r in catalog.strings("restaurant.name"))),
+        "ingredient": positions_by_key(enumerate(dish_ingredients)),
+        "diet": positions_by_key(
+            (pos, [flag for flag, on in flags.items() if on]) for pos, flags in enumerate(catalog.flags("diet_flags"))
+        ),
+        "allergen": positions_by_key(enumerate(catalog.lists("allergens"))),
+        "health": positions_by_key(enumerate(catalog.lists("health_tags"))),
+        "intent": positions_by_key(enumerate(i or e for i, e in zip(catalog.lists("intent_tags"), catalog.lists("experience_tags")))),
+        "price": catalog.column("price_ars"),
+        "eta": np.minimum(catalog.column("delivery_eta_min", default=float("inf")), catalog.column("restaurant.eta_min")),
+        "rating": catalog.column("restaurant.rating"),
+    }
+    return index
+
+def _union(index: Dict[str, Any], field: str, keys: Iterable[str]) -> np.ndarray:
+    # máscara (tamaño catálogo) de los platos con alguna de `keys`
+    mask = np.zeros(index["size"], dtype=bool)
+    postings = index[field]
+    for key in keys:
+        hit = postings.get(key)
+        if hit is not None:
+            mask[hit] = True
+    return mask
+
+def filter_candidates(
+    f: Dict[str, Any], index: Optional[Dict[str, Any]] = None, within: Optional[Iterable[int]] = None
+) -> List[int]:
+    """Posiciones (en orden de catálogo) que pasan los filtros duros.
+
+    Equivale a evaluar `apply_filters` plato por plato, pero resuelve cada filtro
+    como una máscara booleana sobre el índice y las columnas numéricas.
+    Con `within` solo se evalúan esas posiciones (p. ej. las que salen de postings).
+    """
+    index = index if index is not None else _state()["filter_index"]
+    if within is None:
+        mask = np.ones(index["size"], dtype=bool)
+    else:
+        mask = np.zeros(index["size"], dtype=bool)
+        mask[np.fromiter(within, dtype=np.intp)] = True
+
+    if f.get("available_only", True):
+        mask &= index["available"]
+    for field, key in (
+        ("meal_moment", "meal_moments_any"),
+        ("category", "category_any"),
+        ("neighborhood", "neighborhood_any"),
+        ("cuisine", "cuisines_any"),
+        ("restaurant", "restaurant_any"),
+        ("health", "health_any"),
+        ("intent", "intent_tags_any"),
+    ):
+        values = f.get(key) or []
+        if values:
+            mask &= _union(index, field, values)
+    for i in f.get("ingredients_include") or []:
+        mask &= _union(index, "ingredient", _ingredient_keys(i))
+    for flag in f.get("diet_must") or []:
+        mask &= _union(index, "diet", [flag])
+    for i in f.get("ingredients_exclude") or []:
+        mask &= ~_union(index, "ingredient", _ingredient_keys(i))
+    ae = f.get("allergens_exclude") or []
+    if ae:
+        mask &= ~_union(index, "allergen", ae)
+
+    pm = f.get("price_max")
+    if isinstance(pm, str) and pm and pm.startswith("p"):
+        pm_val = percentile_price(pm)
+    else:
+        pm_val = pm
+    em = f.get("eta_max")
+    rm = f.get("rating_min")
+    if pm_val is not None:
+        mask &= index["price"] <= pm_val
+    if em is not None:
+        mask &= index["eta"] <= em
+    if rm is not None:
+        mask &= index["rating"] >= rm
+    return np.flatnonzero(mask).tolist()
+
+def _tokenize(text: str) -> List[str]:
+    return re.findall(r"\w+", _norm_str(text))
+
+LEXICAL_SCORERS = {"overlap", "bm25"}
+
+def _lexical_scorer(query: Dict[str, Any]) -> str:
+    name = str((query.get("ranking_overrides") or {}).get("lexical") or "overlap").lower()
+    return name if name in LEXICAL_SCORERS else "overlap"
+
+# Tamaño de los lotes que se puntúan antes de revisar la cota contra el umbral top-K
+BM25_SCORE_BATCH = 64
+
+def _bm25_candidates(
+    query: Dict[str, Any], weights: Dict[str, float], k: Optional[int]
+) -> Optional[Tuple[np.ndarray, np.ndarray, Dict[str, np.ndarray], int]]:
+    """Candidatos BM25 puntuados: posiciones (en orden de catálogo), scores, componentes
+    y total de platos que matchean y pasan los filtros (incluye los podados).
+
+    Recorre solo los postings de los términos: los filtros se evalúan sobre esos
+    platos y nunca sobre el catálogo completo. Con `k`, los platos se puntúan por
+    lotes de mayor a menor cota superior (`ColumnarScorer.upper_bound`) y se corta
+    cuando la cota del siguiente no alcanza el k-ésimo mejor score: esos nunca se puntúan.
+    Devuelve None si ningún término matchea un plato permitido.
+    """
+    state = _state()
+    bm25, scorer = state["bm25"], state["scorer"]
+    filters = query.get("filters", {}) or {}
+    terms = bm25.terms(query.get("q", ""))
+    matched, lex = bm25.retrieve(terms)
+    if not len(matched):
+        return None
+    allowed = np.asarray(filter_candidates(filters, within=matched.tolist()), dtype=np.intp)
+    if not len(allowed):
+        return None
+    keep = np.searchsorted(matched, allowed)
+    positions, lex = matched[keep], lex[keep]
+    total = len(positions)
+    if k is None or k <= 0 or total <= k:
+        scores, components = scorer.score(positions, weights, filters, query, lex)
+        return positions, scores, components, total
+    bounds = scorer.upper_bound(positions, lex, weights, filters, query)
+    order = np.argsort(-bounds, kind="stable")
+    bounds = bounds[order]
+    batches: List[Tuple[np.ndarray, np.ndarray, Dict[str, np.ndarray]]] = []
+    best = np.zeros(0)
+    step = max(k, BM25_SCORE_BATCH)
+    for start in range(0, total, step):
+        # el resto tiene cotas menores: si ni la mayor llega al k-ésimo, quedan podados
+        if len(best) >= k and bounds[start] < best.min() - 1e-9:
+            break
+        chunk = np.sort(order[start:start + step])
+        chunk_scores, chunk_components = scorer.score(positions[chunk], weights, filters, query, lex[chunk])
+        batches.append((chunk, chunk_scores, chunk_components))
+        merged = np.concatenate([best, chunk_scores])
+        best = merged if len(merged) <= k else np.partition(merged, len(merged) - k)[len(merged) - k:]
+    chosen = np.concatenate([b[0] for b in batches])
+    perm = np.argsort(chosen, kind="stable")
+    scores = np.concatenate([b[1] for b in batches])[perm]
+    components = {name: np.concatenate([b[2][name] for b in batches])[perm] for name in batches[0][2]}
+    return positions[chosen[perm]], scores, components, total
 
-def compute_score(d: Dict[str, Any], f: Dict[str, Any], q: Dict[str, Any]) -> Tuple[float, List[str]]:
-    weights = dict(BASE_WEIGHTS)
-    weights.update(q.get("weights", {}))
-    weights.update((q.get("ranking_overrides") or {}).get("weights", {}))
-    # normalize
-    r = d["restaurant"]["rating"]
-    rating_n = norm(r, IDX["rating_min"], IDX["rating_max"])
-    price_n = norm(d["price_ars"], IDX["price_min"], IDX["price_max"])
-    eta_n = norm(d["restaurant"]["eta_min"], IDX["eta_min"], IDX["eta_max"])
-    pop_n = d.get("popularity", 0) / 100.0
-    dist_n = distance_score(d, q.get("filters", {}))
-    lex_n = lex_score(q.get("q",""), d, q.get("filters", {}))
-    discount = d.get("discount_pct", 0)
-    promo_n = norm(discount, IDX["discount_min"], IDX["discount_max"])
-    fee = d.get("delivery_fee", IDX["fee_max"])
-    fee_n = norm(fee, IDX["fee_min"], IDX["fee_max"])
-    restaurant_hits = set((q.get("metadata") or {}).get("restaurant_hits") or [])
-    score = (
-        weights["rating"] * rating_n +
-        weights["price"] * (1 - price_n) +
-        weights["eta"]   * (1 - eta_n) +
-        weights["pop"]   * pop_n +
-        weights["dist"]  * dist_n +
-        weights["lex"]   * lex_n +
-        weights["promo"] * promo_n +
-        weights["fee"]   * (1 - fee_n)
-    )
-    reasons = [
-        f"rating:{rating_n:.2f}",
-        f"price_inv:{1-price_n:.2f}",
-        f"eta_inv:{1-eta_n:.2f}",
-        f"pop:{pop_n:.2f}",
-        f"dist:{dist_n:.2f}",
-        f"lex:{lex_n:.2f}",
-        f"promo:{promo_n:.2f}",
-        f"fee_inv:{1-fee_n:.2f}"
-    ]
-    if restaurant_hits:
-        rest_name = d.get("restaurant", {}).get("name")
-        if rest_name in restaurant_hits:
-            score += 0.4
-            reasons.append("rest_hit")
-    # boosts and penalties
-    ro = (q.get("ranking_overrides") or {})
-    boost = ro.get("boost_tags") or []
-    penal = ro.get("penalize_tags") or []
-    tags = set(d.get("health_tags", []) + d.get("categories", []) + d.get("experience_tags", []) + [d["restaurant"]["cuisines"].lower()])
-    if any(b in tags for b in boost):
-        score *= 1.10
-        reasons.append("boost")
-    if any(p in tags for p in penal):
-        score *= 0.85
-        reasons.append("penal")
-    return score, reasons
 
 def _effective_weights_snapshot(query: Dict[str, Any]) -> Dict[str, float]:
     weights = dict(BASE_WEIGHTS)
@@ -298,60 +404,168 @@ def _effective_weights_snapshot(query: Dict[str, Any]) -> Dict[str, float]:
     return weights
 
 
-def _run_single_search(query: Dict[str, Any]) -> Tuple[List[Dict[str, Any]], List[Dict[str, Any]], Dict[str, Any]]:
+def _rejected_positions(filters: Dict[str, Any], limit: int = 10, survivors: Optional[List[int]] = None) -> List[int]:
+    # Solo se explican los primeros descartes; sin `survivors` se filtra por tramos
+    # desde el principio del catálogo hasta juntarlos.
+    size = len(_state()["catalog"])
+    known = set(survivors) if survivors is not None else None
+    rejected: List[int] = []
+    step = max(limit, 64)
+    for start in range(0, size, step):
+        if len(rejected) >= limit:
+            break
+        window = range(start, min(size, start + step))
+        accepted = known if known is not None else set(filter_candidates(filters, within=window))
+        rejected.extend(pos for pos in window if pos not in accepted)
+    return rejected[:limit]
+
+def _rejected_sample(filters: Dict[str, Any], positions: List[int]) -> List[Dict[str, Any]]:
+    catalog = _state()["catalog"]
+    records = [catalog.record(pos) for pos in positions]
+    return [{"id": d.id, "why": apply_filters(d, filters)[1]} for d in records]
+
+
+def _ranked_page(scores: np.ndarray, limit: Optional[int], offset: int) -> List[int]:
+    """Índices de `scores` de la página pedida, de mayor a menor score.
+
+    Con `limit` se usa selección top-K por heap (estable ante empates, igual que
+    un sort completo) en lugar de ordenar todos los candidatos.
+    """
+    if limit is None:
+        return np.argsort(-scores, kind="stable").tolist()[offset:]
+    values = scores.tolist()
+    top = heapq.nlargest(offset + limit, range(len(values)), key=values.__getitem__)
+    return top[offset:]
+
+
+def _rank(
+    query: Dict[str, Any], weights: Dict[str, float], limit: Optional[int], offset: int, rejected_limit: int
+) -> Tuple[np.ndarray, np.ndarray, Dict[str, np.ndarray], int, List[int]]:
+    """Filtra y puntúa; devuelve solo la página: posiciones, scores, componentes,
+    total y descartes de muestra. Es lo que guarda la caché de resultados."""
+    state = _state()
+    filters = query.get("filters", {}) or {}
+    ranked = None
+    survivors: Optional[List[int]] = None
+    if _lexical_scorer(query) == "bm25":
+        k = offset + limit if limit is not None else None
+        ranked = _bm25_candidates(query, weights, k)
+    if ranked is not None:
+        positions, scores, components, total = ranked
+    else:
+        # overlap, o BM25 sin ningún término que matchee: todos los filtrados, léxico por solapamiento/0
+        survivors = filter_candidates(filters)
+        positions = np.asarray(survivors, dtype=np.intp)
+        total = len(survivors)
+        if _lexical_scorer(query) == "bm25":
+            lex = np.zeros(len(positions))
+        else:
+            lex = lex_scores(query.get("q", ""), positions, filters)
+        # Solo componentes crudos para todos los candidatos; las razones se arman por página
+        scores, components = state["scorer"].score(positions, weights, filters, query, lex)
+    page = _ranked_page(scores, limit, offset)
+    page_components = {name: values[page] for name, values in components.items()}
+    rejected = _rejected_positions(filters, rejected_limit, survivors)
+    return positions[page], scores[page], page_components, total, rejected
+
+
+def _result_cache_key(query: Dict[str, Any], limit: Optional[int], offset: int, rejected_limit: int) -> tuple:
+    # Solo lo que cambia el ranking; advisor_summary, scenario_tags, etc. van al plan, no al resultado
+    ranking = {
+        "q": query.get("q") or "",
+        "filters": query.get("filters") or {},
+        "weights": query.get("weights") or {},
+        "ranking_overrides": query.get("ranking_overrides") or {},
+        "restaurant_hits": (query.get("metadata") or {}).get("restaurant_hits") or [],
+    }
+    return (snapshot.current().version, canonical_hash(ranking), limit, offset, rejected_limit)
+
+
+def _run_single_search(
+    query: Dict[str, Any], limit: Optional[int] = None, offset: int = 0, explain: bool = False
+) -> Tuple[List[Dict[str, Any]], int, List[Dict[str, Any]], Dict[str, Any]]:
+    state = _state()
     filters = query.get("filters", {}) or {}
+    weights = _effective_weights_snapshot(query)
+    lexical = _lexical_scorer(query)
+    rejected_limit = 50 if explain else 10
+    key = _result_cache_key(query, limit, offset, rejected_limit)
+    ranked = RESULT_CACHE.get(key)
+    if ranked is None:
+        ranked = _rank(query, weights, limit, offset, rejected_limit)
+        if len(ranked[0]) <= RESULT_CACHE_MAX_RESULTS:
+            RESULT_CACHE.put(key, ranked)
+    positions, scores, components, total, rejected_positions = ranked
     results: List[Dict[str, Any]] = []
-    rejected: List[Dict[str, Any]] = []
-    for d in CATALOG:
-        ok, why_not = apply_filters(d, filters)
-        if not ok:
-            rejected.append({"id": d["id"], "why": why_not})
-            continue
-        s, reasons = compute_score(d, filters, query)
-        results.append({"item": d, "score": s, "reasons": reasons})
-    results.sort(key=lambda x: x["score"], reverse=True)
+    items = state["catalog"].dishes(positions)
+    for i, item in enumerate(items):
+        result = {
+            "item": item,
+            "score": float(scores[i]),
+            "reasons": format_reasons(components, i),
+        }
+        if explain:
+            result["explanation"] = explain_score(components, weights, i)
+        results.append(result)
+    rejected = _rejected_sample(filters, rejected_positions)
     plan = {
         "hard_filters": filters,
-        "ranking_weights": _effective_weights_snapshot(query),
+        "ranking_weights": weights,
         "explain": "Se aplicaron filtros duros y luego orden ponderado. Boosts y penalizaciones consideradas.",
-        "rejected_sample": rejected[:10]
+        "rejected_sample": rejected
     }
+    if lexical != "overlap":
+        plan["lexical_scorer"] = lexical
     if query.get("advisor_summary"):
         plan["advisor_summary"] = query.get("advisor_summary")
     if query.get("scenario_tags"):
         plan["scenario_tags"] = query.get("scenario_tags")
-    return results, rejected, plan
+    return results, total, rejected, plan
+
+
+def cache_stats() -> Dict[str, Any]:
+    return RESULT_CACHE.stats()
 
 
 def search(req: Dict[str, Any]) -> Dict[str, Any]:
-    q = req.get("query") or {"filters": req.get("filters", {})}
-    results, rejected, plan = _run_single_search(q)
+    # La búsqueda (incluidas las relajaciones) usa una sola versión del catálogo
+    with snapshot.pinned():
+        return _search(req)
+
+
+def _search(req: Dict[str, Any]) -> Dict[str, Any]:
+    # limit/offset/explain llegan validados por SearchRequest/QueryRequest
+    q = req.get("query") or {"filters": req.get("filters") or {}}
+    limit = req.get("limit")
+    offset = req.get("offset") or 0
+    explain = bool(req.get("explain"))
+    results, total, rejected, plan = _run_single_search(q, limit, offset, explain)
     relaxations: List[str] = []
-    if not results:
+    if not total:
         relaxed_query = json.loads(json.dumps(q, ensure_ascii=False))
         filters_rel = relaxed_query.get("filters", {}) or {}
         metadata_rel = relaxed_query.setdefault("metadata", {})
         auto = set(metadata_rel.get("auto_constraints") or [])
 
         def relax_numeric(field: str, label: str):
-            nonlocal results, rejected, plan
+            nonlocal results, total, rejected, plan
             if filters_rel.get(field) is None or field not in auto:
                 return False
             previous = filters_rel.get(field)
             filters_rel[field] = None
             relaxations.append(f"Se quitó {label} automático ({previous}).")
-            results, rejected, plan = _run_single_search(relaxed_query)
-            return bool(results)
+            results, total, rejected, plan = _run_single_search(relaxed_query, limit, offset, explain)
+            return bool(total)
 
         def relax_list(field: str, label: str):
-            nonlocal results, rejected, plan
+            nonlocal results, total, rejected, plan
             if not (filters_rel.get(field) or []):
                 return False
             previous = list(filters_rel.get(field) or [])
             filters_rel[field] = []
             relaxations.append(f"Se ignoró {label}: {previous}.")
-            results, rejected, plan = _run_single_search(relaxed_query)
-            return bool(results)
+            results, total, rejected, plan = _run_single_search(relaxed_query, limit, offset, explain)
+            return bool(total)
 
         if relax_numeric("rating_min", "el mínimo de rating sugerido"):
             pass
@@ -377,4 +591,56 @@ def search(req: Dict[str, Any]) -> Dict[str, Any]:
             existing_notes = plan["llm_status"].get("notes") or []
             if not existing_notes:
                 plan["llm_status"]["notes"] = metadata["llm_notes"]
-    return {"results": results, "plan": plan}
+    return {"results": results, "total": total, "offset": offset, "limit": limit, "plan": plan}
+
+
+def build_state(snap) -> Dict[str, Any]:
+    """Índices de búsqueda para un snapshot (se llama al publicar cada versión)."""
+    catalog = snap.catalog
+    groups = load_ingredient_groups(snap.dictionaries["ingredients"])
+    canonicals = build_ingredient_canonicals(groups)
+    dish_ingredients_list = build_dish_ingredients(catalog, canonicals)
+    return {
+        "catalog": catalog,
+        "idx": snap.idx,
+        "ingredient_synonym_map": load_ingredient_synonyms(snap.dictionaries["ingredients"]),
+        "ingredient_groups": groups,
+        "ingredient_canonicals": canonicals,
+        "dish_ingredients": dish_ingredients_list,
+        "lex_index": build_lexical_index(catalog),
+        "filter_index": build_filter_index(catalog, dish_ingredients_list),
+        "scorer": ColumnarScorer(catalog, snap.idx),
+        "bm25": BM25Index(catalog, _tokenize),
+    }
+
+
+def update_state(state: Dict[str, Any], snap, changes: List[Tuple[int, DishRecord, DishRecord]]) -> Dict[str, Any]:
+    """Índices de búsqueda tras cambios de disponibilidad, precio, descuento o ETA.
+
+    Copia solo las estructuras afectadas (el snapshot anterior queda intacto) y
+    reutiliza los índices léxicos, BM25 e ingredientes, que no dependen de esos campos.
+    """
+    index = dict(state["filter_index"])
+    positions = [pos for pos, _, _ in changes]
+    for key in ("available", "price", "eta"):
+        index[key] = index[key].copy()
+    index["intent"] = dict(index["intent"])
+    for pos, old, new in changes:
+        index["available"][pos] = new.available
+        index["price"][pos] = new.price_ars
+        index["eta"][pos] = _dish_eta(new)
+        old_tags, new_tags = set(_dish_intents(old)), set(_dish_intents(new))
+        for tag in old_tags ^ new_tags:
+            hit = index["intent"].get(tag, np.empty(0, dtype=np.intp))
+            if tag in new_tags:
+                index["intent"][tag] = np.union1d(hit, [pos]).astype(np.intp)
+            else:
+                index["intent"][tag] = np.setdiff1d(hit, [pos]).astype(np.intp)
+    out = dict(state)
+    out.update({
+        "catalog": snap.catalog,
+        "idx": snap.idx,
+        "filter_index": index,
+        "scorer": state["scorer"].updated(snap.catalog, snap.idx, positions),
+    })
+    return out
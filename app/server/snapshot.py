@@ -0,0 +1,331 @@
+import contextvars, copy, json, logging, os, threading, time, uuid
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+try:  # flock solo existe en POSIX; sin él el log de deltas no se protege entre procesos
+    import fcntl
+except ImportError:  # pragma: no cover - depende del entorno
+    fcntl = None
+
+from . import catalog as catalog_store
+from . import columnar
+
+logger = logging.getLogger(__name__)
+
+# Intervalo de sondeo de cambios en catalog.json y diccionarios; 0 desactiva el watcher
+RELOAD_INTERVAL_SEC = float(os.getenv("CATALOG_RELOAD_INTERVAL_SEC", "5"))
+# Platos con deltas a partir de los cuales el watcher los vuelca a catalog.json; 0 no compacta
+DELTA_COMPACT_ITEMS = int(os.getenv("CATALOG_DELTA_COMPACT_ITEMS", "500"))
+
+
+class Snapshot:
+    """Catálogo, diccionarios e índices derivados de una misma versión de los datos.
+
+    Se arma completo antes de publicarse y no se modifica después: quien toma la
+    referencia ve siempre un estado consistente aunque en paralelo se publique otro.
+    """
+
+    def __init__(self, version: int, sources: tuple):
+        self.version = version
+        self.sources = sources
+        self.loaded_at = time.time()
+        self.catalog = load_catalog()
+        self.positions = {dish_id: pos for pos, dish_id in enumerate(self.catalog.strings("id"))}
+        self.dictionaries = catalog_store.load_dictionaries()
+        self.restaurant_names = catalog_store.get_restaurant_names(self.catalog)
+        self.catalog_metrics = catalog_store.build_metrics(self.catalog)
+        self.idx = catalog_store.build_indexes(self.catalog, self.catalog_metrics)
+        self._payload: Optional[Dict[str, Any]] = None
+        self.delta_offset = 0  # bytes del log de deltas ya aplicados
+        self.delta_epoch: Optional[str] = None  # generación del log a la que refiere el offset
+        # import diferido: parser y search leen el snapshot vigente desde este módulo
+        from . import parser, search
+        self.parser = parser.build_state(self)
+        self.search = search.build_state(self)
+
+    @property
+    def catalog_payload(self) -> Dict[str, Any]:
+        # _reload lo arma antes de publicar la versión; acá solo llegan snapshots sueltos
+        if self._payload is None:
+            self._payload = catalog_store.build_payload(list(self.catalog))
+        return self._payload
+
+    def with_deltas(self, deltas: List[Dict[str, Any]]) -> "Snapshot":
+        """Versión siguiente con los campos de `deltas` aplicados plato por plato.
+
+        Solo se copian las estructuras que dependen de esos campos; el resto
+        (diccionarios, índices léxicos, BM25) se comparte con esta versión.
+        """
+        new = copy.copy(self)
+        new.version = self.version + 1
+        new.loaded_at = time.time()
+        new._payload = None
+        merged: Dict[int, Dict[str, Any]] = {}
+        for delta in deltas:
+            merged.setdefault(self.positions[delta["id"]], {}).update(_delta_fields(delta))
+        base_tags = self.catalog.lists("base_intent_tags")
+        for pos, fields in merged.items():
+            dish = self.catalog[pos]
+            _set_fields(dish, fields)
+            fields["intent_tags"] = catalog_store.dish_intent_tags(dish, base_tags[pos])
+        new.catalog = self.catalog.with_updates(merged)
+        changes = [(pos, self.catalog.record(pos), new.catalog.record(pos)) for pos in merged]
+        pairs = [(old, dish) for _, old, dish in changes]
+        new.catalog_metrics = catalog_store.update_metrics(self.catalog_metrics, pairs)
+        new.idx = catalog_store.update_indexes(self.idx, new.catalog, new.catalog_metrics, pairs)
+        from . import parser, search
+        new.parser = parser.update_state(self.parser, new)
+        new.search = search.update_state(self.search, new, changes)
+        return new
+
+    def status(self) -> Dict[str, Any]:
+        return {
+            "version": self.version,
+            "loaded_at": self.loaded_at,
+            "items": len(self.catalog),
+        }
+
+
+# Campos del plato que admiten actualización incremental (eta_min vive en el restaurante)
+DELTA_FIELDS = ("available", "price_ars", "discount_pct")
+
+
+def _delta_fields(delta: Dict[str, Any]) -> Dict[str, Any]:
+    # "restaurant.<campo>" para los que viven en el restaurante
+    fields = {f: delta[f] for f in DELTA_FIELDS if delta.get(f) is not None}
+    if delta.get("eta_min") is not None:
+        fields["restaurant.eta_min"] = delta["eta_min"]
+    return fields
+
+
+def _set_fields(dish: Dict[str, Any], fields: Dict[str, Any]) -> None:
+    for key, value in fields.items():
+        if key.startswith("restaurant."):
+            dish["restaurant"][key[len("restaurant."):]] = value
+        else:
+            dish[key] = value
+
+
+def load_catalog() -> "columnar.ColumnarCatalog":
+    """Catálogo columnar: mapeado desde `catalog.columns` si está compilado a partir del
+    catalog.json actual; si no, se arma en memoria desde el JSON."""
+    mapped = columnar.load_for()
+    if mapped is not None:
+        return mapped
+    items = catalog_store.load_catalog()
+    base_tags = [catalog_store.base_intent_tags(d) for d in items]
+    catalog_store.augment_catalog_intents(items)
+    return columnar.from_items(items, {"base_intent_tags": base_tags})
+
+
+_CURRENT: Optional[Snapshot] = None
+_PINNED: contextvars.ContextVar = contextvars.ContextVar("catalog_snapshot", default=None)
+_LOCK = threading.Lock()
+_FAILED_SOURCES: Optional[tuple] = None
+LAST_ERROR: Optional[str] = None
+
+
+def current() -> Snapshot:
+    """Snapshot fijado para la request en curso o, si no hay, el último publicado."""
+    snap = _PINNED.get()
+    if snap is not None:
+        return snap
+    snap = _CURRENT
+    if snap is None:
+        snap = reload(force=False)
+    return snap
+
+
+@contextmanager
+def pinned() -> Iterator[Snapshot]:
+    """Fija un snapshot durante el bloque: todas las lecturas anidadas usan la misma versión."""
+    snap = _PINNED.get()
+    if snap is not None:
+        yield snap
+        return
+    token = _PINNED.set(current())
+    try:
+        yield _PINNED.get()
+    finally:
+        _PINNED.reset(token)
+
+
+def reload(force: bool = True) -> Snapshot:
+    """Reconstruye todo y publica el snapshot nuevo con un único cambio de referencia.
+
+    Sin `force` solo reconstruye si cambió algún archivo o se compactó el log; si no,
+    aplica los deltas que otros procesos hayan agregado al log. Si los datos nuevos
+    son inválidos se propaga el error y sigue vigente el snapshot anterior.
+    """
+    with _LOCK:
+        return _reload(force)
+
+
+def _reload(force: bool) -> Snapshot:
+    # con _LOCK tomado
+    global _FAILED_SOURCES, LAST_ERROR
+    sources = catalog_store.source_signature()
+    if _CURRENT is not None and not force and sources in (_CURRENT.sources, _FAILED_SOURCES):
+        snap = _catch_up(_CURRENT)
+        if snap is not None:
+            return _publish(snap)
+    version = 1 if _CURRENT is None else _CURRENT.version + 1
+    try:
+        snap = _catch_up(Snapshot(version, sources))
+    except Exception as exc:
+        _FAILED_SOURCES = sources
+        LAST_ERROR = f"{type(exc).__name__}: {exc}"
+        raise
+    snap.version = version
+    _FAILED_SOURCES = None
+    LAST_ERROR = None
+    return _publish(snap)
+
+
+def _publish(snap: Snapshot) -> Snapshot:
+    # con _LOCK tomado; el cuerpo de /catalog (JSON + gzip/brotli) se arma una vez por
+    # versión acá, en la recarga o el PATCH, y no en el primer GET que lo pide
+    global _CURRENT
+    snap.catalog_payload
+    _CURRENT = snap
+    return snap
+
+
+@contextmanager
+def _delta_log(mode: str, shared: bool = False) -> Iterator[Any]:
+    """Log de deltas abierto con lock: los workers escriben y compactan de a uno, y
+    leen (`shared`) sin ver una compactación a medias."""
+    path = catalog_store.DELTA_LOG_PATH
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with open(path, mode, encoding=None if "b" in mode else "utf-8") as f:
+        if fcntl is not None:
+            fcntl.flock(f, fcntl.LOCK_SH if shared else fcntl.LOCK_EX)
+        yield f
+
+
+def _log_epoch(line: bytes) -> Optional[str]:
+    # compact_deltas abre cada generación del log con una línea {"epoch": ...}
+    if not line.endswith(b"\n"):
+        return None
+    return json.loads(line).get("epoch")
+
+
+def _log_deltas(lines: List[str]) -> List[Dict[str, Any]]:
+    # solo cuentan los deltas registrados sobre el catalog.json vigente
+    signature = catalog_store.file_signature(catalog_store.CATALOG_PATH)
+    deltas: List[Dict[str, Any]] = []
+    for line in lines:
+        entry = json.loads(line)
+        if "deltas" in entry and entry["source"] == (list(signature) if signature else None):
+            deltas.extend(entry["deltas"])
+    return deltas
+
+
+def _read_log(offset: int, epoch: Optional[str]) -> Optional[Tuple[List[Dict[str, Any]], int, Optional[str]]]:
+    """Deltas del log a partir de `offset` (bytes), el offset hasta donde se leyó y la
+    generación del log.
+
+    None si el log ya no es la generación `epoch` en la que se tomó `offset` (se
+    compactó o se borró): esos bytes no significan nada y hay que recargar completo.
+    """
+    try:
+        with _delta_log("rb", shared=True) as f:
+            log_epoch = _log_epoch(f.readline())
+            size = f.seek(0, os.SEEK_END)
+            if offset and (log_epoch != epoch or size < offset):
+                return None
+            f.seek(offset)
+            data = f.read()
+    except FileNotFoundError:
+        return None if offset else ([], 0, None)
+    end = data.rfind(b"\n") + 1  # una línea a medio escribir se lee en la próxima pasada
+    return _log_deltas(data[:end].decode("utf-8").splitlines()), offset + end, log_epoch
+
+
+def _catch_up(snap: Snapshot) -> Optional[Snapshot]:
+    """`snap` con los deltas del log que todavía no tiene, o None si el log se compactó
+    desde la última lectura (un snapshot recién armado nunca da None)."""
+    read = _read_log(snap.delta_offset, snap.delta_epoch)
+    if read is None:
+        return None
+    deltas, offset, epoch = read
+    if (offset, epoch) == (snap.delta_offset, snap.delta_epoch):
+        return snap
+    known = [d for d in deltas if d["id"] in snap.positions]
+    new = snap.with_deltas(known) if known else copy.copy(snap)
+    new.delta_offset, new.delta_epoch = offset, epoch
+    return new
+
+
+def apply_deltas(deltas: List[Dict[str, Any]]) -> Snapshot:
+    """Aplica cambios puntuales de platos y publica la versión resultante.
+
+    Los ids desconocidos se rechazan antes de tocar nada (KeyError). Los cambios se
+    agregan al log de deltas, que cada recarga vuelve a aplicar y que los demás
+    workers leen desde el watcher, hasta que `compact_deltas` los vuelca al catálogo.
+    Si otro worker compactó mientras tanto, se recarga completo en vez de seguir el log.
+    """
+    current()  # asegura la carga inicial
+    with _LOCK:
+        base = _CURRENT
+        unknown = [d["id"] for d in deltas if d["id"] not in base.positions]
+        if unknown:
+            raise KeyError(unknown)
+        with _delta_log("a") as log:
+            # la firma se toma con el lock: una compactación en curso ya reescribió el catálogo
+            signature = catalog_store.file_signature(catalog_store.CATALOG_PATH)
+            entry = {"source": signature, "deltas": deltas}
+            log.write(json.dumps(entry, ensure_ascii=False) + "\n")
+        return _reload(force=False)
+
+
+def compact_deltas() -> Snapshot:
+    """Vuelca el log de deltas a catalog.json (y recompila catalog.columns si existe),
+    lo reinicia con una generación nueva y recarga: los overrides en memoria vuelven
+    a cero y los demás workers recargan completo en vez de seguir el log viejo."""
+    src = catalog_store.CATALOG_PATH
+    with _delta_log("a+") as log:
+        log.seek(0)
+        deltas = _log_deltas(log.read().splitlines())
+        if deltas:
+            items = catalog_store.load_catalog(src)
+            by_id = {d["id"]: d for d in items}
+            for delta in deltas:
+                if delta["id"] in by_id:
+                    _set_fields(by_id[delta["id"]], _delta_fields(delta))
+            catalog_store.write_catalog(items, src)
+            if catalog_store.COLUMNAR_PATH.exists():
+                columnar.build(src, catalog_store.COLUMNAR_PATH)
+        log.truncate(0)
+        log.write(json.dumps({"epoch": uuid.uuid4().hex}) + "\n")
+    return reload(force=False)
+
+
+class Watcher:
+    """Hilo en segundo plano que recarga el snapshot cuando cambian los archivos de datos."""
+
+    def __init__(self, interval: float = RELOAD_INTERVAL_SEC):
+        self.interval = interval
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self) -> "Watcher":
+        if self.interval > 0 and self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="catalog-watcher", daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def _run(self) -> None:
+        while not self._stop.wait(self.interval):
+            try:
+                snap = reload(force=False)
+                if 0 < DELTA_COMPACT_ITEMS <= snap.catalog.overridden:
+                    compact_deltas()
+            except Exception:
+                logger.exception("No se pudo recargar el catálogo; sigue vigente la versión %s", _CURRENT and _CURRENT.version)
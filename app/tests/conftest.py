@@ -0,0 +1,21 @@
+import os, sys, tempfile
+from pathlib import Path
+
+import pytest
+
+# Los tests no escriben en app/data: el log de deltas y la caché del LLM viven en un directorio temporal
+_TMP = Path(tempfile.mkdtemp(prefix="food-search-tests-"))
+os.environ.setdefault("CATALOG_DELTA_LOG", str(_TMP / "catalog.deltas.jsonl"))
+os.environ.setdefault("LLM_CACHE_PATH", str(_TMP / "llm_cache.sqlite3"))
+
+
+@pytest.fixture(autouse=True)
+def _discard_catalog_deltas():
+    # Cada test empieza sin deltas persistidos de los anteriores
+    yield
+    log = Path(os.environ["CATALOG_DELTA_LOG"])
+    if log.exists() and log.stat().st_size:
+        log.unlink()
+        for name in ("app.server.snapshot", "server.snapshot"):
+            if name in sys.modules:
+                sys.modules[name].reload(force=True)
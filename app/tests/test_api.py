@@ -0,0 +1,169 @@
+import gzip, json
+
+from fastapi.testclient import TestClient
+
+from app.server.main import app
+from app.server import parser, snapshot
+
+client = TestClient(app)
+
+
+def test_catalog_served_compressed_with_etag():
+    snap = snapshot.current()
+    r = client.get("/catalog", headers={"Accept-Encoding": "gzip"})
+    assert r.status_code == 200
+    assert r.headers["content-encoding"] == "gzip"
+    assert r.headers["etag"] == snap.catalog_payload["etags"]["gzip"]
+    assert "max-age" in r.headers["cache-control"]
+    data = r.json()
+    assert data["count"] == len(snap.catalog)
+    assert gzip.decompress(snap.catalog_payload["encoded"]["gzip"]) == snap.catalog_payload["body"]
+
+    plain = client.get("/catalog", headers={"Accept-Encoding": "identity"})
+    assert "content-encoding" not in plain.headers
+    assert json.loads(plain.content) == data
+    assert plain.headers["etag"] == snap.catalog_payload["etags"]["identity"]
+    assert plain.headers["etag"] != r.headers["etag"]
+
+
+def test_catalog_revalidation_returns_304():
+    etag = client.get("/catalog").headers["etag"]
+    r = client.get("/catalog", headers={"If-None-Match": etag})
+    assert r.status_code == 304
+    assert r.content == b""
+    assert r.headers["etag"] == etag
+    assert client.get("/catalog", headers={"If-None-Match": '"otro"'}).status_code == 200
+
+
+def test_catalog_etag_is_per_encoding():
+    gz = client.get("/catalog", headers={"Accept-Encoding": "gzip"}).headers["etag"]
+    assert gz.endswith('-gz"')
+    # el validador de la versión gzip no revalida la representación sin comprimir
+    r = client.get("/catalog", headers={"Accept-Encoding": "identity", "If-None-Match": gz})
+    assert r.status_code == 200 and "content-encoding" not in r.headers
+    r = client.get("/catalog", headers={"Accept-Encoding": "gzip", "If-None-Match": gz})
+    assert r.status_code == 304 and r.headers["etag"] == gz
+
+
+def test_catalog_payload_built_before_publishing():
+    # ni la recarga ni un PATCH dejan el cuerpo de /catalog para el primer GET
+    assert snapshot.reload(force=True)._payload is not None
+    dish = snapshot.current().catalog[0]
+    snap = snapshot.apply_deltas([{"id": dish["id"], "discount_pct": 3}])
+    assert snap._payload is not None
+    assert json.loads(snap._payload["body"])["items"][0]["discount_pct"] == 3
+
+
+def test_admin_reload_requires_token(monkeypatch):
+    monkeypatch.delenv("ADMIN_TOKEN", raising=False)
+    assert client.post("/admin/reload").status_code == 403
+    monkeypatch.setenv("ADMIN_TOKEN", "secreto")
+    assert client.post("/admin/reload", headers={"X-Admin-Token": "otro"}).status_code == 403
+    before = snapshot.current().version
+    r = client.post("/admin/reload", headers={"X-Admin-Token": "secreto"})
+    assert r.status_code == 200
+    assert r.json()["version"] == before + 1
+
+
+def test_admin_stats_reports_cache_counters(monkeypatch):
+    monkeypatch.setenv("ADMIN_TOKEN", "secreto")
+    assert client.get("/admin/stats").status_code == 403
+    client.post("/search", json={"query": {"q": "sushi", "filters": {}}, "limit": 5})
+    client.post("/search", json={"query": {"q": "sushi", "filters": {}}, "limit": 5})
+    stats = client.get("/admin/stats", headers={"X-Admin-Token": "secreto"}).json()
+    assert stats["snapshot"]["version"] == snapshot.current().version
+    assert stats["search_cache"]["hits"] >= 1 and stats["search_cache"]["size"] >= 1
+    assert set(stats["parse_cache"]) >= {"hits", "misses", "size"}
+    assert stats["llm_provider"]["breaker"]["state"] in {"closed", "open", "half_open"}
+
+
+def test_search_validates_paging_fields():
+    query = {"q": "sushi", "filters": {}}
+    for bad in ({"limit": "abc"}, {"limit": -1}, {"offset": -5}, {"explain": "tal vez"}):
+        assert client.post("/search", json={"query": query, **bad}).status_code == 422, bad
+    r = client.post("/search", json={"query": query, "limit": 3, "explain": "false"})
+    assert r.status_code == 200 and len(r.json()["results"]) == 3
+    assert "explanation" not in r.json()["results"][0]
+
+
+def test_patch_catalog_items(monkeypatch):
+    monkeypatch.setenv("ADMIN_TOKEN", "secreto")
+    headers = {"X-Admin-Token": "secreto"}
+    dish = snapshot.current().catalog[3]
+    r = client.patch("/catalog/items", json={"items": [{"id": "no-existe", "available": False}]}, headers=headers)
+    assert r.status_code == 404
+    etag = client.get("/catalog").headers["etag"]
+    try:
+        r = client.patch("/catalog/items", json={"items": [{"id": dish["id"], "available": False}]}, headers=headers)
+        assert r.status_code == 200 and r.json()["updated"] == 1
+        assert snapshot.current().catalog[3]["available"] is False
+        assert client.get("/catalog", headers={"If-None-Match": etag}).status_code == 200
+    finally:
+        snapshot.reload(force=True)
+
+
+def _sse_events(body: str):
+    events = []
+    for block in body.strip().split("\n\n"):
+        fields = dict(line.split(": ", 1) for line in block.splitlines())
+        events.append({**fields, "data": json.loads(fields["data"])})
+    return events
+
+
+def test_search_stream_sends_local_then_refined(monkeypatch):
+    monkeypatch.setenv("LLM_PROVIDER", "stub")
+    monkeypatch.setenv("LLM_STUB_RESPONSE", json.dumps({"headline": "Stream", "ranking_overrides": {"boost_tags": ["spicy"]}}))
+    with client.stream("GET", "/search/stream", params={"text": "pizza para compartir", "limit": 5}) as r:
+        assert r.headers["content-type"].startswith("text/event-stream")
+        events = _sse_events(r.read().decode("utf-8"))
+    local, final = (e["data"] for e in events)
+    assert [e["id"] for e in events] == ["1", "2"] and {e["event"] for e in events} == {"results"}
+    assert (local["stage"], local["final"], final["stage"], final["final"]) == ("local", False, "final", True)
+    assert local["parsed"]["status"]["llm"]["status"] == "pending"
+    assert final["parsed"]["status"]["llm"]["status"] == "used"
+    assert len(local["search"]["results"]) == 5
+    assert local["search"]["plan"]["llm_status"]["status"] == "pending"
+    assert final["search"] == client.post("/search", json={"query": final["parsed"]["query"], "limit": 5}).json()
+
+
+def test_search_stream_runs_local_rules_once(monkeypatch):
+    monkeypatch.setenv("LLM_PROVIDER", "stub")
+    monkeypatch.setenv("LLM_STUB_RESPONSE", json.dumps({"headline": "Stream", "filters": {"diet_must": ["veg"]}}))
+    calls = []
+    rules = parser._parse_rules
+    monkeypatch.setattr(parser, "_parse_rules", lambda text: calls.append(text) or rules(text))
+    parser.PARSE_CACHE.clear()
+    with client.stream("GET", "/search/stream", params={"text": "milanesa para la familia"}) as r:
+        local, final = (e["data"] for e in _sse_events(r.read().decode("utf-8")))
+    # la vista previa y el resultado final salen de la misma pasada de reglas
+    assert calls == ["milanesa para la familia"]
+    assert local["parsed"]["query"]["filters"]["diet_must"] == []
+    assert final["parsed"]["query"]["filters"]["diet_must"] == ["veg"]
+
+
+def test_search_stream_without_llm_sends_single_event(monkeypatch):
+    monkeypatch.delenv("LLM_PROVIDER", raising=False)
+    monkeypatch.delenv("GROQ_API_KEY", raising=False)
+    with client.stream("GET", "/search/stream", params={"text": "empanadas"}) as r:
+        events = _sse_events(r.read().decode("utf-8"))
+    assert len(events) == 1 and events[0]["data"]["final"]
+    assert events[0]["data"]["parsed"]["status"]["llm"]["status"] == "disabled"
+
+
+def test_query_parses_and_searches_in_one_call():
+    r = client.post("/query", json={"text": "pizza sin gluten", "limit": 5})
+    assert r.status_code == 200
+    body = r.json()
+    assert "parsed" not in body
+    parsed = client.post("/parse", json={"text": "pizza sin gluten"}).json()
+    assert body == client.post("/search", json={"query": parsed["query"], "limit": 5}).json()
+
+    with_parse = client.post("/query", json={"text": "pizza sin gluten", "limit": 5, "include_parse": True}).json()
+    assert with_parse["parsed"] == parsed
+    assert with_parse["results"] == body["results"]
+
+
+def test_query_returns_bounded_page_by_default():
+    body = client.post("/query", json={"text": "pizza"}).json()
+    assert body["limit"] == 20 and len(body["results"]) == 20 < body["total"]
+    assert client.post("/query", json={"text": "pizza", "limit": 101}).status_code == 422
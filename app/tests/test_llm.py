@@ -0,0 +1,231 @@
+import asyncio, json, threading, time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from app.server import llm, parser
+from app.server.breaker import CircuitBreaker, LatencyWindow
+
+
+class StubLLMHandler(BaseHTTPRequestHandler):
+    """Endpoint /chat/completions compatible con OpenAI que registra cada conexión.
+
+    `server.delay` y `server.status` inyectan lentitud y errores del proveedor.
+    """
+
+    protocol_version = "HTTP/1.1"  # keep-alive
+
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        self.server.requests.append({"client": self.client_address, "path": self.path, "body": body})
+        time.sleep(self.server.delay)
+        content = json.dumps({"headline": "Stub", "filters": {}})
+        data = json.dumps({"choices": [{"message": {"content": content}}]}).encode("utf-8")
+        self.send_response(self.server.status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def stub_llm(monkeypatch):
+    server = ThreadingHTTPServer(("127.0.0.1", 0), StubLLMHandler)
+    server.requests = []
+    server.delay = 0
+    server.status = 200
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    monkeypatch.setenv("LLM_PROVIDER", "openai")
+    monkeypatch.setenv("LLM_API_KEY", "clave")
+    monkeypatch.setenv("LLM_BASE_URL", f"http://127.0.0.1:{server.server_port}/v1")
+    monkeypatch.setattr(llm, "RESPONSE_CACHE", None)
+    monkeypatch.setattr(llm, "BREAKER", CircuitBreaker(3, 0.2))
+    monkeypatch.setattr(llm, "LATENCY", LatencyWindow(50, 3))
+    llm.close_clients()
+    try:
+        yield server
+    finally:
+        llm.close_clients()
+        server.shutdown()
+        server.server_close()
+
+
+def test_llm_client_reuses_pooled_connection(stub_llm):
+    for text in ("pizza", "sushi", "empanadas"):
+        assert llm.request_plan(text, {})["headline"] == "Stub"
+    assert [r["path"] for r in stub_llm.requests] == ["/v1/chat/completions"] * 3
+    assert stub_llm.requests[0]["body"]["temperature"] == llm.TEMPERATURE
+    # las tres consultas viajaron por la misma conexión TCP
+    assert len({r["client"] for r in stub_llm.requests}) == 1
+
+    llm.close_clients()
+    assert not llm._CLIENTS
+    llm.request_plan("tacos", {})
+    assert len({r["client"] for r in stub_llm.requests}) == 2
+
+
+def test_async_llm_client_matches_sync_and_reuses_connection(stub_llm):
+    async def run():
+        plans = [await llm.request_plan_async(text, {}) for text in ("pizza", "sushi")]
+        await llm.aclose_clients()
+        return plans
+
+    assert asyncio.run(run()) == [llm.request_plan("pizza", {})] * 2
+    async_clients = {r["client"] for r in stub_llm.requests[:2]}
+    assert len(async_clients) == 1
+    assert not llm._ASYNC_CLIENTS
+
+
+def test_async_clients_do_not_outlive_their_loop():
+    loops = []
+
+    async def client():
+        loops.append(asyncio.get_running_loop())
+        return llm._async_client("http://llm.invalid/v1")
+
+    first, second = asyncio.run(client()), asyncio.run(client())
+    assert first is not second
+    # el cliente del primer loop (ya cerrado) se soltó al crear el del segundo
+    assert loops[0] not in llm._ASYNC_CLIENTS
+    assert llm._ASYNC_CLIENTS[loops[1]] == {"http://llm.invalid/v1": second}
+    del llm._ASYNC_CLIENTS[loops[1]]
+
+
+def test_parse_async_matches_sync_parse(stub_llm):
+    parser.PARSE_CACHE.clear()
+    expected = parser.parse("pizza sin gluten en palermo")
+    parser.PARSE_CACHE.clear()
+    result = asyncio.run(parser.parse_async("pizza sin gluten en palermo"))
+    assert result == expected
+    assert result["status"]["llm"]["status"] != "error"
+    assert len(stub_llm.requests) == 2
+
+
+@pytest.fixture
+def slow_llm(stub_llm, tmp_path, monkeypatch):
+    """Proveedor que tarda 0,5 s contra un presupuesto de 100 ms, con caché en disco."""
+    stub_llm.delay = 0.5
+    monkeypatch.setattr(llm, "LLM_BUDGET_MS", 100)
+    monkeypatch.setattr(llm, "RESPONSE_CACHE", llm.SQLiteCache(tmp_path / "llm.sqlite3", 3600, 100))
+    parser.PARSE_CACHE.clear()
+    return stub_llm
+
+
+def _wait_for_cache(timeout=3.0):
+    deadline = time.monotonic() + timeout
+    while llm.RESPONSE_CACHE.stats()["size"] == 0 and time.monotonic() < deadline:
+        time.sleep(0.02)
+
+
+def test_parse_returns_local_result_when_llm_exceeds_budget(slow_llm):
+    start = time.perf_counter()
+    first = parser.parse("pizza sin gluten")
+    assert time.perf_counter() - start < 0.4
+    assert first["status"]["llm"]["status"] == "timeout"
+    assert first["query"]["filters"]
+
+    # la respuesta tardía llena la caché y el siguiente parse ya la combina
+    _wait_for_cache()
+    second = parser.parse("pizza sin gluten")
+    assert second["status"]["llm"]["status"] != "timeout"
+    assert len(slow_llm.requests) == 1
+
+
+def test_parse_async_late_result_fills_cache(slow_llm):
+    async def run():
+        first = await parser.parse_async("sushi vegano")
+        await asyncio.sleep(0.7)
+        second = await parser.parse_async("sushi vegano")
+        await llm.aclose_clients()
+        return first, second
+
+    first, second = asyncio.run(run())
+    assert first["status"]["llm"]["status"] == "timeout"
+    assert second["status"]["llm"]["status"] != "timeout"
+    assert len(slow_llm.requests) == 1
+
+
+def test_circuit_breaker_short_circuits_failing_provider(stub_llm):
+    stub_llm.status = 500
+    for _ in range(3):
+        with pytest.raises(llm.LLMError, match="HTTP 500"):
+            llm.request_plan("pizza", {})
+    assert llm.BREAKER.state == "open"
+
+    # abierto: se cae a reglas locales sin tocar la red
+    with pytest.raises(llm.LLMUnavailable):
+        llm.request_plan("pizza", {})
+    parsed = parser.parse("sushi en belgrano")
+    assert parsed["status"]["llm"]["status"] == "error"
+    assert len(stub_llm.requests) == 3
+
+    # half-open: un sondeo fallido vuelve a abrir, uno exitoso cierra
+    time.sleep(0.25)
+    with pytest.raises(llm.LLMError, match="HTTP 500"):
+        llm.request_plan("pizza", {})
+    assert llm.BREAKER.state == "open"
+    time.sleep(0.25)
+    stub_llm.status = 200
+    assert llm.request_plan("pizza", {})["headline"] == "Stub"
+    assert llm.BREAKER.state == "closed"
+    assert len(stub_llm.requests) == 5
+
+
+def test_client_errors_do_not_trip_the_breaker(stub_llm):
+    stub_llm.status = 401
+    for _ in range(5):
+        with pytest.raises(llm.LLMError, match="HTTP 401"):
+            llm.request_plan("pizza", {})
+    assert llm.BREAKER.state == "closed"
+    assert llm.LATENCY.stats()["samples"] == 0
+    # 429 sí es una falla del proveedor
+    stub_llm.status = 429
+    for _ in range(3):
+        with pytest.raises(llm.LLMError, match="HTTP 429"):
+            llm.request_plan("pizza", {})
+    assert llm.BREAKER.state == "open"
+
+
+def test_adaptive_timeout_follows_observed_latency(stub_llm, monkeypatch):
+    monkeypatch.setattr(llm, "LLM_TIMEOUT_MIN_SEC", 0.2)
+    assert llm.request_timeout() == llm.DEFAULT_TIMEOUT_SEC
+    for text in ("pizza", "sushi", "tacos"):
+        llm.request_plan(text, {})
+    # con el proveedor respondiendo en milisegundos el timeout baja al mínimo
+    assert llm.request_timeout() == 0.2
+
+    stub_llm.delay = 1.0
+    start = time.perf_counter()
+    with pytest.raises(llm.LLMError, match="no respondió"):
+        llm.request_plan("empanadas", {})
+    assert time.perf_counter() - start < 0.8
+    assert llm.provider_stats()["breaker"]["consecutive_failures"] == 1
+
+
+def test_adaptive_timeout_recovers_when_provider_slows_down(stub_llm, monkeypatch):
+    monkeypatch.setattr(llm, "LLM_TIMEOUT_MIN_SEC", 0.1)
+    # latencias aprendidas fijas: las reales del stub dependen de la carga de la máquina
+    for _ in range(llm.LATENCY.min_samples):
+        llm.LATENCY.add(0.001)
+    assert llm.request_timeout() == 0.1
+
+    # el proveedor pasa a tardar más que el p99 aprendido: cada timeout sube el siguiente
+    stub_llm.delay = 0.5
+    timeouts = []
+    for text in ("empanadas", "milanesa", "ravioles"):
+        timeouts.append(llm.request_timeout())
+        with pytest.raises(llm.LLMError, match="no respondió"):
+            llm.request_plan(text, {})
+    assert timeouts == [0.1, 0.2, 0.4]
+    assert llm.BREAKER.state == "open"
+
+    # el sondeo half-open usa el timeout completo y cierra el circuito
+    time.sleep(0.25)
+    assert llm.request_plan("ensalada", {})["headline"] == "Stub"
+    assert llm.BREAKER.state == "closed"
+    assert llm.request_timeout() >= 1.0
+    assert llm.request_plan("wok", {})["headline"] == "Stub"
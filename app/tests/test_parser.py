@@ -1,6 +1,9 @@
 
-import json
-from app.server.parser import parse
+import json, re, sqlite3
+from app.server import llm, parser, snapshot
+from app.server.cache import SQLiteCache
+from app.server.llm import _extract_json_payload
+from app.server.parser import extract_include_exclude, normalize, parse
 from app.server.search import search as do_search
 
 def _run(text):
@@ -163,8 +166,6 @@ def test_llm_strategies_merge_results(monkeypatch):
 
 
 def test_extract_json_payload_handles_fences(monkeypatch):
-    from app.server.llm import _extract_json_payload
-
     payload = """```json
     {
       "headline": "Demo",
@@ -173,3 +174,117 @@ def test_extract_json_payload_handles_fences(monkeypatch):
     ```"""
     extracted = _extract_json_payload(payload)
     assert json.loads(extracted)["headline"] == "Demo"
+
+
+def test_dictionary_matcher_agrees_with_word_regex():
+    patterns = parser._dictionary_index(snapshot.current().dictionaries)
+    texts = [
+        "sin pizza quiero parrilla en villa crespo",
+        "cena keto grillada al horno con arroz",
+        "vegetarianos apto celiacos merendar",
+        "cocina vegana en nunez o san telmo",
+    ]
+    for text in texts:
+        tn = parser.normalize(text)
+        for pattern in patterns:
+            word = bool(re.search(rf"\b{re.escape(pattern)}\b", tn))
+            prefix = bool(re.search(rf"\b{re.escape(pattern)}\w*\b", tn))
+            kind = parser._state()["dictionary_hits"](tn).get(pattern)
+            assert (kind == "word") == word, (text, pattern)
+            assert (kind is not None) == prefix, (text, pattern)
+
+
+def test_negation_scope_is_word_based():
+    inc, exc, allerg = extract_include_exclude(normalize("quiero con mani y queso"), [])
+    assert inc == ["mani"]
+    assert exc == [] and allerg == []
+
+    inc, exc, allerg = extract_include_exclude(normalize("odio la cebolla y nada de frutos secos ni tomates"), [])
+    assert {"cebolla", "tomate"} <= set(exc)
+    assert "tree_nut" in allerg
+
+
+def test_restaurant_detection_keeps_substring_semantics():
+    names = parser.RESTAURANT_NAMES[:3]
+    text = "quiero pedir en " + " y en ".join(names) + " algo rico"
+    expected = [rn for rn in parser.RESTAURANT_NAMES if parser.normalize_soft(rn) and parser.normalize_soft(rn) in parser.normalize_soft(text)]
+    assert parser.parse_restaurants(text, []) == expected
+    assert set(names) <= set(expected)
+
+
+def test_parse_memoized_by_normalized_text(monkeypatch):
+    monkeypatch.delenv("LLM_PROVIDER", raising=False)
+    monkeypatch.delenv("GROQ_API_KEY", raising=False)
+    monkeypatch.delenv("LLM_API_KEY", raising=False)
+    parser.PARSE_CACHE.clear()
+    first = parse("Sushi en Palermo")
+    hits = parser.PARSE_CACHE.hits
+    second = parse("sushi en palermo")
+    assert parser.PARSE_CACHE.hits == hits + 1
+    assert second["query"]["q"] == "sushi en palermo" and first["query"]["q"] == "Sushi en Palermo"
+    assert second["query"]["filters"] == first["query"]["filters"]
+    # cada llamada recibe su copia: modificarla no altera la entrada cacheada
+    second["query"]["filters"]["neighborhood_any"].append("Belgrano")
+    assert parse("sushi en palermo")["query"]["filters"]["neighborhood_any"] == ["Palermo"]
+
+    # otro proveedor/modelo de LLM no reutiliza la entrada; los errores no se guardan
+    monkeypatch.setenv("LLM_PROVIDER", "stub")
+    monkeypatch.setenv("LLM_STUB_RESPONSE", "no es json")
+    misses = parser.PARSE_CACHE.misses
+    assert parse("sushi en palermo")["status"]["llm"]["status"] == "error"
+    assert parse("sushi en palermo")["status"]["llm"]["status"] == "error"
+    assert parser.PARSE_CACHE.misses == misses + 2
+    assert llm.cache_identity() == ("stub", "no es json")
+
+
+def test_sqlite_cache_batches_access_times(tmp_path):
+    now = [1000.0]
+    path = tmp_path / "cache.sqlite3"
+    cache = SQLiteCache(path, ttl=0, max_entries=2, clock=lambda: now[0], access_flush_every=3)
+    cache.put("a", "1")
+    now[0] += 1
+    cache.put("b", "2")
+    now[0] += 1
+    assert cache.get("a") == "1"
+    accessed = lambda key: sqlite3.connect(path).execute("SELECT accessed FROM entries WHERE key = ?", (key,)).fetchone()[0]
+    assert accessed("a") == 1000.0  # el hit no escribió
+    # la próxima escritura vuelca el acceso antes de desalojar: sale "b", no "a"
+    cache.put("c", "3")
+    assert cache.get("b") is None and cache.get("a") == "1"
+    assert cache._connect() is cache._connect()
+
+
+def test_llm_responses_cached_on_disk(monkeypatch, tmp_path):
+    monkeypatch.setenv("LLM_PROVIDER", "openai")
+    monkeypatch.setenv("LLM_API_KEY", "clave")
+    monkeypatch.setenv("LLM_BASE_URL", "http://llm.invalid/v1")
+    calls = []
+
+    def fake_request(messages, model):
+        calls.append(model)
+        return '```json\n{"headline": "Cacheado", "filters": {}}\n```'
+
+    monkeypatch.setattr(llm, "_generic_request", fake_request)
+    now = [1000.0]
+    path = tmp_path / "llm.sqlite3"
+    monkeypatch.setattr(llm, "RESPONSE_CACHE", SQLiteCache(path, ttl=60, max_entries=2, clock=lambda: now[0]))
+    context = {"filters": {"category_any": ["pizza"]}}
+    assert llm.request_plan("pizza", context)["headline"] == "Cacheado"
+    assert llm.request_plan("pizza", context)["headline"] == "Cacheado"
+    assert len(calls) == 1
+
+    # otra instancia sobre el mismo archivo (reinicio u otro worker) reutiliza la respuesta
+    monkeypatch.setattr(llm, "RESPONSE_CACHE", SQLiteCache(path, ttl=60, max_entries=2, clock=lambda: now[0]))
+    llm.request_plan("pizza", context)
+    assert len(calls) == 1 and llm.RESPONSE_CACHE.hits == 1
+    # cambia el payload (contexto o modelo) -> otra clave
+    llm.request_plan("pizza", {"filters": {}})
+    monkeypatch.setattr(llm, "DEFAULT_MODEL", "otro-modelo")
+    llm.request_plan("pizza", context)
+    assert len(calls) == 3
+    assert llm.RESPONSE_CACHE.stats()["size"] == 2  # tope de entradas
+
+    now[0] += 61
+    monkeypatch.setattr(llm, "DEFAULT_MODEL", calls[0])
+    llm.request_plan("pizza", context)
+    assert len(calls) == 4  # vencida por TTL
@@ -1,5 +1,17 @@
 
-from app.server.search import search
+import json, re
+
+import numpy as np
+import pytest
+
+from app.server import catalog, columnar, parser, snapshot
+from app.server import search as search_mod
+from app.server.cache import LRUCache, canonical_hash
+from app.server.scoring import ColumnarScorer
+from app.server.search import (
+    BASE_WEIGHTS, _lex_text, _norm_str, apply_filters, dish_ingredients, expand_ingredients,
+    filter_candidates, lex_scores, search,
+)
 from app.server.parser import parse
 
 def test_structured_pipeline():
@@ -17,3 +29,376 @@ def test_ultra_barato_gluten_free_grande():
     # precio bajo segun percentil aproximado y gluten free
     for r in s["results"][:20]:
         assert "gluten" not in r["item"]["allergens"]
+
+def test_filter_index_matches_linear_scan():
+    texts = [
+        "vegetariano",
+        "sin nueces",
+        "pasta barata sin espinaca",
+        "sushi en Belgrano",
+        "ensalada con tomate y queso sin cebolla",
+        "algo rapido para almorzar",
+        "tengo una cita romántica en Palermo",
+    ]
+    for text in texts:
+        filters = parse(text)["query"]["filters"]
+        expected = [d.pos for d in search_mod.CATALOG.records() if apply_filters(d, filters)[0]]
+        assert filter_candidates(filters) == expected, text
+
+def test_precomputed_dish_ingredients_match_expansion():
+    for d in search_mod.CATALOG.records()[:200]:
+        assert search_mod.DISH_INGREDIENTS[d.pos] == expand_ingredients(d.ingredients)
+        assert dish_ingredients(d) is search_mod.DISH_INGREDIENTS[d.pos]
+
+def test_dish_records_share_restaurants_and_match_dicts():
+    records = search_mod.CATALOG.records()
+    by_name = {}
+    for d in records[:500]:
+        item = search_mod.CATALOG[d.pos]
+        assert (d.id, d.price_ars, d.rating, d.eta_min) == (
+            item["id"], item["price_ars"], item["restaurant"]["rating"], item["restaurant"]["eta_min"]
+        )
+        assert d.categories == tuple(item["categories"]) and d.diets == {k for k, on in item["diet_flags"].items() if on}
+        assert by_name.setdefault(d.restaurant.name, d.restaurant) is d.restaurant
+    assert not hasattr(records[0], "__dict__")
+
+# Referencias por plato del scoring: la versión columnar de search tiene que dar
+# exactamente los mismos scores y razones
+
+def _norm(val, vmin, vmax):
+    if vmax == vmin:
+        return 0.0
+    return max(0.0, min(1.0, (val - vmin) / (vmax - vmin)))
+
+def _reference_lex_score(q, dish, filters):
+    qn = _norm_str(q)
+    q_words = set(re.findall(r"\w+", qn))
+    if not q_words:
+        return 0.0
+    base_words = _lex_text(dish.dish_name, dish.description, dish.synonyms, dish.ingredients, dish.restaurant.name)
+    score = len(q_words & base_words) / len(q_words)
+    rn = _norm_str(dish.restaurant.name)
+    cat_filter = set((filters or {}).get("category_any") or [])
+    if rn and rn in qn and (not cat_filter or any(c in dish.categories for c in cat_filter)):
+        score = min(1.0, score + 0.4)
+    return score
+
+def _reference_score(d, f, q):
+    weights = dict(BASE_WEIGHTS)
+    weights.update(q.get("weights", {}))
+    weights.update((q.get("ranking_overrides") or {}).get("weights", {}))
+    idx = search_mod.IDX
+    rating_n = _norm(d.rating, idx["rating_min"], idx["rating_max"])
+    price_n = _norm(d.price_ars, idx["price_min"], idx["price_max"])
+    eta_n = _norm(d.eta_min, idx["eta_min"], idx["eta_max"])
+    pop_n = d.popularity / 100.0
+    nhs = f.get("neighborhood_any") or []
+    dist_n = (1.0 if d.restaurant.neighborhood in nhs else 0.0) if nhs else 0.5
+    lex_n = _reference_lex_score(q.get("q", ""), d, f)
+    promo_n = _norm(d.discount_pct, idx["discount_min"], idx["discount_max"])
+    fee = idx["fee_max"] if d.delivery_fee is None else d.delivery_fee
+    fee_n = _norm(fee, idx["fee_min"], idx["fee_max"])
+    score = (
+        weights["rating"] * rating_n +
+        weights["price"] * (1 - price_n) +
+        weights["eta"]   * (1 - eta_n) +
+        weights["pop"]   * pop_n +
+        weights["dist"]  * dist_n +
+        weights["lex"]   * lex_n +
+        weights["promo"] * promo_n +
+        weights["fee"]   * (1 - fee_n)
+    )
+    reasons = [
+        f"rating:{rating_n:.2f}", f"price_inv:{1-price_n:.2f}", f"eta_inv:{1-eta_n:.2f}", f"pop:{pop_n:.2f}",
+        f"dist:{dist_n:.2f}", f"lex:{lex_n:.2f}", f"promo:{promo_n:.2f}", f"fee_inv:{1-fee_n:.2f}",
+    ]
+    if d.restaurant.name in set((q.get("metadata") or {}).get("restaurant_hits") or []):
+        score += 0.4
+        reasons.append("rest_hit")
+    ro = q.get("ranking_overrides") or {}
+    tags = {*d.health_tags, *d.categories, *d.experience_tags, d.restaurant.cuisines.lower()}
+    if any(b in tags for b in ro.get("boost_tags") or []):
+        score *= 1.10
+        reasons.append("boost")
+    if any(p in tags for p in ro.get("penalize_tags") or []):
+        score *= 0.85
+        reasons.append("penal")
+    return score, reasons
+
+def test_columnar_scoring_matches_reference_score():
+    for text in ["pasta con buen rating", "no me caiga pesado", "sushi en Belgrano", "porcion grande barata"]:
+        pq = parse(text)
+        query = pq["query"]
+        filters = query["filters"]
+        expected = []
+        for pos in filter_candidates(filters):
+            score, reasons = _reference_score(search_mod.CATALOG.record(pos), filters, query)
+            expected.append({"item": search_mod.CATALOG[pos], "score": score, "reasons": reasons})
+        expected.sort(key=lambda x: x["score"], reverse=True)
+        got = search(pq)["results"]
+        assert [r["item"]["id"] for r in got] == [r["item"]["id"] for r in expected], text
+        assert [r["score"] for r in got] == [r["score"] for r in expected], text
+        assert [r["reasons"] for r in got] == [r["reasons"] for r in expected], text
+
+def test_pagination_matches_full_ranking():
+    pq = parse("almuerzo")
+    full = search(pq)
+    ids = [r["item"]["id"] for r in full["results"]]
+    assert full["total"] == len(ids)
+    page = search({**pq, "limit": 10, "offset": 5})
+    assert page["total"] == full["total"]
+    assert [r["item"]["id"] for r in page["results"]] == ids[5:15]
+    assert [r["score"] for r in page["results"]] == [r["score"] for r in full["results"][5:15]]
+    beyond = search({**pq, "limit": 10, "offset": full["total"]})
+    assert beyond["results"] == [] and beyond["total"] == full["total"]
+
+def test_explain_mode_reports_components():
+    pq = parse("pasta con buen rating")
+    plain = search({**pq, "limit": 5})
+    assert all("explanation" not in r for r in plain["results"])
+    explained = search({**pq, "limit": 5, "explain": True})
+    assert [r["reasons"] for r in explained["results"]] == [r["reasons"] for r in plain["results"]]
+    for r in explained["results"]:
+        exp = r["explanation"]
+        total = sum(exp["contributions"].values()) + (0.4 if exp["flags"]["rest_hit"] else 0.0)
+        if exp["flags"]["boost"]:
+            total *= 1.10
+        if exp["flags"]["penal"]:
+            total *= 0.85
+        assert abs(total - r["score"]) < 1e-9
+
+def test_lex_scores_match_per_dish_reference():
+    positions = np.arange(len(search_mod.CATALOG))
+    for q, filters in [
+        ("milanesa napolitana con papas", {}),
+        ("pizza en " + search_mod.CATALOG[0]["restaurant"]["name"], {}),
+        (search_mod.CATALOG[0]["restaurant"]["name"], {"category_any": ["sushi"]}),
+        ("", {}),
+    ]:
+        expected = [_reference_lex_score(q, d, filters) for d in search_mod.CATALOG.records()]
+        assert lex_scores(q, positions, filters).tolist() == expected
+
+def test_bm25_scorer_prunes_without_changing_top_k():
+    pq = parse("milanesa napolitana")
+    pq["query"]["ranking_overrides"]["lexical"] = "bm25"
+    full = search(pq)
+    assert full["plan"]["lexical_scorer"] == "bm25"
+    assert "milanesa" in full["results"][0]["item"]["dish_name"].lower()
+    page = search({**pq, "limit": 10})
+    assert page["total"] == full["total"]
+    assert [r["item"]["id"] for r in page["results"]] == [r["item"]["id"] for r in full["results"][:10]]
+
+def test_bm25_scores_only_unpruned_postings(monkeypatch):
+    scored = []
+    original = ColumnarScorer.score
+    monkeypatch.setattr(ColumnarScorer, "score", lambda self, positions, *a: scored.append(len(positions)) or original(self, positions, *a))
+    query = {"q": "con", "filters": {}, "ranking_overrides": {"lexical": "bm25"}}
+    positions, scores, _, total, _ = search_mod._rank(query, search_mod._effective_weights_snapshot(query), 10, 0, 10)
+    # texto puro: solo se puntúan los platos que sobreviven la poda, una sola vez
+    assert total > 1000 and sum(scored) < total / 10
+    scored.clear()
+    full = search_mod._rank(query, search_mod._effective_weights_snapshot(query), None, 0, 10)
+    assert full[0][:10].tolist() == positions.tolist() and sum(scored) == total
+
+def test_shared_snapshot_feeds_parser_and_search():
+    snap = snapshot.current()
+    assert search_mod.CATALOG is snap.catalog
+    assert parser.CATALOG_METRICS is snap.catalog_metrics
+    assert search_mod.IDX["prices_sorted"] is snap.catalog_metrics["prices"]
+    assert all("intent_tags" in d for d in snap.catalog)
+    with pytest.raises(catalog.CatalogError):
+        catalog.validate_catalog([{"id": "x", "dish_name": "sin restaurante"}])
+
+def test_reload_swaps_snapshot_atomically(tmp_path):
+    original_path = catalog.CATALOG_PATH
+    old = snapshot.current()
+    items = json.loads(original_path.read_text(encoding="utf-8"))
+    target = next(d for d in items if d.get("available", True))
+    target["dish_name"] = "Plato recargado único"
+    path = tmp_path / "catalog.json"
+    path.write_text(json.dumps(items), encoding="utf-8")
+    catalog.CATALOG_PATH = path
+    try:
+        with snapshot.pinned() as pinned:
+            new = snapshot.reload(force=False)
+            # una request en curso sigue viendo la versión que fijó al empezar
+            assert snapshot.current() is pinned is old
+        assert new.version == old.version + 1 and snapshot.current() is new
+        s = search({"query": {"q": "recargado", "filters": {}, "ranking_overrides": {"lexical": "bm25"}}})
+        assert [r["item"]["id"] for r in s["results"]] == [target["id"]]
+        assert snapshot.reload(force=False) is new  # sin cambios en disco no reconstruye
+
+        path.write_text('[{"id": "roto"}]', encoding="utf-8")
+        with pytest.raises(catalog.CatalogError):
+            snapshot.reload(force=True)
+        assert snapshot.current() is new and snapshot.LAST_ERROR
+    finally:
+        catalog.CATALOG_PATH = original_path
+        snapshot.reload(force=True)
+
+def test_item_deltas_match_full_rebuild(tmp_path):
+    original_path = catalog.CATALOG_PATH
+    old = snapshot.current()
+    items = json.loads(original_path.read_text(encoding="utf-8"))
+    cheapest = min(items, key=lambda d: d["price_ars"])
+    top_discount = max(items, key=lambda d: d.get("discount_pct", 0))
+    deltas = [
+        {"id": items[0]["id"], "available": True, "price_ars": 5000, "eta_min": 10},
+        {"id": items[1]["id"], "available": False, "discount_pct": 0},
+        {"id": cheapest["id"], "price_ars": cheapest["price_ars"] + 50000},  # mueve el mínimo y el máximo
+        {"id": top_discount["id"], "discount_pct": 1},
+        {"id": items[7]["id"], "eta_min": 90},
+    ]
+    by_id = {d["id"]: d for d in items}
+    for delta in deltas:
+        dish = by_id[delta["id"]]
+        for field in ("available", "price_ars", "discount_pct"):
+            if field in delta:
+                dish[field] = delta[field]
+        if "eta_min" in delta:
+            dish["restaurant"]["eta_min"] = delta["eta_min"]
+    path = tmp_path / "catalog.json"
+    path.write_text(json.dumps(items), encoding="utf-8")
+    try:
+        incremental = snapshot.apply_deltas(deltas)
+        catalog.CATALOG_PATH = path
+        full = snapshot.reload(force=True)
+
+        assert list(incremental.catalog) == list(full.catalog)
+        assert incremental.idx == full.idx
+        assert incremental.catalog_metrics == full.catalog_metrics
+        assert incremental.parser["catalog_metrics"] == full.parser["catalog_metrics"]
+        fi, ff = incremental.search["filter_index"], full.search["filter_index"]
+        for key in ("available", "price", "eta"):
+            assert np.array_equal(fi[key], ff[key])
+        assert {k: v.tolist() for k, v in fi["intent"].items() if len(v)} == {k: v.tolist() for k, v in ff["intent"].items() if len(v)}
+        for column in ("price_inv", "eta_inv", "promo_n"):
+            assert np.array_equal(getattr(incremental.search["scorer"], column), getattr(full.search["scorer"], column))
+        assert incremental.catalog_payload["body"] == full.catalog_payload["body"]
+        # el snapshot anterior no se modificó
+        originals = json.loads(original_path.read_text(encoding="utf-8"))
+        assert [d["price_ars"] for d in old.catalog] == [d["price_ars"] for d in originals]
+        assert [d["restaurant"]["eta_min"] for d in old.catalog] == [d["restaurant"]["eta_min"] for d in originals]
+        assert old.search["filter_index"]["price"].tolist() == [d["price_ars"] for d in originals]
+        assert old.catalog_metrics["prices"] == sorted(d["price_ars"] for d in originals)
+    finally:
+        catalog.CATALOG_PATH = original_path
+        snapshot.reload(force=True)
+
+def test_item_deltas_survive_reload():
+    dish = snapshot.current().catalog[5]
+    snapshot.apply_deltas([{"id": dish["id"], "price_ars": dish["price_ars"] + 777}])
+    snap = snapshot.reload(force=True)
+    assert snap.catalog[5]["price_ars"] == dish["price_ars"] + 777
+    assert snap.catalog.overridden == 1
+    # otro worker agrega al log: la próxima pasada del watcher lo aplica sin reconstruir
+    other = snap.catalog[6]
+    with snapshot._delta_log("a") as log:
+        source = list(catalog.file_signature(catalog.CATALOG_PATH))
+        log.write(json.dumps({"source": source, "deltas": [{"id": other["id"], "available": False}]}) + "\n")
+    caught_up = snapshot.reload(force=False)
+    assert caught_up.catalog[6]["available"] is False and caught_up.catalog[5]["price_ars"] == dish["price_ars"] + 777
+    assert caught_up.idx is not snap.idx and caught_up.dictionaries is snap.dictionaries
+
+def test_compact_deltas_folds_log_into_catalog(tmp_path):
+    original = catalog.CATALOG_PATH, catalog.COLUMNAR_PATH
+    path = tmp_path / "catalog.json"
+    path.write_text(original[0].read_text(encoding="utf-8"), encoding="utf-8")
+    catalog.CATALOG_PATH, catalog.COLUMNAR_PATH = path, tmp_path / "catalog.columns"
+    try:
+        dish = snapshot.reload(force=True).catalog[2]
+        snapshot.apply_deltas([{"id": dish["id"], "available": False, "eta_min": 70}])
+        snap = snapshot.compact_deltas()
+        assert snapshot._read_log(0, None)[0] == []
+        assert snap.catalog.overridden == 0
+        assert snap.catalog[2]["available"] is False and snap.catalog[2]["restaurant"]["eta_min"] == 70
+        saved = json.loads(path.read_text(encoding="utf-8"))[2]
+        assert saved["available"] is False and saved["restaurant"]["eta_min"] == 70
+    finally:
+        catalog.CATALOG_PATH, catalog.COLUMNAR_PATH = original
+        snapshot.reload(force=True)
+
+def test_stale_worker_reloads_after_compaction(tmp_path):
+    original = catalog.CATALOG_PATH, catalog.COLUMNAR_PATH
+    path = tmp_path / "catalog.json"
+    path.write_text(original[0].read_text(encoding="utf-8"), encoding="utf-8")
+    catalog.CATALOG_PATH, catalog.COLUMNAR_PATH = path, tmp_path / "catalog.columns"
+    try:
+        dishes = snapshot.reload(force=True).catalog[:4]
+        stale = snapshot.apply_deltas([{"id": dishes[0]["id"], "price_ars": 1234}])
+        snapshot.compact_deltas()
+        # otro worker escribe sobre el log nuevo más allá del offset del snapshot viejo
+        with snapshot._delta_log("a") as log:
+            source = list(catalog.file_signature(path))
+            deltas = [{"id": d["id"], "discount_pct": 7} for d in dishes[1:3]]
+            log.write(json.dumps({"source": source, "deltas": deltas}) + "\n")
+        assert catalog.DELTA_LOG_PATH.stat().st_size > stale.delta_offset
+        snapshot._CURRENT = stale  # este worker todavía no vio la compactación
+        snap = snapshot.apply_deltas([{"id": dishes[3]["id"], "available": False}])
+        assert snap.catalog[0]["price_ars"] == 1234
+        assert [d["discount_pct"] for d in snap.catalog[1:3]] == [7, 7]
+        assert snap.catalog[3]["available"] is False
+        assert snap.catalog.overridden == 3
+    finally:
+        catalog.CATALOG_PATH, catalog.COLUMNAR_PATH = original
+        snapshot.reload(force=True)
+
+def test_columnar_file_matches_json_catalog(tmp_path):
+    original_path = catalog.COLUMNAR_PATH
+    path = tmp_path / "catalog.columns"
+    columnar.build(dest=path)
+    loaded = columnar.load_for(path=path)
+    items = catalog.load_catalog()
+    catalog.augment_catalog_intents(items)
+    assert list(loaded) == items
+    # columnas numéricas: vistas de solo lectura sobre el archivo mapeado, sin copia
+    prices = loaded.column("price_ars")
+    assert not prices.flags.owndata and not prices.flags.writeable
+    query = {"query": {"q": "pizza barata en Palermo", "filters": {"diet_must": ["veg"]}}}
+    expected = search(query)["results"]
+    catalog.COLUMNAR_PATH = path
+    try:
+        snap = snapshot.reload(force=True)
+        assert isinstance(snap.catalog._buffer, columnar.mmap.mmap)
+        assert search(query)["results"] == expected
+        # si catalog.json cambia, el archivo compilado queda viejo y se ignora
+        edited = tmp_path / "catalog.json"
+        edited.write_text(json.dumps(items[:10]), encoding="utf-8")
+        assert columnar.load_for(src=edited, path=path) is None
+    finally:
+        catalog.COLUMNAR_PATH = original_path
+        snapshot.reload(force=True)
+
+def test_result_cache_reuses_ranking_until_version_changes():
+    assert canonical_hash({"a": ["x", "y"], "b": 1}) == canonical_hash({"b": 1, "a": ["y", "x"]})
+    search_mod.RESULT_CACHE.clear()
+    query = {"q": "pizza", "filters": {"category_any": ["pizza", "pastas"], "diet_must": []}}
+    reordered = {"q": "pizza", "filters": {"diet_must": [], "category_any": ["pastas", "pizza"]}}
+    first = search({"query": query, "limit": 10})
+    hits = search_mod.RESULT_CACHE.hits
+    second = search({"query": reordered, "limit": 10})
+    assert search_mod.RESULT_CACHE.hits == hits + 1
+    assert second["results"] == first["results"] and second["total"] == first["total"]
+    # se guardan posiciones y scores, no platos: cada respuesta trae dicts nuevos
+    assert second["results"][0]["item"] is not first["results"][0]["item"]
+    target = first["results"][0]["item"]
+    try:
+        snapshot.apply_deltas([{"id": target["id"], "available": False}])
+        misses = search_mod.RESULT_CACHE.misses
+        third = search({"query": query, "limit": 10})
+        assert search_mod.RESULT_CACHE.misses == misses + 1
+        assert target["id"] not in [r["item"]["id"] for r in third["results"]]
+    finally:
+        snapshot.reload(force=True)
+
+def test_lru_cache_evicts_by_size_and_ttl():
+    now = [0.0]
+    cache = LRUCache(maxsize=2, ttl=10, clock=lambda: now[0])
+    cache.put("a", 1)
+    cache.put("b", 2)
+    assert cache.get("a") == 1
+    cache.put("c", 3)  # desaloja "b", el menos usado
+    assert cache.get("b") is None and cache.get("c") == 3
+    now[0] = 11
+    assert cache.get("a") is None
+    assert cache.stats()["hits"] == 2 and cache.stats()["evictions"] == 1
@@ -3,6 +3,7 @@ import { CATEGORIES, INGREDIENTS, DIETS, ALLERGENS, HEALTH } from "./data/dictio
 
 const APP_VERSION = "v3.0.0";
 const BACKEND_TIMEOUT_MS = 8000;
+const BACKEND_PAGE_SIZE = 60;
 let backendAvailable = null;
 
 const FORCE_BACKEND = typeof window !== "undefined" && window.ENABLE_BACKEND === true;
@@ -104,8 +105,52 @@ function showBackendError(err) {
   statusBanner.classList.add("visible", "error");
 }
 
-const parseViaBackend = (text) => callBackend("/parse", { text });
-const searchViaBackend = (query) => callBackend("/search", { query });
+// /query interpreta y busca en un solo viaje; `parsed` se pide para los paneles de depuración
+const queryViaBackend = (text) => callBackend("/query", { text, limit: BACKEND_PAGE_SIZE, include_parse: true });
+
+// GET /search/stream (server-sent events): primero resultados con reglas locales y, cuando
+// responde el LLM, los refinados. Se descartan eventos con versión vieja; devuelve el final.
+async function streamViaBackend(text, onEvent) {
+  const params = new URLSearchParams({ text, limit: String(BACKEND_PAGE_SIZE) });
+  const path = `/search/stream?${params}`;
+  const url = API_BASE ? `${API_BASE}${path}` : path;
+  const controller = new AbortController();
+  // Timeout hasta el primer resultado: el refinado con IA puede tardar más y no se corta
+  const timer = setTimeout(() => controller.abort(), BACKEND_TIMEOUT_MS);
+  try {
+    const response = await fetch(url, { headers: { Accept: "text/event-stream" }, signal: controller.signal });
+    if (!response.ok || !response.body) throw new Error(`HTTP ${response.status}`);
+    backendAvailable = true;
+    const reader = response.body.pipeThrough(new TextDecoderStream()).getReader();
+    let buffer = "";
+    let last = null;
+    for (;;) {
+      const { value, done } = await reader.read();
+      if (done) break;
+      buffer += value;
+      let cut;
+      while ((cut = buffer.indexOf("\n\n")) >= 0) {
+        const block = buffer.slice(0, cut);
+        buffer = buffer.slice(cut + 2);
+        const data = block
+          .split("\n")
+          .filter((line) => line.startsWith("data: "))
+          .map((line) => line.slice(6))
+          .join("\n");
+        if (!data) continue;
+        const event = JSON.parse(data);
+        clearTimeout(timer);
+        if (last && event.version <= last.version) continue;
+        last = event;
+        onEvent(event);
+      }
+    }
+    if (!last?.final) throw new Error("Stream de búsqueda incompleto");
+    return last;
+  } finally {
+    clearTimeout(timer);
+  }
+}
 
 function resolveStrategies(source) {
   if (!source) return [];
@@ -140,6 +185,12 @@ function buildStatusMessage(parseStatus, searchPlan) {
       case "error":
         lines.push(`LLM no disponible (${provider}): ${llmInfo.message || "se usó modo fallback."}`);
         break;
+      case "pending":
+        lines.push(`LLM (${provider}) pensando: se muestran resultados con reglas locales mientras tanto.`);
+        break;
+      case "timeout":
+        lines.push(`LLM (${provider}) demoró más de lo previsto: ${llmInfo.message || "se usaron reglas locales."}`);
+        break;
       case "no_data":
         lines.push(`LLM (${provider}) sin respuesta útil. Se mantienen filtros locales.`);
         break;
@@ -229,6 +280,10 @@ function renderAdvisor(box, headlineEl, detailsEl, notesEl, statusEl, summary, n
         return "IA desactivada: usando reglas locales.";
       case "error":
         return `IA sin conexión: ${llmStatus.message || "se usan reglas locales."}`;
+      case "pending":
+        return "IA pensando: resultados locales por ahora.";
+      case "timeout":
+        return "IA demorada: se usan reglas locales.";
       case "no_data":
         return "IA sin respuesta útil: se mantienen reglas locales.";
       default:
@@ -1564,30 +1619,8 @@ async function runSearch(trigger = "user") {
     }
     btn.disabled = true;
     results.innerHTML = "<p>Buscando resultados...</p>";
-    try {
-      let parsed;
-      let usedBackend = false;
-      if (shouldUseBackend()) {
-        try {
-          parsed = await parseViaBackend(text);
-          usedBackend = true;
-        } catch (backendErr) {
-          console.warn("Fallo parser backend; se usa fallback local.", backendErr);
-          backendAvailable = false;
-          showBackendError(backendErr);
-          parsed = parseText(text);
-          if (!Array.isArray(parsed.plan)) parsed.plan = [];
-          parsed.plan.push(`❌ Backend parse: ${backendErr?.message ?? backendErr}`);
-        }
-      }
-      if (!parsed) {
-        parsed = parseText(text);
-        if (!Array.isArray(parsed.plan)) parsed.plan = [];
-        if (backendAvailable === false) {
-          parsed.plan.push("Backend no disponible: se usó el parser local.");
-        }
-      }
 
+    const showParsed = (parsed) => {
       structuredEl.textContent = JSON.stringify(parsed.query, null, 2);
       planEl.textContent = JSON.stringify(parsed.plan, null, 2);
       renderLLMDebug(
@@ -1600,30 +1633,9 @@ async function runSearch(trigger = "user") {
         parsed.status,
         parsed.query
       );
+    };
 
-      let searched;
-      if (usedBackend) {
-        try {
-          searched = await searchViaBackend(parsed.query);
-        } catch (backendErr) {
-          console.warn("Fallo búsqueda backend; se usa ranking local.", backendErr);
-          backendAvailable = false;
-          showBackendError(backendErr);
-          searched = searchCatalog(parsed.query);
-          searched.plan = searched.plan || {};
-          searched.plan.backend_warning =
-            `Backend no disponible en este momento. Se muestran resultados locales. (${backendErr?.message ?? backendErr})`;
-        }
-      }
-      if (!searched) {
-        searched = searchCatalog(parsed.query);
-        searched.plan = searched.plan || {};
-        if (backendAvailable === false) {
-          searched.plan.backend_warning =
-            "Backend no disponible en este momento. Se muestran resultados locales.";
-        }
-      }
-
+    const showSearched = (parsed, searched) => {
       if (!searched.plan) searched.plan = {};
       if (!searched.plan.llm_status && parsed.status?.llm) {
         searched.plan.llm_status = parsed.status.llm;
@@ -1645,6 +1657,60 @@ async function runSearch(trigger = "user") {
         llmStatus
       );
       updateStatusBanner(statusBanner, parsed.status, searched.plan);
+    };
+
+    try {
+      let parsed;
+      if (shouldUseBackend()) {
+        // Si ya se mostraron los resultados locales del stream, un corte posterior los deja en pantalla
+        let streamed = false;
+        try {
+          await streamViaBackend(text, (event) => {
+            streamed = true;
+            showParsed(event.parsed);
+            showSearched(event.parsed, event.search);
+          });
+          return;
+        } catch (streamErr) {
+          if (streamed) return;
+          console.warn("Fallo stream backend; se usa /query.", streamErr);
+        }
+      }
+      let searched;
+      if (shouldUseBackend()) {
+        try {
+          const { parsed: backendParsed, ...backendSearched } = await queryViaBackend(text);
+          parsed = backendParsed;
+          searched = backendSearched;
+        } catch (backendErr) {
+          console.warn("Fallo backend; se usan parser y ranking locales.", backendErr);
+          backendAvailable = false;
+          showBackendError(backendErr);
+          parsed = parseText(text);
+          if (!Array.isArray(parsed.plan)) parsed.plan = [];
+          parsed.plan.push(`❌ Backend parse: ${backendErr?.message ?? backendErr}`);
+        }
+      }
+      if (!parsed) {
+        parsed = parseText(text);
+        if (!Array.isArray(parsed.plan)) parsed.plan = [];
+        if (backendAvailable === false) {
+          parsed.plan.push("Backend no disponible: se usó el parser local.");
+        }
+      }
+
+      showParsed(parsed);
+
+      if (!searched) {
+        searched = searchCatalog(parsed.query);
+        searched.plan = searched.plan || {};
+        if (backendAvailable === false) {
+          searched.plan.backend_warning =
+            "Backend no disponible en este momento. Se muestran resultados locales.";
+        }
+      }
+
+      showSearched(parsed, searched);
     } catch (err) {
       console.error("Error al buscar", err);
       const errorDetails = {